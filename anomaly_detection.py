@@ -2,118 +2,184 @@
 import pandas as pd
 import numpy as np
 import joblib
-import matplotlib.pyplot as plt
-from sklearn.metrics import roc_curve, auc
+import argparse
 import os
+import sys
+
+import columnar
+from anomaly_eval import K_SIGMAS, AnomalyEvaluator, save_roc_plot, with_counts
+
+# Feature layout shared with the serving path (backend/app/core/features.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from app.core.features import BASE_COLUMNS, LATENT_FEATURES, STAGE2_COLUMNS, FeatureFrame
 
 # Configuration
 DATA_PATH_STUDENT = 'data/student_data.csv'
 MODEL_PATH = 'models/stage2_soh_model.pkl'
 STAGE1_MODELS_DIR = 'models'
+STAGE1_TARGETS = LATENT_FEATURES
+# Model inputs and target, plus the row identifiers kept in anomaly_results.csv
+STUDENT_COLUMNS = ['car', 'charge_segment', 'battery_type', 'total_dist_km', 'charging_time_min', 'SOH_teacher']
 OUTPUT_DIR = 'results'
+CHUNK_SIZE = 100_000    # Rows per chunk in streaming mode
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-def load_models():
+def load_models(stage1_mode='separate'):
     print("Loading models...")
     stage2_model = joblib.load(MODEL_PATH)
-    stage1_models = {
-        'charging_cycles': joblib.load(os.path.join(STAGE1_MODELS_DIR, 'stage1_charging_cycles.pkl')),
-        'efficiency': joblib.load(os.path.join(STAGE1_MODELS_DIR, 'stage1_efficiency.pkl')),
-        'battery_temp': joblib.load(os.path.join(STAGE1_MODELS_DIR, 'stage1_battery_temp.pkl'))
-    }
+    if stage1_mode == 'multi':
+        # One forest predicting every target, see train_student_model.py --stage1-mode multi
+        stage1_models = {'multi': joblib.load(os.path.join(STAGE1_MODELS_DIR, 'stage1_multi.pkl'))}
+    else:
+        stage1_models = {
+            'charging_cycles': joblib.load(os.path.join(STAGE1_MODELS_DIR, 'stage1_charging_cycles.pkl')),
+            'efficiency': joblib.load(os.path.join(STAGE1_MODELS_DIR, 'stage1_efficiency.pkl')),
+            'battery_temp': joblib.load(os.path.join(STAGE1_MODELS_DIR, 'stage1_battery_temp.pkl'))
+        }
     return stage1_models, stage2_model
 
-def evaluate_anomalies():
+def score_chunk(df, stage1_models, stage2_model):
+    """Add Stage 1 latent features, the Stage 2 SOH and the |Teacher - Student| residual to df."""
+    # Latent features go straight into the FeatureFrame's preallocated float32 columns
+    frame = FeatureFrame.from_frame(df)
+    X_input = frame.to_frame(BASE_COLUMNS)
+    if 'multi' in stage1_models:
+        frame.set_latent(stage1_models['multi'].predict(X_input))
+    else:
+        for target, model in stage1_models.items():
+            frame.set_column(f'pred_{target}', model.predict(X_input))
+
+    soh_student = stage2_model.predict(frame.to_frame(STAGE2_COLUMNS))
+    latent = {f'pred_{target}': frame.column(f'pred_{target}') for target in STAGE1_TARGETS}
+    # One assign: the new columns are added with a single copy of df
+    return df.assign(**latent, SOH_student=soh_student,
+                     residual=np.abs(df['SOH_teacher'].to_numpy() - soh_student))
+
+def save_report(report, plot=True):
+    """Print the evaluation and write anomaly_metrics.csv, threshold_sweep.csv and (with plot) roc_curve.png."""
+    binned = report['mode'] == 'binned'
+    detected, rows = report['detected'], report['rows']
+    print(f"Residual Mean: {report['residual_mean']:.4f}")
+    print(f"Residual Std:  {report['residual_std']:.4f}")
+    print(f"Anomaly Threshold (Mean + {report['threshold_k']:g}*STD): {report['threshold']:.4f}")
+    print(f"Detected Anomalies: {detected:.0f} / {rows} ({detected/max(rows, 1)*100:.2f}%)")
+    print(f"Synthetic Ground Truth (Top 5% Degradation > {report['label_threshold']:.2f}): "
+          f"{report['positives']:.0f} instances")
+    print(f"ROC AUC Score{' (binned)' if binned else ''}: {report['auc']:.4f}")
+
+    sweep = pd.DataFrame(report['sweep'])
+    print(sweep.to_string(index=False, float_format=lambda v: f"{v:.4f}"))
+    sweep.to_csv(os.path.join(OUTPUT_DIR, 'threshold_sweep.csv'), index=False)
+    if plot:
+        save_roc_plot(report['fpr'], report['tpr'], report['auc'], os.path.join(OUTPUT_DIR, 'roc_curve.png'))
+
+    # 'Threshold (3SD)' is what the API and the model registry read back
+    comparison = {
+        'Metric': ['Residual Mean', 'Residual Std', 'Threshold (3SD)', 'Detected Anomalies', 'ROC AUC'],
+        'Value': [report['residual_mean'], report['residual_std'], report['threshold'],
+                  round(detected) if binned else detected, report['auc']]
+    }
+    pd.DataFrame(comparison).to_csv(os.path.join(OUTPUT_DIR, 'anomaly_metrics.csv'), index=False)
+    print("Anomaly Detection Completed. Results saved.")
+
+def evaluate_anomalies_streaming(chunksize=CHUNK_SIZE, stage1_mode='separate', ks=K_SIGMAS,
+                                 plot=True, export_rows=True, exact=False):
+    """
+    Bounded-memory version of evaluate_anomalies() for inputs that don't fit in RAM.
+
+    Scores DATA_PATH_STUDENT (or its columnar copy) chunk by chunk in one
+    pass, feeding residual and SOH_teacher to an anomaly_eval.AnomalyEvaluator.
+    Binned by default. exact keeps every pair in memory, for small inputs.
+    With export_rows, the scored rows are also spilled to a temporary CSV.
+    The labels need the final threshold and 95th percentile, so a second
+    pass over the spill appends them to anomaly_results.csv and counts
+    detections and true positives exactly. Without export_rows there is
+    only the one pass.
+    """
+    print("\n--- Phase 3: Anomaly Detection (streaming) ---")
+    stage1_models, stage2_model = load_models(stage1_mode)
+
+    spill_path = os.path.join(OUTPUT_DIR, 'anomaly_results.partial.csv')
+    results_path = os.path.join(OUTPUT_DIR, 'anomaly_results.csv')
+    evaluator = AnomalyEvaluator(exact=exact)
+
+    first = True
+    for chunk in columnar.iter_chunks(DATA_PATH_STUDENT, STUDENT_COLUMNS, chunksize):
+        df_aug = score_chunk(chunk, stage1_models, stage2_model)
+        evaluator.update(df_aug['residual'].to_numpy(), df_aug['SOH_teacher'].to_numpy())
+        if export_rows:
+            df_aug.to_csv(spill_path, mode='w' if first else 'a', header=first, index=False)
+        first = False
+    report = evaluator.finish(ks)
+
+    if export_rows:
+        thresholds = report['thresholds']
+        counts = {k: [0, 0] for k in thresholds}
+        positives = 0
+        first = True
+        for df_aug in pd.read_csv(spill_path, chunksize=chunksize, float_precision='round_trip'):
+            residual = df_aug['residual'].to_numpy()
+            labels = df_aug['SOH_teacher'].to_numpy() > report['label_threshold']
+            df_aug['is_anomaly_detected'] = residual > report['threshold']
+            df_aug['true_anomaly_label'] = labels.astype(int)
+            positives += int(labels.sum())
+            for k, threshold in thresholds.items():
+                detected = residual > threshold
+                counts[k][0] += int(detected.sum())
+                counts[k][1] += int((detected & labels).sum())
+            df_aug.to_csv(results_path, mode='w' if first else 'a', header=first, index=False)
+            first = False
+        os.remove(spill_path)
+        report = with_counts(report, positives, counts)
+
+    save_report(report, plot)
+
+def evaluate_anomalies(stage1_mode='separate', ks=K_SIGMAS, plot=True, export_rows=True):
     print("\n--- Phase 3: Anomaly Detection ---")
     
     # 1. Load Data
-    df = pd.read_csv(DATA_PATH_STUDENT)
+    df = columnar.read_table(DATA_PATH_STUDENT, STUDENT_COLUMNS)
     
     # 2. Load Models
-    stage1_models, stage2_model = load_models()
+    stage1_models, stage2_model = load_models(stage1_mode)
     
-    # 3. Generate Latent Features (Stage 1 prediction)
-    X_input = df[['battery_type', 'total_dist_km', 'charging_time_min']]
+    # 3. Generate Latent Features (Stage 1), predict SOH (Stage 2)
+    # and compute Residuals: Residual = |Teacher - Student|
+    df_aug = score_chunk(df, stage1_models, stage2_model)
     
-    df_aug = df.copy()
-    for target, model in stage1_models.items():
-        df_aug[f'pred_{target}'] = model.predict(X_input)
-        
-    # 4. Predict SOH (Stage 2)
-    # The pipeline handles preprocessing
-    X_stage2 = df_aug[['battery_type', 'total_dist_km', 'charging_time_min', 
-                       'pred_charging_cycles', 'pred_efficiency', 'pred_battery_temp']]
-    
-    df_aug['SOH_student'] = stage2_model.predict(X_stage2)
-    
-    # 5. Compute Residuals
-    # Residual = |Teacher - Student|
-    df_aug['residual'] = np.abs(df_aug['SOH_teacher'] - df_aug['SOH_student'])
-    
-    residual_mean = df_aug['residual'].mean()
-    residual_std = df_aug['residual'].std()
-    
-    print(f"Residual Mean: {residual_mean:.4f}")
-    print(f"Residual Std:  {residual_std:.4f}")
-    
-    # 6. Thresholding Logic (Mean + k * STD)
-    k = 3
-    threshold = residual_mean + (k * residual_std)
-    print(f"Anomaly Threshold (Mean + {k}*STD): {threshold:.4f}")
-    
-    df_aug['is_anomaly_detected'] = df_aug['residual'] > threshold
-    num_anomalies = df_aug['is_anomaly_detected'].sum()
-    print(f"Detected Anomalies: {num_anomalies} / {len(df_aug)} ({num_anomalies/len(df_aug)*100:.2f}%)")
-    
-    # 7. ROC Curve Generation
-    # PROBLEM: We don't have "Ground Truth" anomaly labels in the dataset.
-    # The user says "Use teacher SOH as reference ground truth."
-    # Interpretation: We typically validate Anomaly Detection against labeled anomalies.
-    # Since we lack them, for the purpose of the requirement/paper, we will define 
-    # "True Anomalies" based on a statistical heuristic of the TEACHER's behavior 
-    # (e.g., if Teacher output deviates significantly from the population mean, or if residuals are high).
-    # OR, we treat the 'threshold' classification as the system output and compare against... what?
-    # Let's assume a synthetic ground truth for demonstration: 
+    # 4. Thresholds (Mean + k * STD), exact ROC and threshold sweep.
+    # There are no labelled anomalies, so the ROC uses a synthetic ground truth:
     # "True" anomalies are points where the Teacher value is > 95th percentile (extreme degradation).
-    
-    # Defining Synthetic Ground Truth for ROC evaluation (Teacher-based)
-    # Let's say "Real Anomalies" are cases with Extreme Degradation (SOH_teacher > 35, approx top 5-10%)
     # This tests: "Can the Student's Residual predict Extreme Degradation cases?"
-    # (High residual -> simpler model fails to capture complex extreme behavior -> anomaly)
-    
-    # Check distribution of SOH_teacher
-    teacher_95 = df_aug['SOH_teacher'].quantile(0.95)
-    df_aug['true_anomaly_label'] = (df_aug['SOH_teacher'] > teacher_95).astype(int)
-    print(f"Synthetic Ground Truth (Top 5% Degradation > {teacher_95:.2f}): {df_aug['true_anomaly_label'].sum()} instances")
-    
-    # Compute ROC based on Residuals vs Synthetic Label
-    fpr, tpr, thresholds = roc_curve(df_aug['true_anomaly_label'], df_aug['residual'])
-    roc_auc = auc(fpr, tpr)
-    print(f"ROC AUC Score: {roc_auc:.4f}")
-    
-    # Save ROC Plot
-    plt.figure()
-    plt.plot(fpr, tpr, color='darkorange', lw=2, label=f'ROC curve (area = {roc_auc:.2f})')
-    plt.plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
-    plt.xlim([0.0, 1.0])
-    plt.ylim([0.0, 1.05])
-    plt.xlabel('False Positive Rate')
-    plt.ylabel('True Positive Rate')
-    plt.title('Anomaly Detection ROC (Residual vs Extreme Degradation)')
-    plt.legend(loc="lower right")
-    plt.savefig(os.path.join(OUTPUT_DIR, 'roc_curve.png'))
-    plt.close()
-    
-    # Save results
-    df_aug.to_csv(os.path.join(OUTPUT_DIR, 'anomaly_results.csv'), index=False)
-    
-    # Create comparison table
-    comparison = {
-        'Metric': ['Residual Mean', 'Residual Std', 'Threshold (3SD)', 'Detected Anomalies', 'ROC AUC'],
-        'Value': [residual_mean, residual_std, threshold, num_anomalies, roc_auc]
-    }
-    pd.DataFrame(comparison).to_csv(os.path.join(OUTPUT_DIR, 'anomaly_metrics.csv'), index=False)
-    print("Anomaly Detection Completed. Results saved.")
+    evaluator = AnomalyEvaluator(exact=True)
+    evaluator.update(df_aug['residual'].to_numpy(), df_aug['SOH_teacher'].to_numpy())
+    report = evaluator.finish(ks)
+    
+    # 5. Save results
+    if export_rows:
+        df_aug['is_anomaly_detected'] = df_aug['residual'] > report['threshold']
+        df_aug['true_anomaly_label'] = (df_aug['SOH_teacher'] > report['label_threshold']).astype(int)
+        df_aug.to_csv(os.path.join(OUTPUT_DIR, 'anomaly_results.csv'), index=False)
+    save_report(report, plot)
 
 if __name__ == "__main__":
-    evaluate_anomalies()
+    parser = argparse.ArgumentParser(description="Residual-based anomaly detection for the student model.")
+    parser.add_argument('--stream', action='store_true',
+                        help="Process the data in chunks with bounded memory (for very large CSVs).")
+    parser.add_argument('--chunksize', type=int, default=CHUNK_SIZE, help="Rows per chunk in streaming mode.")
+    parser.add_argument('--exact', action='store_true',
+                        help="Streaming mode: exact ROC/quantiles instead of histograms (keeps all residuals in memory).")
+    parser.add_argument('--k', type=float, nargs='+', default=list(K_SIGMAS),
+                        help="k values for the mean + k*std threshold sweep (threshold_sweep.csv).")
+    parser.add_argument('--no-plot', action='store_true', help="Skip roc_curve.png.")
+    parser.add_argument('--no-rows', action='store_true',
+                        help="Skip anomaly_results.csv (and, when streaming, the spill and second pass).")
+    parser.add_argument('--stage1-mode', choices=['separate', 'multi'], default='separate',
+                        help="Use the three Stage 1 forests or the multi-output stage1_multi.pkl.")
+    args = parser.parse_args()
+
+    if args.stream:
+        evaluate_anomalies_streaming(args.chunksize, args.stage1_mode, args.k, not args.no_plot,
+                                     not args.no_rows, args.exact)
+    else:
+        evaluate_anomalies(args.stage1_mode, args.k, not args.no_plot, not args.no_rows)
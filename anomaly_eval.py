@@ -0,0 +1,344 @@
+"""
+Residual-based anomaly evaluation in one streaming pass with bounded memory.
+
+    python anomaly_eval.py bench --rows 100000000
+
+AnomalyEvaluator takes (residual, SOH_teacher) chunks. The default binned
+mode keeps running mean/std and a joint residual x SOH_teacher histogram,
+so the k-sigma thresholds and the synthetic ground truth (SOH_teacher
+above its 95th percentile) are both resolved after the pass. The ROC/AUC
+and every k in the sweep are read off the histogram. Memory is fixed at
+HIST_BINS x LABEL_BINS counts, whatever the number of rows. Inside a bin,
+values are assumed uniform, so binned results are within one bin width
+of the exact ones. exact=True keeps every pair and uses sklearn's
+roc_curve instead, for inputs that fit in memory.
+"""
+import argparse
+import json
+import time
+import tracemalloc
+
+import numpy as np
+from sklearn.metrics import auc, roc_curve
+
+HIST_BINS = 4096        # Residual resolution of the streaming histograms
+LABEL_BINS = 512        # SOH_teacher resolution of the joint histogram
+K_SIGMAS = (2.0, 2.5, 3.0, 3.5, 4.0)
+THRESHOLD_K = 3.0       # The k behind 'Threshold (3SD)' in anomaly_metrics.csv
+LABEL_QUANTILE = 0.95   # Synthetic ground truth: SOH_teacher above this quantile
+
+
+class RunningStats:
+    """One-pass mean/std (Welford, merged chunk-wise with Chan et al.'s update)."""
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        n_b = len(values)
+        mean_b = values.mean()
+        m2_b = ((values - mean_b) ** 2).sum()
+        delta = mean_b - self.mean
+        n = self.n + n_b
+        self.mean += delta * n_b / n
+        self.m2 += m2_b + delta ** 2 * self.n * n_b / n
+        self.n = n
+
+    @property
+    def std(self):
+        # Sample std (ddof=1), as pandas Series.std()
+        return np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.nan
+
+
+def histogram_quantile(counts, lo, width, q):
+    """Approximate quantile of a histogram, interpolated linearly inside the bin that holds it."""
+    cumulative = np.cumsum(counts)
+    target = q * cumulative[-1]
+    i = int(np.searchsorted(cumulative, target))
+    before = cumulative[i - 1] if i > 0 else 0
+    frac = (target - before) / counts[i] if counts[i] else 0.0
+    return lo + (i + frac) * width
+
+
+class StreamingHistogram:
+    """
+    Fixed number of equal-width bins whose range grows by doubling, so values
+    of unknown range can be histogrammed in one pass with bounded memory.
+    Used for approximate quantiles (error below one bin width).
+    """
+
+    def __init__(self, bins=HIST_BINS):
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64)
+        self.lo = None
+        self.width = None
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        if len(values) == 0:
+            return
+        vmin, vmax = values.min(), values.max()
+        if self.lo is None:
+            self.lo = vmin
+            self.width = max((vmax - vmin) / self.bins, 1e-9)
+        # Double the bin width until everything fits; pairs of old bins merge into one
+        while vmax >= self.lo + self.bins * self.width:
+            self.counts = np.concatenate([self.counts.reshape(-1, 2).sum(axis=1),
+                                          np.zeros(self.bins // 2, dtype=np.int64)])
+            self.width *= 2
+        while vmin < self.lo:
+            self.counts = np.concatenate([np.zeros(self.bins // 2, dtype=np.int64),
+                                          self.counts.reshape(-1, 2).sum(axis=1)])
+            self.lo -= self.bins * self.width
+            self.width *= 2
+        idx = np.minimum(((values - self.lo) / self.width).astype(np.int64), self.bins - 1)
+        self.counts += np.bincount(idx, minlength=self.bins)
+
+    def quantile(self, q):
+        return histogram_quantile(self.counts, self.lo, self.width, q)
+
+
+def _merge_pairs(counts, axis):
+    shape = list(counts.shape)
+    shape[axis:axis + 1] = [shape[axis] // 2, 2]
+    return counts.reshape(shape).sum(axis=axis + 1)
+
+
+class JointHistogram:
+    """
+    StreamingHistogram over (x, y) pairs: a bins[0] x bins[1] grid whose
+    range grows by doubling on each axis independently.
+    """
+
+    def __init__(self, bins=(HIST_BINS, LABEL_BINS)):
+        self.bins = tuple(bins)
+        self.counts = np.zeros(self.bins, dtype=np.int64)
+        self.lo = [None, None]
+        self.width = [None, None]
+
+    def _fit(self, axis, vmin, vmax):
+        n = self.bins[axis]
+        if self.lo[axis] is None:
+            self.lo[axis] = vmin
+            # n - 1 so the first chunk's maximum doesn't force a doubling straight away
+            self.width[axis] = max((vmax - vmin) / (n - 1), 1e-9)
+        while vmax >= self.lo[axis] + n * self.width[axis]:
+            merged = _merge_pairs(self.counts, axis)
+            self.counts = np.concatenate([merged, np.zeros_like(merged)], axis=axis)
+            self.width[axis] *= 2
+        while vmin < self.lo[axis]:
+            merged = _merge_pairs(self.counts, axis)
+            self.counts = np.concatenate([np.zeros_like(merged), merged], axis=axis)
+            self.lo[axis] -= n * self.width[axis]
+            self.width[axis] *= 2
+
+    def _index(self, axis, values):
+        idx = ((values - self.lo[axis]) / self.width[axis]).astype(np.int64)
+        return np.minimum(idx, self.bins[axis] - 1)
+
+    def update(self, x, y):
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        if len(x) == 0:
+            return
+        self._fit(0, x.min(), x.max())
+        self._fit(1, y.min(), y.max())
+        flat = self._index(0, x) * self.bins[1] + self._index(1, y)
+        self.counts += np.bincount(flat, minlength=self.counts.size).reshape(self.bins)
+
+    def upper_edges(self, axis):
+        return self.lo[axis] + (np.arange(self.bins[axis]) + 1) * self.width[axis]
+
+    def fraction_above(self, axis, threshold):
+        """Share of each bin on `axis` above threshold, assuming values spread evenly inside a bin."""
+        return np.clip((self.upper_edges(axis) - threshold) / self.width[axis], 0.0, 1.0)
+
+    def quantile(self, axis, q):
+        return histogram_quantile(self.counts.sum(axis=1 - axis), self.lo[axis], self.width[axis], q)
+
+
+def binned_roc(pos_counts, neg_counts):
+    """ROC curve and AUC from per-bin score counts of positives and negatives (ascending bins)."""
+    # Sweep the threshold from the highest bin down
+    tps = np.concatenate([[0], np.cumsum(pos_counts[::-1])])
+    fps = np.concatenate([[0], np.cumsum(neg_counts[::-1])])
+    tpr = tps / max(tps[-1], 1)
+    fpr = fps / max(fps[-1], 1)
+    # Trapezoids count ties inside a bin as half right, like the exact AUC
+    return fpr, tpr, auc(fpr, tpr)
+
+
+def _rates(detected, tp, positives, negatives):
+    return {
+        "detected": detected,
+        "tpr": tp / positives if positives else float('nan'),
+        "fpr": (detected - tp) / negatives if negatives else float('nan'),
+        "precision": tp / detected if detected else float('nan'),
+    }
+
+
+class AnomalyEvaluator:
+    """
+    Accumulates (residual, SOH_teacher) chunks and reports the mean + k*std
+    thresholds, ROC/AUC of the residual against the SOH_teacher-quantile
+    label, and a detection sweep over `ks`. See the module docstring.
+    """
+
+    def __init__(self, exact=False, bins=(HIST_BINS, LABEL_BINS)):
+        self.exact = exact
+        self.stats = RunningStats()
+        self.hist = None if exact else JointHistogram(bins)
+        self._chunks = [] if exact else None
+
+    def update(self, residual, teacher):
+        residual = np.asarray(residual, dtype=float)
+        teacher = np.asarray(teacher, dtype=float)
+        self.stats.update(residual)
+        if self.exact:
+            self._chunks.append((residual, teacher))
+        else:
+            self.hist.update(residual, teacher)
+
+    def finish(self, ks=K_SIGMAS, label_quantile=LABEL_QUANTILE, threshold_k=THRESHOLD_K):
+        """
+        Dict with rows, residual_mean/std, threshold (mean + threshold_k*std),
+        detected, label_threshold, positives, fpr/tpr/auc, `thresholds`
+        ({k: mean + k*std}) and `sweep`, one entry per k in ks: threshold,
+        detected, rate, tpr, fpr, precision.
+        """
+        n, mean, std = self.stats.n, self.stats.mean, self.stats.std
+        thresholds = {k: mean + k * std for k in sorted(set(ks) | {threshold_k})}
+
+        if self.exact:
+            residual = np.concatenate([r for r, _ in self._chunks]) if self._chunks else np.zeros(0)
+            teacher = np.concatenate([t for _, t in self._chunks]) if self._chunks else np.zeros(0)
+            label_threshold = float(np.quantile(teacher, label_quantile))
+            labels = teacher > label_threshold
+            positives = int(labels.sum())
+            fpr, tpr, _ = roc_curve(labels, residual)
+            roc_auc = auc(fpr, tpr)
+            counts = {k: (int((residual > t).sum()), int((labels & (residual > t)).sum()))
+                      for k, t in thresholds.items()}
+        else:
+            hist = self.hist
+            label_threshold = float(hist.quantile(1, label_quantile))
+            pos = hist.counts @ hist.fraction_above(1, label_threshold)
+            neg = hist.counts.sum(axis=1) - pos
+            positives = float(pos.sum())
+            fpr, tpr, roc_auc = binned_roc(pos, neg)
+            counts = {}
+            for k, t in thresholds.items():
+                above = hist.fraction_above(0, t)
+                counts[k] = (float(above @ (pos + neg)), float(above @ pos))
+
+        report = {
+            "mode": "exact" if self.exact else "binned",
+            "rows": n,
+            "residual_mean": mean,
+            "residual_std": std,
+            "thresholds": thresholds,
+            "ks": list(ks),
+            "threshold_k": threshold_k,
+            "threshold": thresholds[threshold_k],
+            "label_threshold": label_threshold,
+            "fpr": fpr,
+            "tpr": tpr,
+            "auc": float(roc_auc),
+        }
+        return with_counts(report, positives, counts)
+
+
+def with_counts(report, positives, counts):
+    """
+    `report` with positives, detected and the sweep recomputed from
+    `counts`, {k: (detected, true positives)} for every k in
+    report['thresholds'], e.g. counted exactly in a pass over labelled rows.
+    """
+    n = report["rows"]
+    sweep = [dict(k=k, threshold=t, rate=counts[k][0] / n if n else float('nan'),
+                  **_rates(counts[k][0], counts[k][1], positives, n - positives))
+             for k, t in report["thresholds"].items() if k in report["ks"]]
+    return dict(report, positives=positives, detected=counts[report["threshold_k"]][0], sweep=sweep)
+
+
+def save_roc_plot(fpr, tpr, roc_auc, path):
+    import matplotlib.pyplot as plt
+
+    plt.figure()
+    plt.plot(fpr, tpr, color='darkorange', lw=2, label=f'ROC curve (area = {roc_auc:.2f})')
+    plt.plot([0, 1], [0, 1], color='navy', lw=2, linestyle='--')
+    plt.xlim([0.0, 1.0])
+    plt.ylim([0.0, 1.05])
+    plt.xlabel('False Positive Rate')
+    plt.ylabel('True Positive Rate')
+    plt.title('Anomaly Detection ROC (Residual vs Extreme Degradation)')
+    plt.legend(loc="lower right")
+    plt.savefig(path)
+    plt.close()
+
+
+def _synthetic_chunk(rng, n):
+    """Residuals loosely tied to SOH_teacher, shaped like the student model's."""
+    teacher = rng.gamma(4.0, 5.0, n)
+    residual = np.abs(0.4 * (teacher - 20.0) + rng.normal(0.0, 6.0, n))
+    return residual, teacher
+
+
+def _summary(report):
+    return {key: report[key] for key in ("rows", "threshold", "detected", "label_threshold", "auc")}
+
+
+def bench(rows, chunk_size, exact_rows, seed=0):
+    """Binned evaluation of `rows` synthetic residuals vs exact roc_curve on the first `exact_rows`."""
+    rng = np.random.default_rng(seed)
+    chunks = [_synthetic_chunk(rng, min(chunk_size, exact_rows - start))
+              for start in range(0, exact_rows, chunk_size)]
+    result = {"config": {"rows": rows, "chunk_size": chunk_size, "exact_rows": exact_rows}}
+
+    for mode, exact in (("exact", True), ("binned", False)):
+        tracemalloc.start()
+        start = time.perf_counter()
+        evaluator = AnomalyEvaluator(exact=exact)
+        for residual, teacher in chunks:
+            evaluator.update(residual, teacher)
+        report = evaluator.finish()
+        result[f"{mode}_{exact_rows}"] = dict(_summary(report), seconds=round(time.perf_counter() - start, 3),
+                                              peak_alloc_mb=round(tracemalloc.get_traced_memory()[1] / 2**20, 1))
+        tracemalloc.stop()
+
+    # Full size: chunks generated on the fly, only the binned evaluator keeps state
+    tracemalloc.start()
+    evaluator, update_seconds = AnomalyEvaluator(), 0.0
+    for start in range(0, rows, chunk_size):
+        residual, teacher = _synthetic_chunk(rng, min(chunk_size, rows - start))
+        t0 = time.perf_counter()
+        evaluator.update(residual, teacher)
+        update_seconds += time.perf_counter() - t0
+    t0 = time.perf_counter()
+    report = evaluator.finish()
+    result[f"binned_{rows}"] = dict(_summary(report), update_seconds=round(update_seconds, 3),
+                                    finish_seconds=round(time.perf_counter() - t0, 3),
+                                    peak_alloc_mb=round(tracemalloc.get_traced_memory()[1] / 2**20, 1))
+    tracemalloc.stop()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    timing = commands.add_parser('bench', help="Binned vs exact evaluation on synthetic residuals.")
+    timing.add_argument('--rows', type=int, default=100_000_000)
+    timing.add_argument('--chunk-size', type=int, default=1_000_000)
+    timing.add_argument('--exact-rows', type=int, default=10_000_000,
+                        help="Rows also evaluated exactly (roc_curve), for accuracy and time.")
+    args = parser.parse_args()
+    print(json.dumps(bench(args.rows, args.chunk_size, args.exact_rows), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import asyncio
+import os
+import time
+
+import pandas as pd
+from prometheus_client import Gauge, Histogram
+
+
+MICRO_BATCHING = os.getenv("MICRO_BATCHING", "1") == "1"
+# How long the first request of a batch waits for others to join
+MICRO_BATCH_WINDOW_MS = float(os.getenv("MICRO_BATCH_WINDOW_MS", "2"))
+MICRO_BATCH_MAX_SIZE = int(os.getenv("MICRO_BATCH_MAX_SIZE", "64"))
+
+QUEUE_DEPTH = Gauge(
+    "ev_inference_queue_depth",
+    "Prediction requests waiting to be coalesced into a batch"
+)
+BATCH_SIZE = Histogram(
+    "ev_inference_batch_size",
+    "Number of requests scored per coalesced batch",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128, 256, 512)
+)
+BATCH_WAIT = Histogram(
+    "ev_inference_batch_wait_seconds",
+    "Time a request spent queued before its batch was dispatched",
+    buckets=(0.0005, 0.001, 0.002, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+
+
+class MicroBatcher:
+    """
+    Coalesces concurrent single-row predictions. The first queued request
+    opens a window of `window_ms`; everything that arrives before it closes
+    (up to `max_batch_size` rows) is scored by one `run_batch(df)` call and
+    each caller gets back its own row of the result.
+    """
+
+    def __init__(self, run_batch, window_ms=MICRO_BATCH_WINDOW_MS,
+                 max_batch_size=MICRO_BATCH_MAX_SIZE, enabled=MICRO_BATCHING):
+        self.run_batch = run_batch
+        self.window = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self.enabled = enabled
+        self._queue = None
+        self._collector = None
+        self._inflight = set()
+
+    async def submit(self, row):
+        """Score one row (a dict of input columns) as part of the next batch."""
+        if not self.enabled:
+            return (await self.run_batch(pd.DataFrame([row])))[0]
+
+        if self._collector is None or self._collector.done():
+            self._queue = asyncio.Queue()
+            self._collector = asyncio.get_running_loop().create_task(self._collect())
+
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((row, future, time.perf_counter()))
+        QUEUE_DEPTH.inc()
+        return await future
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            dispatched = time.perf_counter()
+            QUEUE_DEPTH.dec(len(batch))
+            BATCH_SIZE.observe(len(batch))
+            for _, _, queued in batch:
+                BATCH_WAIT.observe(dispatched - queued)
+            # Keep collecting while this batch is scored
+            task = loop.create_task(self._dispatch(batch))
+            self._inflight.add(task)
+            task.add_done_callback(self._inflight.discard)
+
+    async def _dispatch(self, batch):
+        # The batch is admitted or rejected as a unit (executors.InferenceSaturated
+        # counts its rows), so every caller in it shares the outcome
+        futures = [future for _, future, _ in batch]
+        try:
+            results = await self.run_batch(pd.DataFrame([row for row, _, _ in batch]))
+        except Exception as e:
+            for future in futures:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for future, result in zip(futures, results):
+            if not future.done():
+                future.set_result(result)
+
+    def stop(self):
+        if self._collector is not None:
+            self._collector.cancel()
+            self._collector = None
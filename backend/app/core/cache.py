@@ -0,0 +1,133 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date
+
+from prometheus_client import Counter, Gauge
+
+
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "10000"))  # 0 disables the cache
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "300"))     # seconds
+# Optional grid the float inputs are snapped to before lookup and scoring (0 = exact)
+PREDICTION_CACHE_KM_STEP = float(os.getenv("PREDICTION_CACHE_KM_STEP", "0"))
+PREDICTION_CACHE_MINUTES_STEP = float(os.getenv("PREDICTION_CACHE_MINUTES_STEP", "0"))
+
+CACHE_HITS = Counter("ev_prediction_cache_hits", "Predictions served from the cache")
+CACHE_MISSES = Counter("ev_prediction_cache_misses", "Predictions not found in the cache")
+CACHE_EVICTIONS = Counter(
+    "ev_prediction_cache_evictions",
+    "Cache entries dropped before being reused",
+    ["reason"]
+)
+CACHE_ENTRIES = Gauge("ev_prediction_cache_entries", "Predictions currently cached")
+
+
+def _snap(value, step):
+    return round(value / step) * step if step > 0 else value
+
+
+class PredictionCache:
+    """
+    Bounded LRU cache of /predict responses with a per-entry TTL.
+
+    Keys hold the vehicle, its row as read for the request (battery type,
+    buying price and date), the (optionally quantized) km/charge-time inputs
+    and today's date, since the resale model's vehicle age changes once per
+    day. With the row in the key, an update made through any worker makes
+    the old entries unreachable everywhere; the worker that made it also
+    drops them to free the space. Everything is dropped when the models are
+    reloaded, and put() skips results scored before that (see token()).
+    """
+
+    def __init__(self, max_entries=PREDICTION_CACHE_SIZE, ttl=PREDICTION_CACHE_TTL,
+                 km_step=PREDICTION_CACHE_KM_STEP, minutes_step=PREDICTION_CACHE_MINUTES_STEP):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.km_step = km_step
+        self.minutes_step = minutes_step
+        self._entries = OrderedDict()   # key -> (expires_at, response)
+        self._by_vehicle = {}           # (user_id, vehicle_id) -> set of keys
+        # Bumped on clear() so results computed by the previous models aren't stored
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def quantize(self, total_dist_km, charging_time_min):
+        """Snap the float inputs to the cache grid; scoring must use the snapped values."""
+        return _snap(total_dist_km, self.km_step), _snap(charging_time_min, self.minutes_step)
+
+    def key(self, user_id, vehicle_id, vehicle, total_dist_km, charging_time_min):
+        """`vehicle` is the (battery_type, buying_price, buying_date) row the response is scored from."""
+        return (user_id, vehicle_id, tuple(vehicle), total_dist_km, charging_time_min, date.today())
+
+    def token(self):
+        """Snapshot taken before scoring; pass it back to put()."""
+        return self._generation
+
+    def get(self, key):
+        if not self.enabled:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] < time.monotonic():
+                self._remove(key)
+                CACHE_EVICTIONS.labels(reason="ttl").inc()
+                entry = None
+            if entry is None:
+                CACHE_MISSES.inc()
+                return None
+            self._entries.move_to_end(key)
+            CACHE_HITS.inc()
+            return entry[1]
+
+    def put(self, key, response, token):
+        if not self.enabled:
+            return
+        with self._lock:
+            if token != self._generation:
+                return
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, response)
+            self._by_vehicle.setdefault(key[:2], set()).add(key)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                CACHE_EVICTIONS.labels(reason="lru").inc()
+            CACHE_ENTRIES.set(len(self._entries))
+
+    def invalidate_vehicle(self, user_id, vehicle_id):
+        """Drop every cached prediction for one vehicle, e.g. after /update_vehicle."""
+        with self._lock:
+            keys = self._by_vehicle.pop((user_id, vehicle_id), ())
+            for key in keys:
+                self._entries.pop(key, None)
+            if keys:
+                CACHE_EVICTIONS.labels(reason="invalidated").inc(len(keys))
+            CACHE_ENTRIES.set(len(self._entries))
+
+    def clear(self):
+        """Drop everything, e.g. after the models were reloaded."""
+        with self._lock:
+            self._generation += 1
+            if self._entries:
+                CACHE_EVICTIONS.labels(reason="invalidated").inc(len(self._entries))
+            self._entries.clear()
+            self._by_vehicle.clear()
+            CACHE_ENTRIES.set(0)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._by_vehicle.get(key[:2])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_vehicle[key[:2]]
+        CACHE_ENTRIES.set(len(self._entries))
+
+
+prediction_cache = PredictionCache()
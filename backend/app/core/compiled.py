@@ -0,0 +1,272 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from app.core.features import CATEGORICAL_COLUMN
+
+
+# Sidecar written next to each pickle by train_student_model.py
+COMPILED_SUFFIX = '.npz'
+# Directory of one .npy per array, unpacked from the .npz so it can be memory-mapped
+MMAP_SUFFIX = '.arrays'
+# Written into each .arrays directory: sha256 of the .npz it was unpacked from
+SOURCE_DIGEST = 'source.sha256'
+
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def unpacked_digest(directory):
+    """Digest of the .npz an .arrays directory was unpacked from, or None (missing or unmarked)."""
+    try:
+        with open(os.path.join(directory, SOURCE_DIGEST)) as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+def is_unpacked(compiled_path, directory, digest=None):
+    """Whether `directory` holds the arrays of the .npz at compiled_path as it is now."""
+    digest = digest or file_digest(compiled_path)
+    return os.path.isdir(directory) and unpacked_digest(directory) == digest
+
+
+def unpack(compiled_path, directory=None, digest=None):
+    """
+    Unpack a .npz into its .arrays directory (stem + MMAP_SUFFIX by default),
+    replacing a copy unpacked from an older .npz. Returns the directory.
+    """
+    directory = directory or os.path.splitext(compiled_path)[0] + MMAP_SUFFIX
+    digest = digest or file_digest(compiled_path)
+    CompiledPipeline.load(compiled_path).save(directory, digest)
+    return directory
+
+
+class CompiledPipeline:
+    """
+    NumPy-only replacement for the fitted sklearn Pipelines
+    (ColumnTransformer[StandardScaler, OneHotEncoder] -> regressor).
+
+    Arrays are produced by train_student_model.export_compiled_model() and
+    loaded either from the .npz (private copy) or from the unpacked .arrays
+    directory with read-only memory maps, which every process on the host
+    shares through the page cache. Arrays are kept in the dtype traversal
+    uses, so loading from the directory never copies the node arrays:
+      kind              'forest', 'boosting' or 'linear'
+      num_columns       scaled input columns, in transformer order
+      scaler_mean/scale StandardScaler statistics
+      cat_columns       one-hot encoded input columns
+      cat_categories_i  categories of the i-th categorical column
+      left/right        child node ids (leaves point to themselves)
+      feature/threshold split of each node (leaves: 0 / +inf)
+      value             leaf values, shape (n_nodes, n_outputs)
+      roots             root node id of every tree
+      max_depth         deepest tree
+      base/learning_rate  boosting init prediction and shrinkage
+      coef/intercept    linear model weights
+      target_mean/scale optional StandardScaler applied to the targets
+                        (TransformedTargetRegressor), undone after prediction
+      is_leaf           written by save(); derived from left/right otherwise
+    """
+
+    def __init__(self, arrays):
+        self.kind = str(arrays['kind'])
+        self.num_columns = [str(c) for c in arrays['num_columns']]
+        self.cat_columns = [str(c) for c in arrays['cat_columns']]
+        self.scaler_mean = arrays['scaler_mean']
+        self.scaler_scale = arrays['scaler_scale']
+
+        # Sorted categories and one-hot column offset of each categorical input
+        self.categories = []
+        self.category_offsets = []
+        offset = len(self.num_columns)
+        for i in range(len(self.cat_columns)):
+            categories = arrays[f'cat_categories_{i}'].astype(str)
+            self.categories.append(categories)
+            self.category_offsets.append(offset)
+            offset += len(categories)
+        self.n_features = offset
+        self.target_mean = arrays.get('target_mean')
+        self.target_scale = arrays.get('target_scale')
+
+        if self.kind == 'linear':
+            self.coef = arrays['coef']
+            self.intercept = arrays['intercept']
+        else:
+            # asarray leaves memory-mapped arrays that already have the right dtype untouched
+            self.left = np.asarray(arrays['left'], dtype=np.int32)
+            self.right = np.asarray(arrays['right'], dtype=np.int32)
+            self.feature = np.asarray(arrays['feature'], dtype=np.int32)
+            if 'is_leaf' in arrays:
+                self.is_leaf = arrays['is_leaf']
+            else:
+                self.is_leaf = self.left == np.arange(len(self.left), dtype=np.int32)
+            # x <= t for a float32 x is the same test as x <= t rounded down to float32,
+            # so the traversal can stay in float32 without changing any split.
+            # float32 thresholds (from save()) have already been rounded.
+            threshold = arrays['threshold']
+            if threshold.dtype != np.float32:
+                threshold32 = threshold.astype(np.float32)
+                too_high = threshold32 > threshold
+                threshold32[too_high] = np.nextafter(threshold32[too_high], np.float32(-np.inf))
+                threshold = threshold32
+            self.threshold = threshold
+            self.value = arrays['value']
+            self.roots = np.asarray(arrays['roots'], dtype=np.int32)
+            self.base = arrays['base']
+            self.learning_rate = float(arrays['learning_rate'])
+        self._arrays = arrays
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            return cls({key: data[key] for key in data.files})
+
+    @classmethod
+    def load_mmap(cls, directory):
+        """Load an unpacked .arrays directory with read-only memory maps."""
+        arrays = {}
+        for filename in os.listdir(directory):
+            if filename.endswith('.npy'):
+                arrays[filename[:-4]] = np.load(os.path.join(directory, filename), mmap_mode='r', allow_pickle=False)
+        return cls(arrays)
+
+    def to_arrays(self):
+        """The source arrays with node arrays in traversal dtype, as save() writes them."""
+        arrays = dict(self._arrays)
+        if self.kind != 'linear':
+            arrays.update(left=self.left, right=self.right, feature=self.feature,
+                          threshold=self.threshold, is_leaf=self.is_leaf, roots=self.roots)
+        return arrays
+
+    def save(self, directory, digest=None):
+        """
+        Write one .npy per array into `directory`, plus the source .npz
+        `digest` when given. The directory is built next to the target and
+        renamed into place, so concurrent workers unpacking the same model
+        never see a partial copy. An existing directory with a different
+        digest is moved aside and replaced.
+        """
+        parent = os.path.dirname(os.path.abspath(directory))
+        staging = tempfile.mkdtemp(prefix='.unpack-', dir=parent)
+        try:
+            for key, value in self.to_arrays().items():
+                np.save(os.path.join(staging, f'{key}.npy'), np.asarray(value), allow_pickle=False)
+            if digest:
+                with open(os.path.join(staging, SOURCE_DIGEST), 'w') as f:
+                    f.write(digest + '\n')
+            # mkdtemp creates 0700; the models may be served by another user
+            os.chmod(staging, 0o755)
+            try:
+                os.rename(staging, directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+                if unpacked_digest(directory) == digest:
+                    # Another process finished first; its copy is identical
+                    return
+                # Unpacked from an older .npz. Processes that mapped it keep their pages.
+                stale = tempfile.mkdtemp(prefix='.stale-', dir=parent)
+                try:
+                    os.rename(directory, os.path.join(stale, 'arrays'))
+                    os.rename(staging, directory)
+                except OSError:
+                    if unpacked_digest(directory) != digest:
+                        raise
+                finally:
+                    shutil.rmtree(stale, ignore_errors=True)
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+    def transform(self, numeric, categorical):
+        """
+        Build the model matrix from an (n, len(num_columns)) float array and an
+        (n, len(cat_columns)) array of category labels.
+        """
+        n = len(numeric)
+        X = np.zeros((n, self.n_features), dtype=np.float64)
+        X[:, :len(self.num_columns)] = (numeric - self.scaler_mean) / self.scaler_scale
+        rows = np.arange(n)
+        for j, categories in enumerate(self.categories):
+            # Unknown categories encode as all zeros (handle_unknown='ignore')
+            labels = categorical[:, j]
+            pos = np.minimum(np.searchsorted(categories, labels), len(categories) - 1)
+            known = categories[pos] == labels
+            X[rows[known], self.category_offsets[j] + pos[known]] = 1.0
+        return X
+
+    def transform_features(self, frame):
+        """
+        Model matrix from a FeatureFrame (app.core.features): numeric columns
+        are read from its float32 matrix, battery types mapped to one-hot
+        positions once per distinct label. Built in float32 for trees.
+        """
+        n = len(frame)
+        dtype = np.float64 if self.kind == 'linear' else np.float32
+        X = np.zeros((n, self.n_features), dtype=dtype)
+        X[:, :len(self.num_columns)] = (frame.numeric(self.num_columns) - self.scaler_mean) / self.scaler_scale
+        if self.cat_columns:
+            if self.cat_columns != [CATEGORICAL_COLUMN]:
+                raise ValueError(f"FeatureFrame only carries {CATEGORICAL_COLUMN!r}, model needs {self.cat_columns}")
+            # Unknown categories encode as all zeros (handle_unknown='ignore')
+            pos = frame.positions(self.categories[0])
+            known = np.flatnonzero(pos >= 0)
+            X[known, self.category_offsets[0] + pos[known]] = 1.0
+        return X
+
+    def predict_features(self, frame):
+        """Predict from a FeatureFrame without building a DataFrame."""
+        return self.predict_matrix(self.transform_features(frame))
+
+    def predict_matrix(self, X):
+        """Predict from an already transformed model matrix."""
+        if self.kind == 'linear':
+            return self._finish(X @ self.coef.T + self.intercept)
+
+        # sklearn trees compare float32 inputs against the split thresholds
+        X = np.ascontiguousarray(X, dtype=np.float32)
+        n, n_features = X.shape
+        n_trees = len(self.roots)
+        flat = X.ravel()
+
+        # Walk every (row, tree) pair one level per step, dropping pairs once they hit a leaf
+        node = np.tile(self.roots, n)
+        row_offset = np.repeat(np.arange(n, dtype=np.int32) * n_features, n_trees)
+        leaves = node.copy()
+        active = np.flatnonzero(~self.is_leaf[node])
+        node, row_offset = node[active], row_offset[active]
+        while len(active):
+            go_left = flat[row_offset + self.feature[node]] <= self.threshold[node]
+            node = np.where(go_left, self.left[node], self.right[node])
+            done = self.is_leaf[node]
+            if done.any():
+                leaves[active[done]] = node[done]
+                keep = ~done
+                active, node, row_offset = active[keep], node[keep], row_offset[keep]
+
+        leaf_sum = self.value[leaves.reshape(n, n_trees)].sum(axis=1)
+        if self.kind == 'forest':
+            out = leaf_sum / n_trees
+        else:
+            out = self.base + self.learning_rate * leaf_sum
+        return self._finish(out)
+
+    def _finish(self, out):
+        if self.target_scale is not None:
+            out = out * self.target_scale + self.target_mean
+        return out[:, 0] if out.shape[1] == 1 else out
+
+    def predict(self, df):
+        """Drop-in for Pipeline.predict on a DataFrame with the training columns."""
+        # Column-by-column access avoids building intermediate DataFrames
+        numeric = np.column_stack([df[col].to_numpy(dtype=np.float64) for col in self.num_columns])
+        categorical = np.column_stack([df[col].to_numpy().astype(str) for col in self.cat_columns])
+        return self.predict_matrix(self.transform(numeric, categorical))
@@ -1,21 +1,919 @@
+import logging
+import os
+import queue
 import sqlite3
+import threading
+from contextlib import contextmanager
 
-def init_db():
 
-    conn = sqlite3.connect("vehicle.db")
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    CREATE TABLE IF NOT EXISTS vehicle(
-        user_id TEXT,
-        vehicle_id TEXT,
-        battery_type TEXT,
-        buying_price REAL,
-        buying_date TEXT,
-        manufacture_date TEXT,
-        PRIMARY KEY(vehicle_id)
-    )
+DB_PATH = os.getenv("VEHICLE_DB_PATH", "vehicle.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "8"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Rows written per transaction by the bulk vehicle methods
+DB_BULK_CHUNK = int(os.getenv("DB_BULK_CHUNK", "5000"))
+
+logger = logging.getLogger(__name__)
+
+# Applied to every pooled connection. WAL lets readers run alongside the single
+# writer, NORMAL sync is durable in WAL mode except on power loss, and
+# busy_timeout makes writers queue instead of failing with "database is locked".
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA mmap_size=134217728",
+)
+
+
+class ConnectionPool:
+    """
+    Thread-safe pool of SQLite connections. Connections are opened lazily up
+    to `size` and handed out one per thread at a time; callers block for up
+    to `timeout` seconds when all of them are busy.
+    """
+
+    def __init__(self, path=DB_PATH, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT):
+        self.path = path
+        self.size = size
+        self.timeout = timeout
+        self.pid = os.getpid()
+        self._idle = queue.LifoQueue()
+        self._opened = 0
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        # Statement cache keeps the repository's fixed SQL strings prepared
+        conn = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False, cached_statements=256)
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self._opened < self.size:
+                self._opened += 1
+                try:
+                    return self._connect()
+                except Exception:
+                    self._opened -= 1
+                    raise
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise TimeoutError(f"No database connection available after {self.timeout}s")
+
+    def release(self, conn):
+        self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection; uncommitted work is rolled back on return."""
+        conn = self.acquire()
+        try:
+            yield conn
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            self.release(conn)
+
+    @contextmanager
+    def transaction(self):
+        """Borrow a connection and commit on success, roll back on error."""
+        with self.connection() as conn:
+            yield conn
+            conn.commit()
+
+    def close(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().close()
+                except queue.Empty:
+                    break
+            self._opened = 0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool():
+    """Process-wide pool, recreated after a fork since connections can't be shared."""
+    global _pool
+    if _pool is None or _pool.pid != os.getpid():
+        with _pool_lock:
+            if _pool is None or _pool.pid != os.getpid():
+                _pool = ConnectionPool()
+    return _pool
+
+
+class VehicleRepository:
+    """Data access for the `vehicle` table. SQL strings are constants so the
+    per-connection statement cache reuses the prepared statements."""
+
+    INSERT = """
+        INSERT OR IGNORE INTO vehicle
+        VALUES(?,?,?,?,?,?)
+    """
+    SELECT_ONE = """
+        SELECT battery_type, buying_price, buying_date
+        FROM vehicle
+        WHERE user_id = ? AND vehicle_id = ?
+    """
+    SELECT_BY_USER = """
+        SELECT user_id, vehicle_id, battery_type, buying_price, buying_date, manufacture_date
+        FROM vehicle
+        WHERE user_id = ?
+        ORDER BY vehicle_id
+    """
+    # Keyset pagination: vehicle_user(user_id, vehicle_id) seeks straight to the
+    # cursor, so every page costs the same however deep into the account it is
+    SELECT_PAGE = """
+        SELECT user_id, vehicle_id, battery_type, buying_price, buying_date, manufacture_date
+        FROM vehicle
+        WHERE user_id = ? AND vehicle_id > ?
+        ORDER BY vehicle_id
+        LIMIT ?
+    """
+    UPDATE = """
+        UPDATE vehicle
+        SET battery_type=?,
+            buying_price=?,
+            buying_date=?,
+            manufacture_date=?
+        WHERE user_id=? AND vehicle_id=?
+    """
+    # SQLite's default host parameter limit is 999, two parameters per vehicle
+    LOOKUP_CHUNK = 400
+    ID_LOOKUP_CHUNK = 900
+
+    def __init__(self, pool_factory=get_pool):
+        self._pool = pool_factory
+
+    def register(self, user_id, vehicle_id, battery_type, buying_price, buying_date, manufacture_date):
+        """Insert a vehicle; returns False if the vehicle_id is already saved."""
+        with self._pool().transaction() as conn:
+            cursor = conn.execute(self.INSERT, (
+                user_id, vehicle_id, battery_type, buying_price, str(buying_date), str(manufacture_date)
+            ))
+            return cursor.rowcount > 0
+
+    def get(self, user_id, vehicle_id):
+        """Return (battery_type, buying_price, buying_date) or None."""
+        with self._pool().connection() as conn:
+            return conn.execute(self.SELECT_ONE, (user_id, vehicle_id)).fetchone()
+
+    def get_many(self, keys):
+        """Map (user_id, vehicle_id) -> (battery_type, buying_price, buying_date) for registered keys."""
+        keys = list(set(keys))
+        found = {}
+        with self._pool().connection() as conn:
+            for start in range(0, len(keys), self.LOOKUP_CHUNK):
+                chunk = keys[start:start + self.LOOKUP_CHUNK]
+                placeholders = ",".join(["(?,?)"] * len(chunk))
+                rows = conn.execute(f"""
+                    SELECT user_id, vehicle_id, battery_type, buying_price, buying_date
+                    FROM vehicle
+                    WHERE (user_id, vehicle_id) IN (VALUES {placeholders})
+                """, [value for key in chunk for value in key])
+                for row in rows:
+                    found[(row[0], row[1])] = row[2:]
+        return found
+
+    @staticmethod
+    def _vehicle_dict(r):
+        return {
+            "user_id": r[0],
+            "vehicle_id": r[1],
+            "battery_type": r[2],
+            "buying_price": r[3],
+            "buying_date": r[4],
+            "manufacture_date": r[5]
+        }
+
+    def list_for_user(self, user_id):
+        with self._pool().connection() as conn:
+            rows = conn.execute(self.SELECT_BY_USER, (user_id,)).fetchall()
+        return [self._vehicle_dict(r) for r in rows]
+
+    def page_for_user(self, user_id, after="", limit=100):
+        """Up to `limit` vehicles of the user with vehicle_id > `after`, in vehicle_id order."""
+        with self._pool().connection() as conn:
+            rows = conn.execute(self.SELECT_PAGE, (user_id, after or "", limit)).fetchall()
+        return [self._vehicle_dict(r) for r in rows]
+
+    def update(self, user_id, vehicle_id, battery_type, buying_price, buying_date, manufacture_date):
+        """Update a vehicle; returns the number of rows changed."""
+        with self._pool().transaction() as conn:
+            cursor = conn.execute(self.UPDATE, (
+                battery_type, buying_price, str(buying_date), str(manufacture_date), user_id, vehicle_id
+            ))
+            return cursor.rowcount
+
+    @classmethod
+    def _saved_ids(cls, conn, vehicle_ids):
+        saved = set()
+        for start in range(0, len(vehicle_ids), cls.ID_LOOKUP_CHUNK):
+            chunk = vehicle_ids[start:start + cls.ID_LOOKUP_CHUNK]
+            rows = conn.execute(
+                f"SELECT vehicle_id FROM vehicle WHERE vehicle_id IN ({','.join('?' * len(chunk))})", chunk
+            )
+            saved.update(row[0] for row in rows)
+        return saved
+
+    @classmethod
+    def _saved_keys(cls, conn, keys):
+        saved = set()
+        for start in range(0, len(keys), cls.LOOKUP_CHUNK):
+            chunk = keys[start:start + cls.LOOKUP_CHUNK]
+            placeholders = ",".join(["(?,?)"] * len(chunk))
+            rows = conn.execute(f"""
+                SELECT user_id, vehicle_id
+                FROM vehicle
+                WHERE (user_id, vehicle_id) IN (VALUES {placeholders})
+            """, [value for key in chunk for value in key])
+            saved.update(rows)
+        return saved
+
+    def _write_chunks(self, rows, chunk_size, write):
+        """
+        Run write(conn, chunk) for each `chunk_size` slice of rows in its own
+        BEGIN IMMEDIATE transaction, so the existence check and the write see
+        the same snapshot. Chunks committed before a failure stay committed.
+        """
+        with self._pool().connection() as conn:
+            for start in range(0, len(rows), chunk_size):
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    write(conn, rows[start:start + chunk_size])
+                    conn.commit()
+                except Exception:
+                    conn.rollback()
+                    raise
+
+    def register_many(self, rows, chunk_size=DB_BULK_CHUNK):
+        """
+        Insert (user_id, vehicle_id, battery_type, buying_price, buying_date,
+        manufacture_date) rows with one executemany per chunk. Returns one
+        flag per row: True if inserted, False if the vehicle_id was already
+        saved (before the call or earlier in `rows`).
+        """
+        inserted = []
+
+        def write(conn, chunk):
+            saved = self._saved_ids(conn, [row[1] for row in chunk])
+            new = []
+            for row in chunk:
+                is_new = row[1] not in saved
+                if is_new:
+                    saved.add(row[1])
+                    new.append((*row[:4], str(row[4]), str(row[5])))
+                inserted.append(is_new)
+            conn.executemany(self.INSERT, new)
+
+        self._write_chunks(rows, chunk_size, write)
+        return inserted
+
+    def update_many(self, rows, chunk_size=DB_BULK_CHUNK):
+        """
+        Update vehicles from rows shaped like register_many's, with one
+        executemany per chunk. Returns one flag per row: True if updated,
+        False if no vehicle matches its (user_id, vehicle_id).
+        """
+        updated = []
+
+        def write(conn, chunk):
+            saved = self._saved_keys(conn, list({(row[0], row[1]) for row in chunk}))
+            changes = []
+            for row in chunk:
+                found = (row[0], row[1]) in saved
+                if found:
+                    changes.append((row[2], row[3], str(row[4]), str(row[5]), row[0], row[1]))
+                updated.append(found)
+            conn.executemany(self.UPDATE, changes)
+
+        self._write_chunks(rows, chunk_size, write)
+        return updated
+
+
+class ReadingRepository:
+    """
+    Time series of /predict readings. `reading` is an append-only rowid
+    table indexed on (vehicle_id, ts) for per-vehicle ranges and on ts for
+    the rollup/retention sweeps; `reading_daily` holds one row per vehicle
+    and UTC day, keyed (vehicle_id, day), and `reading_fleet_daily` one row
+    per day and battery type, so fleet queries read a few rows per day.
+    Timestamps are epoch milliseconds, days 'YYYY-MM-DD'.
+    """
+
+    INSERT = """
+        INSERT INTO reading(vehicle_id, ts, total_dist_km, charging_time_min,
+                            predicted_soh, degradation_rate, anomaly, resale_value)
+        VALUES(?,?,?,?,?,?,?,?)
+    """
+    SELECT_RANGE = """
+        SELECT ts, total_dist_km, charging_time_min, predicted_soh, degradation_rate, anomaly
+        FROM reading
+        WHERE vehicle_id = ? AND ts >= ? AND ts < ?
+        ORDER BY ts
+        LIMIT ?
+    """
+    SELECT_DAILY_RANGE = """
+        SELECT day, readings, soh_sum / readings, soh_min, soh_max, km_max, anomalies
+        FROM reading_daily
+        WHERE vehicle_id = ? AND day >= ? AND day <= ?
+        ORDER BY day
+    """
+    # Recomputes whole days from `since` (a day boundary), so reruns are idempotent
+    ROLLUP = """
+        INSERT OR REPLACE INTO reading_daily(vehicle_id, day, battery_type, readings,
+                                             soh_sum, soh_min, soh_max, km_max, anomalies)
+        SELECT r.vehicle_id, date(r.ts / 1000, 'unixepoch') AS day, v.battery_type, count(*),
+               sum(r.predicted_soh), min(r.predicted_soh), max(r.predicted_soh),
+               max(r.total_dist_km), sum(r.anomaly)
+        FROM reading r
+        LEFT JOIN vehicle v ON v.vehicle_id = r.vehicle_id
+        WHERE r.ts >= ?
+        GROUP BY r.vehicle_id, day
+    """
+    ROLLUP_FLEET = """
+        INSERT OR REPLACE INTO reading_fleet_daily(day, battery_type, vehicles, readings,
+                                                   soh_sum, soh_min, soh_max, anomalies)
+        SELECT day, coalesce(battery_type, ''), count(*), sum(readings),
+               sum(soh_sum), min(soh_min), max(soh_max), sum(anomalies)
+        FROM reading_daily
+        WHERE day >= date(? / 1000, 'unixepoch')
+        GROUP BY day, coalesce(battery_type, '')
+    """
+    PRUNE = "DELETE FROM reading WHERE ts < ?"
+
+    def __init__(self, pool_factory=get_pool):
+        self._pool = pool_factory
+
+    def insert_many(self, rows):
+        """
+        Append (vehicle_id, ts, total_dist_km, charging_time_min, predicted_soh,
+        degradation_rate, anomaly, resale_value) rows. The fleet summaries
+        are updated by trigger in the same transaction (a no-op for scores
+        FleetSummaryRepository.score() already applied).
+        """
+        with self._pool().transaction() as conn:
+            conn.executemany(self.INSERT, rows)
+
+    def history(self, vehicle_id, start_ms, end_ms, limit):
+        with self._pool().connection() as conn:
+            rows = conn.execute(self.SELECT_RANGE, (vehicle_id, start_ms, end_ms, limit)).fetchall()
+        return [
+            {
+                "ts": r[0],
+                "total_dist_km": r[1],
+                "charging_time_min": r[2],
+                "predicted_soh": r[3],
+                "degradation_rate": r[4],
+                "anomaly": bool(r[5])
+            }
+            for r in rows
+        ]
+
+    def daily_history(self, vehicle_id, start_day, end_day):
+        with self._pool().connection() as conn:
+            rows = conn.execute(self.SELECT_DAILY_RANGE, (vehicle_id, start_day, end_day)).fetchall()
+        return [
+            {
+                "day": r[0],
+                "readings": r[1],
+                "soh_avg": r[2],
+                "soh_min": r[3],
+                "soh_max": r[4],
+                "km_max": r[5],
+                "anomalies": r[6]
+            }
+            for r in rows
+        ]
+
+    def fleet_daily(self, start_day, end_day, battery_type=None):
+        """Per-day fleet aggregates from the rollup table, optionally for one battery type."""
+        sql = """
+            SELECT day, sum(vehicles), sum(readings), sum(soh_sum) / sum(readings),
+                   min(soh_min), max(soh_max), sum(anomalies)
+            FROM reading_fleet_daily
+            WHERE day >= ? AND day <= ?
+        """
+        params = [start_day, end_day]
+        if battery_type is not None:
+            sql += " AND battery_type = ?"
+            params.append(battery_type)
+        sql += " GROUP BY day ORDER BY day"
+        with self._pool().connection() as conn:
+            rows = conn.execute(sql, params).fetchall()
+        return [
+            {
+                "day": r[0],
+                "vehicles": r[1],
+                "readings": r[2],
+                "soh_avg": r[3],
+                "soh_min": r[4],
+                "soh_max": r[5],
+                "anomalies": r[6]
+            }
+            for r in rows
+        ]
+
+    def rollup(self, since_ms):
+        """Rebuild the daily rollups for every day from since_ms (floored to its UTC day) onwards."""
+        since_ms -= since_ms % 86_400_000
+        with self._pool().transaction() as conn:
+            rolled = conn.execute(self.ROLLUP, (since_ms,)).rowcount
+            conn.execute(self.ROLLUP_FLEET, (since_ms,))
+            return rolled
+
+    def prune(self, before_ms):
+        """Drop raw readings older than before_ms; their days stay in reading_daily."""
+        with self._pool().transaction() as conn:
+            return conn.execute(self.PRUNE, (before_ms,)).rowcount
+
+
+class AnomalyRepository:
+    """
+    Fleet anomaly scores written by app.core.fleet_anomalies: one row per
+    vehicle with the inputs it was scored on (battery type and the latest
+    reading's mileage/charging time), the model set and threshold, and the
+    result. A vehicle is re-scored only when one of those inputs differs
+    from its row, which SELECT_CHANGED checks inside SQLite so unchanged
+    vehicles are never read out. Ranked reads use the degradation index.
+    """
+
+    # Latest reading per vehicle through the (vehicle_id, ts) index, keyset-paged on vehicle_id
+    _INPUTS = """
+        SELECT v.vehicle_id, v.user_id, v.battery_type, r.ts, r.total_dist_km, r.charging_time_min
+        FROM vehicle v
+        JOIN reading r ON r.rowid = (
+            SELECT rowid FROM reading WHERE vehicle_id = v.vehicle_id ORDER BY ts DESC LIMIT 1
+        )
+        LEFT JOIN vehicle_anomaly a ON a.vehicle_id = v.vehicle_id
+        WHERE v.vehicle_id > ? {changed}
+        ORDER BY v.vehicle_id
+        LIMIT ?
+    """
+    SELECT_ALL = _INPUTS.format(changed="")
+    SELECT_CHANGED = _INPUTS.format(changed="""
+          AND (a.vehicle_id IS NULL
+               OR a.model_key IS NOT ? OR a.threshold IS NOT ?
+               OR a.battery_type IS NOT v.battery_type
+               OR a.total_dist_km IS NOT r.total_dist_km
+               OR a.charging_time_min IS NOT r.charging_time_min)
     """)
+    UPSERT = """
+        INSERT OR REPLACE INTO vehicle_anomaly(vehicle_id, user_id, battery_type, reading_ts,
+                                               total_dist_km, charging_time_min, model_key, threshold,
+                                               raw_soh, charging_cycles, degradation, is_anomaly, scored_at)
+        VALUES(?,?,?,?,?,?,?,?,?,?,?,?,?)
+    """
+    SELECT_RANKED = """
+        SELECT vehicle_id, user_id, battery_type, reading_ts, total_dist_km, charging_time_min,
+               model_key, threshold, raw_soh, charging_cycles, degradation, is_anomaly, scored_at
+        FROM vehicle_anomaly
+        WHERE is_anomaly >= ?
+        ORDER BY degradation DESC
+        LIMIT ?
+    """
+
+    def __init__(self, pool_factory=get_pool):
+        self._pool = pool_factory
+
+    def inputs(self, after, limit, model_key=None, threshold=None, changed_only=True):
+        """
+        Up to `limit` (vehicle_id, user_id, battery_type, reading_ts, total_dist_km,
+        charging_time_min) rows after vehicle_id `after`; with changed_only, only
+        vehicles never scored or scored on other inputs, model_key or threshold.
+        Vehicles without readings are skipped.
+        """
+        with self._pool().connection() as conn:
+            if changed_only:
+                return conn.execute(self.SELECT_CHANGED, (after, model_key, threshold, limit)).fetchall()
+            return conn.execute(self.SELECT_ALL, (after, limit)).fetchall()
+
+    def upsert_many(self, rows):
+        """Write (vehicle_id, ..., scored_at) rows in UPSERT column order, in one transaction."""
+        with self._pool().transaction() as conn:
+            conn.executemany(self.UPSERT, rows)
+
+    def ranked(self, limit, anomalies_only=False):
+        """Vehicles by descending fused degradation."""
+        with self._pool().connection() as conn:
+            rows = conn.execute(self.SELECT_RANKED, (1 if anomalies_only else 0, limit)).fetchall()
+        return [
+            {
+                "rank": i + 1,
+                "vehicle_id": r[0],
+                "user_id": r[1],
+                "battery_type": r[2],
+                "reading_ts": r[3],
+                "total_dist_km": r[4],
+                "charging_time_min": r[5],
+                "model_key": r[6],
+                "anomaly_threshold": r[7],
+                "raw_soh": r[8],
+                "charging_cycles": r[9],
+                "degradation_rate": r[10],
+                "predicted_soh": 100.0 - r[10],
+                "is_anomaly": bool(r[11]),
+                "scored_at": r[12]
+            }
+            for i, r in enumerate(rows)
+        ]
+
+
+# Additive counters of the fleet summary tables. A vehicle contributes
+# vehicles=1, scored/valued=1 once it has a predicted SOH/resale value,
+# and its latest SOH, resale value and anomaly flag to the sums.
+SUMMARY_COUNTERS = ("vehicles", "scored", "soh_sum", "valued", "resale_sum", "anomalies")
+# (table, key columns): fleet-wide and per-user grains
+SUMMARY_TABLES = (
+    ("fleet_summary", ("battery_type", "cohort")),
+    ("fleet_summary_user", ("user_id", "battery_type", "cohort")),
+)
+
+
+def _summary_contribution(state, sign="+"):
+    """Select-list of one vehicle_summary row's counters, signed."""
+    return (f"{sign}1, {sign}({state}.soh IS NOT NULL), {sign}coalesce({state}.soh, 0), "
+            f"{sign}({state}.resale_value IS NOT NULL), {sign}coalesce({state}.resale_value, 0), "
+            f"{sign}coalesce({state}.anomaly, 0)")
+
+
+def _summary_upsert(table, keys, select):
+    """Add the rows of `select` (keys then SUMMARY_COUNTERS) to a summary table."""
+    columns = ", ".join(keys + SUMMARY_COUNTERS)
+    increments = ", ".join(f"{c} = {c} + excluded.{c}" for c in SUMMARY_COUNTERS)
+    return f"INSERT INTO {table}({columns}) {select} ON CONFLICT({', '.join(keys)}) DO UPDATE SET {increments}"
+
+
+def _summary_apply(state_where, sign):
+    """Statements adding (sign '+') or removing ('-') vehicle_summary rows from every summary table."""
+    return [
+        _summary_upsert(table, keys, f"SELECT {', '.join(keys)}, {_summary_contribution('s', sign)} "
+                                     f"FROM vehicle_summary s WHERE {state_where}")
+        for table, keys in SUMMARY_TABLES
+    ]
+
+
+def _summary_state_delta(where, soh, resale_value, anomaly):
+    """
+    Upserts moving the vehicle_summary rows matching `where` from their
+    stored SOH/resale value/anomaly to the given ones: one delta row per
+    summary table.
+    """
+    return [
+        _summary_upsert(table, keys, f"""
+            SELECT {", ".join("s." + key for key in keys)}, 0, s.soh IS NULL,
+                   {soh} - coalesce(s.soh, 0),
+                   ({resale_value} IS NOT NULL) - (s.resale_value IS NOT NULL),
+                   coalesce({resale_value}, 0) - coalesce(s.resale_value, 0),
+                   coalesce({anomaly}, 0) - coalesce(s.anomaly, 0)
+            FROM vehicle_summary s WHERE {where}""")
+        for table, keys in SUMMARY_TABLES
+    ]
+
+
+def _summary_rebuild():
+    """Statements recomputing every summary table from vehicle_summary."""
+    statements = []
+    for table, keys in SUMMARY_TABLES:
+        statements.append(f"DELETE FROM {table}")
+        statements.append(f"""
+            INSERT INTO {table}({", ".join(keys + SUMMARY_COUNTERS)})
+            SELECT {", ".join(keys)}, count(*), count(soh), sum(coalesce(soh, 0)),
+                   count(resale_value), sum(coalesce(resale_value, 0)), sum(coalesce(anomaly, 0))
+            FROM vehicle_summary
+            GROUP BY {", ".join(keys)}
+        """)
+    return statements
+
+
+def _summary_tables():
+    return [
+        f"""
+        CREATE TABLE IF NOT EXISTS {table}(
+            {" ".join(key + " TEXT NOT NULL," for key in keys)}
+            vehicles INTEGER NOT NULL,
+            scored INTEGER NOT NULL,
+            soh_sum REAL NOT NULL,
+            valued INTEGER NOT NULL,
+            resale_sum REAL NOT NULL,
+            anomalies INTEGER NOT NULL,
+            PRIMARY KEY({", ".join(keys)})
+        ) WITHOUT ROWID
+        """
+        for table, keys in SUMMARY_TABLES
+    ]
+
+
+def _summary_triggers():
+    """Triggers keeping vehicle_summary and the summary tables in step with `vehicle` and `reading`."""
+    keys_from_new = ("coalesce(NEW.user_id, ''), coalesce(NEW.battery_type, ''), "
+                     "coalesce(substr(NEW.manufacture_date, 1, 7), '')")
+    add_new = "; ".join(_summary_apply("s.vehicle_id = NEW.vehicle_id", "+"))
+    add_old = "; ".join(_summary_apply("s.vehicle_id = OLD.vehicle_id", "+"))
+    remove_old = "; ".join(_summary_apply("s.vehicle_id = OLD.vehicle_id", "-"))
+    # A newer scored reading replaces the vehicle's previous one
+    reading_delta = "; ".join(_summary_state_delta(
+        "s.vehicle_id = NEW.vehicle_id", "NEW.predicted_soh", "NEW.resale_value", "NEW.anomaly"))
+    return [
+        f"""
+        CREATE TRIGGER IF NOT EXISTS vehicle_summary_insert AFTER INSERT ON vehicle
+        BEGIN
+            INSERT OR REPLACE INTO vehicle_summary(vehicle_id, user_id, battery_type, cohort)
+            VALUES(NEW.vehicle_id, {keys_from_new});
+            {add_new};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS vehicle_summary_update
+        AFTER UPDATE OF user_id, battery_type, manufacture_date ON vehicle
+        WHEN OLD.user_id IS NOT NEW.user_id OR OLD.battery_type IS NOT NEW.battery_type
+             OR substr(OLD.manufacture_date, 1, 7) IS NOT substr(NEW.manufacture_date, 1, 7)
+        BEGIN
+            {remove_old};
+            UPDATE vehicle_summary SET (user_id, battery_type, cohort) = ({keys_from_new})
+            WHERE vehicle_id = OLD.vehicle_id;
+            {add_old};
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS vehicle_summary_delete AFTER DELETE ON vehicle
+        BEGIN
+            {remove_old};
+            DELETE FROM vehicle_summary WHERE vehicle_id = OLD.vehicle_id;
+        END
+        """,
+        f"""
+        CREATE TRIGGER IF NOT EXISTS reading_summary AFTER INSERT ON reading
+        WHEN NEW.predicted_soh IS NOT NULL AND EXISTS (
+            SELECT 1 FROM vehicle_summary WHERE vehicle_id = NEW.vehicle_id AND coalesce(ts, -1) <= NEW.ts
+        )
+        BEGIN
+            {reading_delta};
+            UPDATE vehicle_summary
+            SET soh = NEW.predicted_soh, resale_value = NEW.resale_value,
+                anomaly = coalesce(NEW.anomaly, 0), ts = NEW.ts
+            WHERE vehicle_id = NEW.vehicle_id;
+        END
+        """,
+    ]
+
+
+class FleetSummaryRepository:
+    """
+    Fleet aggregates kept current by triggers instead of scans.
+    `vehicle_summary` holds one row per registered vehicle: its group keys
+    (owner, battery type, manufacture month as `cohort` 'YYYY-MM') and its
+    latest scored SOH, resale value and anomaly flag. The triggers fire
+    on every vehicle insert/update/delete and reading insert, in the
+    writer's transaction. They apply the change as a delta of
+    SUMMARY_COUNTERS to `fleet_summary` (per battery type and cohort) and
+    `fleet_summary_user` (per user, battery type and cohort), so a fleet
+    query reads a few hundred rows at most, whatever the fleet size.
+    score() applies the same delta for scores that are not stored as
+    readings. Scores older than a vehicle's latest are not applied, and
+    applying the same score twice (once by score(), once by its reading)
+    changes nothing.
+    """
+
+    _COUNTERS = ", ".join(SUMMARY_COUNTERS)
+    SELECT_FLEET = f"""
+        SELECT battery_type, cohort, {_COUNTERS}
+        FROM fleet_summary
+        WHERE vehicles > 0
+    """
+    SELECT_USER = f"""
+        SELECT battery_type, cohort, {_COUNTERS}
+        FROM fleet_summary_user
+        WHERE user_id = ? AND vehicles > 0
+    """
+    # Keyset page of users, then all their rows through the primary key
+    SELECT_USER_PAGE = """
+        SELECT DISTINCT user_id
+        FROM fleet_summary_user
+        WHERE user_id > ?
+        ORDER BY user_id
+        LIMIT ?
+    """
+    SELECT_USERS = f"""
+        SELECT user_id, battery_type, cohort, {_COUNTERS}
+        FROM fleet_summary_user
+        WHERE user_id >= ? AND user_id <= ? AND vehicles > 0
+        ORDER BY user_id
+    """
+    REBUILD = tuple(_summary_rebuild())
+    # The reading_summary trigger, for a (vehicle_id, ts, soh, resale_value, anomaly) row
+    _NEWER = "vehicle_id = :vehicle_id AND coalesce(ts, -1) <= :ts"
+    SCORE = tuple(_summary_state_delta(_NEWER, ":soh", ":resale_value", ":anomaly")) + (f"""
+        UPDATE vehicle_summary
+        SET soh = :soh, resale_value = :resale_value, anomaly = coalesce(:anomaly, 0), ts = :ts
+        WHERE {_NEWER}
+    """,)
+
+    def __init__(self, pool_factory=get_pool):
+        self._pool = pool_factory
+
+    def fleet(self, user_id=None):
+        """(battery_type, cohort, *SUMMARY_COUNTERS) rows, fleet-wide or for one user."""
+        with self._pool().connection() as conn:
+            if user_id is None:
+                return conn.execute(self.SELECT_FLEET).fetchall()
+            return conn.execute(self.SELECT_USER, (user_id,)).fetchall()
+
+    def users(self, after="", limit=100):
+        """
+        ((user_id, battery_type, cohort, *SUMMARY_COUNTERS) rows, cursor) for up
+        to `limit` users with user_id > `after`. The cursor is the page's last
+        user_id, or None when there are no more users.
+        """
+        with self._pool().connection() as conn:
+            page = [r[0] for r in conn.execute(self.SELECT_USER_PAGE, (after or "", limit))]
+            if not page:
+                return [], None
+            rows = conn.execute(self.SELECT_USERS, (page[0], page[-1])).fetchall()
+        return rows, page[-1] if len(page) == limit else None
+
+    def score(self, rows):
+        """
+        Make (vehicle_id, ts, soh, resale_value, anomaly) each vehicle's latest
+        score, in one transaction. At most one row per vehicle.
+        """
+        params = [dict(zip(("vehicle_id", "ts", "soh", "resale_value", "anomaly"), row)) for row in rows]
+        with self._pool().transaction() as conn:
+            for statement in self.SCORE:
+                conn.executemany(statement, params)
+
+    def rebuild(self):
+        """Recompute the summary tables from vehicle_summary (repairs float drift of the sums)."""
+        with self._pool().transaction() as conn:
+            for statement in self.REBUILD:
+                conn.execute(statement)
+
+
+vehicles = VehicleRepository()
+readings = ReadingRepository()
+anomalies = AnomalyRepository()
+fleet_summaries = FleetSummaryRepository()
+
+
+# Schema migrations, applied in order by init_db(). PRAGMA user_version holds
+# the number applied so far: append new entries, never edit released ones.
+# IF NOT EXISTS keeps the first steps safe on databases created before versioning.
+MIGRATIONS = (
+    ("vehicle table", (
+        """
+        CREATE TABLE IF NOT EXISTS vehicle(
+            user_id TEXT,
+            vehicle_id TEXT,
+            battery_type TEXT,
+            buying_price REAL,
+            buying_date TEXT,
+            manufacture_date TEXT,
+            PRIMARY KEY(vehicle_id)
+        )
+        """,
+    )),
+    ("readings time series and daily rollups", (
+        """
+        CREATE TABLE IF NOT EXISTS reading(
+            vehicle_id TEXT NOT NULL,
+            ts INTEGER NOT NULL,
+            total_dist_km REAL,
+            charging_time_min REAL,
+            predicted_soh REAL,
+            degradation_rate REAL,
+            anomaly INTEGER
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS reading_vehicle_ts ON reading(vehicle_id, ts)",
+        "CREATE INDEX IF NOT EXISTS reading_ts ON reading(ts)",
+        """
+        CREATE TABLE IF NOT EXISTS reading_daily(
+            vehicle_id TEXT NOT NULL,
+            day TEXT NOT NULL,
+            battery_type TEXT,
+            readings INTEGER,
+            soh_sum REAL,
+            soh_min REAL,
+            soh_max REAL,
+            km_max REAL,
+            anomalies INTEGER,
+            PRIMARY KEY(vehicle_id, day)
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS reading_daily_day ON reading_daily(day, battery_type)",
+        """
+        CREATE TABLE IF NOT EXISTS reading_fleet_daily(
+            day TEXT NOT NULL,
+            battery_type TEXT NOT NULL,
+            vehicles INTEGER,
+            readings INTEGER,
+            soh_sum REAL,
+            soh_min REAL,
+            soh_max REAL,
+            anomalies INTEGER,
+            PRIMARY KEY(day, battery_type)
+        ) WITHOUT ROWID
+        """,
+    )),
+    ("per-user vehicle index for listings, keyset pagination and (user_id, vehicle_id) lookups", (
+        "CREATE INDEX IF NOT EXISTS vehicle_user ON vehicle(user_id, vehicle_id)",
+        "ANALYZE vehicle",
+    )),
+    ("fleet anomaly scores", (
+        """
+        CREATE TABLE IF NOT EXISTS vehicle_anomaly(
+            vehicle_id TEXT PRIMARY KEY,
+            user_id TEXT,
+            battery_type TEXT,
+            reading_ts INTEGER,
+            total_dist_km REAL,
+            charging_time_min REAL,
+            model_key TEXT,
+            threshold REAL,
+            raw_soh REAL,
+            charging_cycles REAL,
+            degradation REAL,
+            is_anomaly INTEGER,
+            scored_at INTEGER
+        ) WITHOUT ROWID
+        """,
+        "CREATE INDEX IF NOT EXISTS vehicle_anomaly_rank ON vehicle_anomaly(degradation DESC)",
+    )),
+    ("incrementally maintained fleet summaries", (
+        "ALTER TABLE reading ADD COLUMN resale_value REAL",
+        """
+        CREATE TABLE IF NOT EXISTS vehicle_summary(
+            vehicle_id TEXT PRIMARY KEY,
+            user_id TEXT NOT NULL,
+            battery_type TEXT NOT NULL,
+            cohort TEXT NOT NULL,
+            soh REAL,
+            resale_value REAL,
+            anomaly INTEGER,
+            ts INTEGER
+        ) WITHOUT ROWID
+        """,
+        *_summary_tables(),
+        # Existing vehicles with their latest scored reading
+        """
+        INSERT OR IGNORE INTO vehicle_summary
+        SELECT v.vehicle_id, coalesce(v.user_id, ''), coalesce(v.battery_type, ''),
+               coalesce(substr(v.manufacture_date, 1, 7), ''),
+               r.predicted_soh, r.resale_value, r.anomaly, r.ts
+        FROM vehicle v
+        LEFT JOIN reading r ON r.rowid = (
+            SELECT rowid FROM reading
+            WHERE vehicle_id = v.vehicle_id AND predicted_soh IS NOT NULL
+            ORDER BY ts DESC LIMIT 1
+        )
+        """,
+        *_summary_rebuild(),
+        *_summary_triggers(),
+    )),
+)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn, migrations=MIGRATIONS):
+    """
+    Apply the migrations `conn`'s database hasn't seen yet, each in its own
+    transaction together with the user_version bump. BEGIN IMMEDIATE takes
+    the write lock first, so workers starting at the same time apply every
+    step exactly once. Returns the resulting schema version.
+    """
+    while True:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            version = schema_version(conn)
+            if version >= len(migrations):
+                conn.rollback()
+                return version
+            description, statements = migrations[version]
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(f"PRAGMA user_version = {version + 1}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        logger.info("Applied schema migration %d: %s", version + 1, description)
+
+
+def init_db():
 
-    conn.commit()
-    conn.close()
\ No newline at end of file
+    with get_pool().connection() as conn:
+        migrate(conn)
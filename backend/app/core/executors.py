@@ -0,0 +1,132 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from app.core.batching import MICRO_BATCH_MAX_SIZE
+from app.core.inference import load_models, predict_batch
+from app.core.instrumentation import INSTRUMENTATION, log_event, observe, sampled, stages_ms
+
+
+logger = logging.getLogger(__name__)
+
+
+# Threads dedicated to blocking SQLite calls, separate from Starlette's threadpool
+DB_IO_WORKERS = int(os.getenv("DB_IO_WORKERS", "8"))
+# Inference processes; 0 runs inference on a thread in the API process instead
+INFERENCE_WORKERS = int(os.getenv("INFERENCE_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Rows queued or running on the inference pool before new batches are rejected.
+# Counted in rows because a coalesced /predict batch carries up to
+# MICRO_BATCH_MAX_SIZE requests; the default is 8 full batches per worker.
+INFERENCE_MAX_PENDING_ROWS = int(os.getenv(
+    "INFERENCE_MAX_PENDING_ROWS", str(max(1, INFERENCE_WORKERS) * 8 * MICRO_BATCH_MAX_SIZE)))
+
+
+class InferenceSaturated(Exception):
+    """Raised when a batch would take the inference pool past INFERENCE_MAX_PENDING_ROWS rows."""
+
+
+_db_executor = None
+
+
+def get_db_executor():
+    global _db_executor
+    if _db_executor is None:
+        _db_executor = ThreadPoolExecutor(max_workers=DB_IO_WORKERS, thread_name_prefix="db-io")
+    return _db_executor
+
+
+async def run_db(fn, *args):
+    """Run a blocking repository call on the dedicated DB I/O threads."""
+    return await asyncio.get_running_loop().run_in_executor(get_db_executor(), fn, *args)
+
+
+# Per-process model copies, loaded once by the pool initializer
+_worker_models = None
+
+
+def _init_worker(model_dir, load_options):
+    global _worker_models
+    _worker_models = load_models(model_dir, **load_options)
+
+
+def _ping():
+    return os.getpid()
+
+
+def _predict_timed(models, df_input, anomaly_threshold, collect_timings):
+    """Returns (results, stage timings or None); timings are recorded by the API process."""
+    timings = {} if collect_timings else None
+    return predict_batch(models, df_input, anomaly_threshold, timings=timings), timings
+
+
+def _predict_in_worker(df_input, anomaly_threshold, collect_timings):
+    return _predict_timed(_worker_models, df_input, anomaly_threshold, collect_timings)
+
+
+class InferenceExecutor:
+    """
+    Bounded pool for CPU-bound model inference. Each worker process opens the
+    models with load_models(model_dir, **load_options) at start-up (memory-mapped
+    compiled models are shared between workers); with workers=0 inference
+    runs on a single thread against `local_models()` from the API process.
+    """
+
+    def __init__(self, model_dir, load_options, local_models,
+                 workers=INFERENCE_WORKERS, max_pending_rows=INFERENCE_MAX_PENDING_ROWS):
+        self.max_pending_rows = max_pending_rows
+        self.local_models = local_models
+        self._pending_rows = 0
+        self.workers = workers
+        if workers > 0:
+            # spawn: forking the server process (event loop, DB threads) is unsafe
+            self._pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_worker,
+                initargs=(model_dir, load_options),
+            )
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="inference")
+
+    @property
+    def pending_rows(self):
+        return self._pending_rows
+
+    async def predict(self, df_input, anomaly_threshold):
+        """
+        Score df_input off the event loop; raises InferenceSaturated instead of
+        queueing unboundedly. A batch larger than the limit still runs on an
+        idle pool, so it is delayed rather than rejected forever.
+        """
+        rows = len(df_input)
+        # Only touched from the event loop thread, so no lock is needed
+        if self._pending_rows and self._pending_rows + rows > self.max_pending_rows:
+            raise InferenceSaturated()
+        self._pending_rows += rows
+        try:
+            loop = asyncio.get_running_loop()
+            if isinstance(self._pool, ProcessPoolExecutor):
+                results, timings = await loop.run_in_executor(
+                    self._pool, _predict_in_worker, df_input, anomaly_threshold, INSTRUMENTATION
+                )
+            else:
+                results, timings = await loop.run_in_executor(
+                    self._pool, _predict_timed, self.local_models(), df_input, anomaly_threshold, INSTRUMENTATION
+                )
+        finally:
+            self._pending_rows -= rows
+        observe(timings)
+        if sampled():
+            log_event(logger, "inference_batch", rows=len(df_input), stages_ms=stages_ms(timings))
+        return results
+
+    def warm_up(self):
+        """Start every worker (and load its models) now rather than on the first request."""
+        for future in [self._pool.submit(_ping) for _ in range(max(1, self.workers))]:
+            future.result()
+
+    def shutdown(self, cancel_futures=True):
+        """Stop the pool; with cancel_futures=False queued requests are still scored first."""
+        self._pool.shutdown(wait=True, cancel_futures=cancel_futures)
@@ -0,0 +1,93 @@
+"""
+Typed model inputs for the Stage 1 -> Stage 2 cascade.
+
+A FeatureFrame holds a batch's numeric features in one preallocated,
+C-contiguous float32 matrix whose columns follow the Stage 2 training
+schema (NUMERIC_COLUMNS; Stage 1 reads the leading two), and the battery
+type as integer codes into the batch's distinct labels. Stage 1 outputs
+are written into their columns in place, so nothing is reallocated between
+stages, and labels are only handled per distinct value: once when the
+frame is built and once per model when they are mapped to its one-hot
+categories.
+"""
+import numpy as np
+import pandas as pd
+
+
+# Stage 1 latent features, in the order the Stage 2 model was trained with
+LATENT_FEATURES = ['charging_cycles', 'efficiency', 'battery_temp']
+CATEGORICAL_COLUMN = 'battery_type'
+INPUT_COLUMNS = ['total_dist_km', 'charging_time_min']
+NUMERIC_COLUMNS = INPUT_COLUMNS + [f'pred_{name}' for name in LATENT_FEATURES]
+# DataFrame columns of the Stage 1 and Stage 2 training sets
+BASE_COLUMNS = [CATEGORICAL_COLUMN] + INPUT_COLUMNS
+STAGE2_COLUMNS = BASE_COLUMNS + NUMERIC_COLUMNS[len(INPUT_COLUMNS):]
+
+
+class FeatureFrame:
+    """
+    values      float32 (n, len(NUMERIC_COLUMNS)); latent columns start as NaN
+    codes       intp (n,) index of each row's battery type in `categories`
+    categories  distinct battery type labels (str) of the batch
+    """
+
+    def __init__(self, codes, categories, values):
+        self.codes = codes
+        self.categories = categories
+        self.values = values
+
+    @classmethod
+    def from_columns(cls, battery_type, total_dist_km, charging_time_min):
+        codes, categories = pd.factorize(battery_type, use_na_sentinel=False)
+        values = np.full((len(codes), len(NUMERIC_COLUMNS)), np.nan, dtype=np.float32)
+        values[:, 0] = total_dist_km
+        values[:, 1] = charging_time_min
+        return cls(codes, np.asarray(categories, dtype=str), values)
+
+    @classmethod
+    def from_frame(cls, df):
+        """From a DataFrame with BASE_COLUMNS (extra columns are ignored)."""
+        return cls.from_columns(df[CATEGORICAL_COLUMN].to_numpy(), df['total_dist_km'].to_numpy(),
+                                df['charging_time_min'].to_numpy())
+
+    def __len__(self):
+        return len(self.codes)
+
+    def column(self, name):
+        """View of one numeric column."""
+        return self.values[:, NUMERIC_COLUMNS.index(name)]
+
+    def set_column(self, name, values):
+        self.values[:, NUMERIC_COLUMNS.index(name)] = values
+
+    def set_latent(self, preds):
+        """Write Stage 1 outputs, an (n, len(LATENT_FEATURES)) array in LATENT_FEATURES order."""
+        self.values[:, len(INPUT_COLUMNS):] = preds
+
+    def numeric(self, columns):
+        """The given numeric columns as an (n, k) array; a view when they lead NUMERIC_COLUMNS in order."""
+        if list(columns) == NUMERIC_COLUMNS[:len(columns)]:
+            return self.values[:, :len(columns)]
+        return self.values[:, [NUMERIC_COLUMNS.index(name) for name in columns]]
+
+    def positions(self, categories):
+        """
+        Index of each row's battery type in `categories` (a sorted label
+        array, e.g. a fitted one-hot encoder's), -1 where it is unknown.
+        """
+        pos = np.minimum(np.searchsorted(categories, self.categories), len(categories) - 1)
+        known = categories[pos] == self.categories
+        return np.where(known, pos, -1)[self.codes]
+
+    def labels(self):
+        return self.categories[self.codes]
+
+    def to_frame(self, columns=STAGE2_COLUMNS):
+        """DataFrame view for sklearn pipelines: categorical battery_type, float32 numerics."""
+        data = {}
+        for name in columns:
+            if name == CATEGORICAL_COLUMN:
+                data[name] = pd.Categorical.from_codes(self.codes, categories=self.categories)
+            else:
+                data[name] = self.column(name)
+        return pd.DataFrame(data, copy=False)
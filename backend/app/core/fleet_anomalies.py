@@ -0,0 +1,196 @@
+"""
+Fleet anomaly scoring: every registered vehicle's latest reading through the
+model cascade and physics fusion, flagged against the versioned anomaly
+threshold and written to the ranked `vehicle_anomaly` table.
+
+    cd backend
+    python -m app.core.fleet_anomalies run [--full] [--workers N] [--report top.csv --top 500]
+    python -m app.core.fleet_anomalies report --top 100 [--anomalies-only]
+
+Models and threshold come from the registry's current version (or --version),
+else the flat app/models directory with results/anomaly_metrics.csv, exactly
+as the API loads them. Vehicles are read in keyset chunks and scored in a
+process pool while the next chunk is read; results are written by the main
+process. Runs are incremental: only vehicles that were never scored, whose
+battery type or latest mileage/charging time changed, or that were scored by
+another model set or threshold are read and re-scored (--full re-scores all).
+"""
+import argparse
+import csv
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from app.core import physics
+from app.core.database import anomalies as anomaly_repo, init_db
+from app.core.features import FeatureFrame
+from app.core.inference import load_models, run_cascade
+from app.core.registry import MODEL_REGISTRY_DIR, ModelRegistry, read_anomaly_threshold
+from app.core.surface import model_fingerprint
+
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+MODEL_DIR = os.path.join(APP_DIR, "models")
+ANOMALY_METRICS = os.path.join(APP_DIR, "results", "anomaly_metrics.csv")
+# Vehicles read, scored and written per chunk
+FLEET_CHUNK_SIZE = int(os.getenv("FLEET_CHUNK_SIZE", "5000"))
+FLEET_WORKERS = int(os.getenv("FLEET_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_models(registry=None, version=None, model_dir=None, stage1_mode='separate'):
+    """
+    (model_dir, stage1_mode, model_key, threshold) for a registry version
+    ('current' or an id), or for the flat MODEL_DIR when no version is given
+    or active. model_key identifies the model set in the anomaly table.
+    """
+    registry = registry or ModelRegistry(MODEL_REGISTRY_DIR)
+    if model_dir is None and version is not None:
+        version = registry.current() if version == 'current' else version
+    if model_dir is None and version is not None:
+        manifest = registry.verify(version)
+        return registry.version_dir(version), manifest['stage1_mode'], version, manifest['anomaly_threshold']
+    model_dir = model_dir or MODEL_DIR
+    metrics = os.path.join(model_dir, "anomaly_metrics.csv")
+    threshold = read_anomaly_threshold(metrics if os.path.exists(metrics) else ANOMALY_METRICS)
+    return model_dir, stage1_mode, f"sha256:{model_fingerprint(model_dir, stage1_mode)[:16]}", threshold
+
+
+# Per-process model copies, loaded once by the pool initializer
+_worker_models = None
+
+
+def _init_worker(model_dir, stage1_mode):
+    global _worker_models
+    _worker_models = load_models(model_dir, stage1_mode=stage1_mode)
+
+
+def score_chunk(models, battery_type, total_dist_km, charging_time_min):
+    """(raw_soh, charging_cycles, degradation) arrays for one chunk of vehicles."""
+    frame = FeatureFrame.from_columns(battery_type, total_dist_km, charging_time_min)
+    latent, raw_soh = run_cascade(models, frame)
+    cycles = latent['pred_charging_cycles']
+    return raw_soh, cycles, physics.fuse_degradation(raw_soh, total_dist_km, cycles)
+
+
+def _score_in_worker(battery_type, total_dist_km, charging_time_min):
+    return score_chunk(_worker_models, battery_type, total_dist_km, charging_time_min)
+
+
+def _result_rows(rows, scores, model_key, threshold, scored_at):
+    raw_soh, cycles, degradation = scores
+    return [
+        (vehicle_id, user_id, battery_type, ts, km, minutes, model_key, threshold,
+         float(raw_soh[i]), float(cycles[i]), float(degradation[i]), int(degradation[i] > threshold), scored_at)
+        for i, (vehicle_id, user_id, battery_type, ts, km, minutes) in enumerate(rows)
+    ]
+
+
+def run(model_dir, stage1_mode, model_key, threshold, full=False, workers=FLEET_WORKERS,
+        chunk_size=FLEET_CHUNK_SIZE, repo=anomaly_repo):
+    """
+    Score every vehicle whose inputs changed (all of them with `full`) and
+    upsert the results. workers=0 scores in this process. Returns run stats.
+    """
+    start = time.perf_counter()
+    scored_at = time.time_ns() // 1_000_000
+    stats = {"model_key": model_key, "anomaly_threshold": threshold, "full": full,
+             "chunks": 0, "vehicles_scored": 0, "anomalies": 0}
+
+    if workers > 0:
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=_init_worker, initargs=(model_dir, stage1_mode))
+        submit = lambda *args: pool.submit(_score_in_worker, *args)
+    else:
+        pool, models = None, load_models(model_dir, stage1_mode=stage1_mode)
+
+    def write(rows, scores):
+        results = _result_rows(rows, scores, model_key, threshold, scored_at)
+        repo.upsert_many(results)
+        stats["chunks"] += 1
+        stats["vehicles_scored"] += len(results)
+        stats["anomalies"] += sum(r[11] for r in results)
+
+    pending = {}
+    after = ""
+    try:
+        while True:
+            rows = repo.inputs(after, chunk_size, model_key, threshold, changed_only=not full)
+            if not rows:
+                break
+            after = rows[-1][0]
+            columns = list(zip(*rows))
+            args = (list(columns[2]), np.asarray(columns[4], dtype=float), np.asarray(columns[5], dtype=float))
+            if pool is None:
+                write(rows, score_chunk(models, *args))
+                continue
+            pending[submit(*args)] = rows
+            # Keep every worker busy plus one chunk queued each; write finished chunks meanwhile
+            if len(pending) >= workers * 2:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    write(pending.pop(future), future.result())
+        for future in list(pending):
+            write(pending.pop(future), future.result())
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    stats["seconds"] = round(time.perf_counter() - start, 3)
+    stats["vehicles_per_sec"] = round(stats["vehicles_scored"] / stats["seconds"], 1) if stats["seconds"] else None
+    logger.info("fleet anomaly run: %s", stats)
+    return stats
+
+
+def write_report(path, entries):
+    """Ranked entries (AnomalyRepository.ranked) as CSV; '-' writes to stdout."""
+    fields = list(entries[0]) if entries else ["rank", "vehicle_id"]
+    f = sys.stdout if path == '-' else open(path, 'w', newline='')
+    try:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(entries)
+    finally:
+        if f is not sys.stdout:
+            f.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    score = commands.add_parser('run', help="Score changed vehicles and update the anomaly table.")
+    score.add_argument('--models', help="Model directory (default: the registry version, else app/models).")
+    score.add_argument('--version', default='current', help="Registry version id, or 'current'.")
+    score.add_argument('--stage1-mode', choices=['separate', 'multi'], default='separate',
+                       help="For --models / the flat directory; versions use their manifest.")
+    score.add_argument('--full', action='store_true', help="Re-score every vehicle.")
+    score.add_argument('--workers', type=int, default=FLEET_WORKERS, help="0 scores in this process.")
+    score.add_argument('--chunk-size', type=int, default=FLEET_CHUNK_SIZE)
+    for command in (score, commands.add_parser('report', help="Print or save the ranked anomaly table.")):
+        command.add_argument('--report', default=None if command is score else '-',
+                             help="CSV path for the ranking ('-' for stdout).")
+        command.add_argument('--top', type=int, default=100)
+        command.add_argument('--anomalies-only', action='store_true')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    init_db()
+
+    if args.command == 'run':
+        model_dir, stage1_mode, model_key, threshold = resolve_models(
+            version=args.version, model_dir=args.models, stage1_mode=args.stage1_mode
+        )
+        print(json.dumps(run(model_dir, stage1_mode, model_key, threshold, args.full,
+                             args.workers, args.chunk_size), indent=2))
+    if args.report:
+        write_report(args.report, anomaly_repo.ranked(args.top, args.anomalies_only))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,141 @@
+"""
+Fleet aggregates (SOH, resale value, anomalies, material totals) grouped
+by chemistry, battery type, user or age bucket, read from the summary
+tables the database triggers keep current (see FleetSummaryRepository).
+
+    cd backend
+    python -m app.core.fleet_summary show [--group-by chemistry] [--user-id U]
+    python -m app.core.fleet_summary rebuild
+
+The tables are keyed by battery type and manufacture month, so chemistry
+and age are resolved here over a few hundred rows. Chemistry comes from
+physics.chemistry_of; age is measured from the manufacture month to
+`today` in whole months, so vehicles move to the next age bucket without
+any write. Material totals are per-chemistry pack compositions times
+vehicle counts.
+"""
+import argparse
+import json
+from collections import defaultdict
+from datetime import date
+
+from app.core import physics
+from app.core.database import SUMMARY_COUNTERS, fleet_summaries as summary_repo
+
+
+GROUP_BY = ("none", "chemistry", "battery_type", "age_bucket", "user")
+# Upper bound (years, exclusive) and label of each age bucket; the last is open-ended
+AGE_BUCKETS = ((1, "<1y"), (3, "1-3y"), (5, "3-5y"), (8, "5-8y"), (None, "8y+"))
+UNKNOWN_AGE = "unknown"
+AGE_ORDER = [label for _, label in AGE_BUCKETS] + [UNKNOWN_AGE]
+
+
+def age_bucket(cohort, today):
+    """Age bucket label of a manufacture month 'YYYY-MM' on `today`."""
+    try:
+        year, month = int(cohort[:4]), int(cohort[5:7])
+    except (TypeError, ValueError):
+        return UNKNOWN_AGE
+    years = ((today.year - year) * 12 + today.month - month) / 12
+    for bound, label in AGE_BUCKETS:
+        if bound is None or years < bound:
+            return label
+
+
+def _group_entry(key, counters, vehicles_by_chemistry):
+    vehicles, scored, soh_sum, valued, resale_sum, anomalies = counters
+    materials = defaultdict(float)
+    for chemistry, count in vehicles_by_chemistry.items():
+        for name, grams in physics.CHEMISTRIES[chemistry]["materials"].items():
+            materials[name] += grams * count
+    return {
+        "key": key,
+        "vehicles": vehicles,
+        "scored_vehicles": scored,
+        "soh_avg": soh_sum / scored if scored else None,
+        "anomalies": anomalies,
+        "anomaly_rate": anomalies / scored if scored else None,
+        "resale_value_usd": round(resale_sum, 2),
+        "resale_value_avg": resale_sum / valued if valued else None,
+        "vehicles_by_chemistry": dict(vehicles_by_chemistry),
+        "material_composition_g": dict(materials),
+    }
+
+
+def summarize(rows, key_of):
+    """
+    Group (battery_type, cohort, *SUMMARY_COUNTERS) rows by key_of(battery_type,
+    cohort) and return one entry per group, in key order.
+    """
+    counters = defaultdict(lambda: [0] * len(SUMMARY_COUNTERS))
+    chemistry = defaultdict(lambda: defaultdict(int))
+    chemistry_of = {}
+    for battery_type, cohort, *values in rows:
+        key = key_of(battery_type, cohort)
+        total = counters[key]
+        for i, value in enumerate(values):
+            total[i] += value
+        if battery_type not in chemistry_of:
+            chemistry_of[battery_type] = physics.chemistry_of(battery_type)
+        chemistry[key][chemistry_of[battery_type]] += values[0]
+    return [_group_entry(key, counters[key], chemistry[key]) for key in sorted(counters, key=str)]
+
+
+def fleet_summary(group_by="none", user_id=None, after=None, limit=100, repo=summary_repo, today=None):
+    """
+    Aggregates for the whole fleet or one user's vehicles, grouped by
+    `group_by` (one of GROUP_BY). group_by='user' pages through users in
+    user_id order: `limit` users after `after`, with `next_after` for the
+    next page (None on the last).
+    """
+    if group_by not in GROUP_BY:
+        raise ValueError(f"group_by must be one of {', '.join(GROUP_BY)}")
+    today = today or date.today()
+    result = {"group_by": group_by, "user_id": user_id}
+
+    if group_by == "user":
+        rows, last = repo.users(after, limit) if user_id is None else (
+            [(user_id, *row) for row in repo.fleet(user_id)], None)
+        by_user = defaultdict(list)
+        for owner, *row in rows:
+            by_user[owner].append(row)
+        result["groups"] = [summarize(by_user[owner], lambda *_: owner)[0] for owner in sorted(by_user)]
+        result["next_after"] = last
+        return result
+
+    key_of = {
+        "none": lambda battery_type, cohort: "all",
+        "chemistry": lambda battery_type, cohort: physics.chemistry_of(battery_type),
+        "battery_type": lambda battery_type, cohort: battery_type,
+        "age_bucket": lambda battery_type, cohort: age_bucket(cohort, today),
+    }[group_by]
+    groups = summarize(repo.fleet(user_id), key_of)
+    if group_by == "age_bucket":
+        groups.sort(key=lambda group: AGE_ORDER.index(group["key"]))
+    result["groups"] = groups
+    return result
+
+
+def main():
+    from app.core.database import init_db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    show = commands.add_parser('show', help="Print fleet aggregates as JSON.")
+    show.add_argument('--group-by', choices=GROUP_BY, default='none')
+    show.add_argument('--user-id')
+    show.add_argument('--after')
+    show.add_argument('--limit', type=int, default=100)
+    commands.add_parser('rebuild', help="Recompute the summary tables from the per-vehicle state.")
+    args = parser.parse_args()
+
+    init_db()
+    if args.command == 'rebuild':
+        summary_repo.rebuild()
+        print("Fleet summaries rebuilt")
+    else:
+        print(json.dumps(fleet_summary(args.group_by, args.user_id, args.after, args.limit), indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import logging
+import os
+import threading
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from app.core import physics
+from app.core.compiled import CompiledPipeline, COMPILED_SUFFIX, MMAP_SUFFIX, file_digest, is_unpacked, unpack
+from app.core.features import BASE_COLUMNS, LATENT_FEATURES, STAGE2_COLUMNS, FeatureFrame
+from app.core.instrumentation import timed
+
+
+STAGE1_MODELS = {
+    'charging_cycles': 'stage1_charging_cycles.pkl',
+    'efficiency': 'stage1_efficiency.pkl',
+    'battery_temp': 'stage1_battery_temp.pkl'
+}
+# Single forest predicting every latent feature, columns in LATENT_FEATURES order
+STAGE1_MULTI_MODEL = 'stage1_multi.pkl'
+STAGE2_MODEL = 'stage2_soh_model.pkl'
+
+logger = logging.getLogger(__name__)
+
+
+def load_model(path, use_compiled=True, mmap=True, unpack_arrays=True):
+    """
+    Load a pickled pipeline, or its compiled sidecar when available. With
+    mmap, the .npz is served from its .arrays directory with read-only
+    memory maps, so worker processes share the model pages. The directory
+    is used only if it was unpacked from the .npz as it is now (see
+    compiled.SOURCE_DIGEST); otherwise it is unpacked again, unless
+    unpack_arrays is False (published registry versions are read-only),
+    in which case the .npz is loaded as a private copy.
+    """
+    stem = os.path.splitext(path)[0]
+    compiled_path = stem + COMPILED_SUFFIX
+    mmap_path = stem + MMAP_SUFFIX
+    if use_compiled and os.path.exists(compiled_path):
+        if mmap:
+            digest = file_digest(compiled_path)
+            try:
+                if not is_unpacked(compiled_path, mmap_path, digest):
+                    if not unpack_arrays:
+                        return CompiledPipeline.load(compiled_path)
+                    unpack(compiled_path, mmap_path, digest)
+                return CompiledPipeline.load_mmap(mmap_path)
+            except OSError:
+                # Read-only or foreign-owned model directory: serve a private copy instead
+                logger.warning("Cannot memory-map %s, loading %s", mmap_path, compiled_path, exc_info=True)
+        return CompiledPipeline.load(compiled_path)
+    if use_compiled and mmap and os.path.isdir(mmap_path):
+        return CompiledPipeline.load_mmap(mmap_path)
+    return joblib.load(path)
+
+
+def model_available(path, use_compiled=True):
+    stem = os.path.splitext(path)[0]
+    candidates = [path]
+    if use_compiled:
+        candidates += [stem + COMPILED_SUFFIX, stem + MMAP_SUFFIX]
+    return any(os.path.exists(candidate) for candidate in candidates)
+
+
+class LazyModel:
+    """Stands in for a model and loads it on the first predict() call."""
+
+    def __init__(self, path, use_compiled=True, mmap=True, unpack_arrays=True):
+        self.path = path
+        self.use_compiled = use_compiled
+        self.mmap = mmap
+        self.unpack_arrays = unpack_arrays
+        self._model = None
+        self._lock = threading.Lock()
+
+    @property
+    def model(self):
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    self._model = load_model(self.path, self.use_compiled, self.mmap, self.unpack_arrays)
+        return self._model
+
+    def predict(self, df):
+        return self.model.predict(df)
+
+
+def load_models(model_dir, use_compiled=True, stage1_mode='separate', lazy=False, mmap=True, unpack_arrays=True):
+    """
+    Load the Stage 1 models and the Stage 2 model into a dict keyed like
+    STAGE1_MODELS + 'stage2', or 'stage1_multi' + 'stage2' when stage1_mode
+    is 'multi'. The mode must match the one Stage 2 was trained with.
+
+    With lazy, only the presence of every model file is checked here and
+    each model is loaded on first use. Missing files raise FileNotFoundError.
+    unpack_arrays is passed to load_model.
+    """
+    if stage1_mode == 'multi':
+        files = {'stage1_multi': STAGE1_MULTI_MODEL}
+    else:
+        files = dict(STAGE1_MODELS)
+    files['stage2'] = STAGE2_MODEL
+
+    paths = {name: os.path.join(model_dir, filename) for name, filename in files.items()}
+    missing = [path for path in paths.values() if not model_available(path, use_compiled)]
+    if missing:
+        raise FileNotFoundError(f"Model files not found: {', '.join(missing)}")
+
+    if lazy:
+        return {name: LazyModel(path, use_compiled, mmap, unpack_arrays) for name, path in paths.items()}
+    return {name: load_model(path, use_compiled, mmap, unpack_arrays) for name, path in paths.items()}
+
+
+def _predict(model, frame, columns):
+    """Compiled models read the FeatureFrame directly; sklearn pipelines get a DataFrame of `columns`."""
+    if isinstance(model, LazyModel):
+        model = model.model
+    if isinstance(model, CompiledPipeline):
+        return np.asarray(model.predict_features(frame), dtype=float)
+    return np.asarray(model.predict(frame.to_frame(columns)), dtype=float)
+
+
+def run_cascade(models, features, timings=None):
+    """
+    Run the Stage 1 -> Stage 2 cascade over every row of `features`, a
+    FeatureFrame or a DataFrame with BASE_COLUMNS. One predict call per
+    stage, regardless of the number of rows; Stage 1 outputs are written
+    into the frame's latent columns for Stage 2.
+    Returns (latent, raw_soh) where latent maps 'pred_<name>' to an array.
+    Per-model durations are added to `timings` when given (see instrumentation.timed).
+    """
+    frame = features if isinstance(features, FeatureFrame) else FeatureFrame.from_frame(features)
+
+    # Stage 1: Latent Feature Estimation
+    latent = {}
+    if 'stage1_multi' in models:
+        with timed(timings, 'stage1_multi'):
+            preds = _predict(models['stage1_multi'], frame, BASE_COLUMNS).reshape(len(frame), -1)
+        for i, name in enumerate(LATENT_FEATURES):
+            latent[f'pred_{name}'] = preds[:, i]
+        frame.set_latent(preds)
+    else:
+        for name in LATENT_FEATURES:
+            with timed(timings, f'stage1_{name}'):
+                latent[f'pred_{name}'] = _predict(models[name], frame, BASE_COLUMNS)
+            frame.set_column(f'pred_{name}', latent[f'pred_{name}'])
+
+    # Stage 2: SOH Estimation
+    with timed(timings, 'stage2'):
+        raw_soh = _predict(models['stage2'], frame, STAGE2_COLUMNS)
+    return latent, raw_soh
+
+
+def score_arrays(models, df_input, today=None, timings=None):
+    """
+    Vectorized equivalent of the per-vehicle scoring done by /predict.
+    df_input needs battery_type, total_dist_km, charging_time_min,
+    buying_price and buying_date columns. Returns a dict of arrays.
+    """
+    if today is None:
+        today = pd.Timestamp.today()
+
+    frame = FeatureFrame.from_frame(df_input)
+    latent, raw_soh = run_cascade(models, frame, timings)
+    with timed(timings, 'fusion'):
+        return _fuse(df_input, frame, latent, raw_soh, today)
+
+
+def _fuse(df_input, frame, latent, raw_soh, today):
+    """Physics fusion, SOC, resale and chemistry (see app.core.physics) on top of the cascade outputs."""
+    scored = physics.evaluate(
+        raw_soh,
+        latent['pred_charging_cycles'],
+        df_input['total_dist_km'].to_numpy(dtype=float),
+        df_input['charging_time_min'].to_numpy(dtype=float),
+        df_input['buying_price'].to_numpy(dtype=float),
+        physics.age_years(pd.to_datetime(df_input['buying_date']).to_numpy(), today)
+    )
+    scored["latent_features"] = latent
+    scored["raw_soh"] = raw_soh
+    # Only the frame's distinct battery types are classified
+    scored["chemistry"] = physics.chemistry_codes(frame.categories)[frame.codes]
+    return scored
+
+
+def predict_batch(models, df_input, anomaly_threshold, today=None, timings=None):
+    """
+    Score N vehicles in one pass and return a list of /predict responses,
+    in the same order as the rows of df_input.
+    """
+    scored = score_arrays(models, df_input, today=today, timings=timings)
+    with timed(timings, 'response_build'):
+        return _build_responses(scored, len(df_input), anomaly_threshold)
+
+
+def _build_responses(scored, n, anomaly_threshold):
+    latent = scored['latent_features']
+    results = []
+    for i in range(n):
+        is_anomaly = bool(scored['is_anomaly'][i])
+        results.append({
+            "predicted_soh": float(scored['predicted_soh'][i]),
+            "degradation_rate": float(scored['degradation_rate'][i]),
+            "estimated_soc": round(float(scored['estimated_soc'][i]), 1),
+            "latent_features": {k: float(v[i]) for k, v in latent.items()},
+            "anomaly_warning": is_anomaly,
+            "anomaly_threshold": anomaly_threshold,
+            "resale_value_usd": round(float(scored['resale_value_usd'][i]), 2),
+            "material_composition": physics.materials(scored['chemistry'][i]),
+            "risk_rating": "Low Risk" if not is_anomaly else "High Risk",
+            "calculation_note": "Estimates based on ANL BatPaC Model & Straight-line Depreciation."
+        })
+    return results
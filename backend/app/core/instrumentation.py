@@ -0,0 +1,91 @@
+import os
+import random
+import time
+
+from prometheus_client import Histogram
+
+
+# Stage timing histograms; with INSTRUMENTATION=0 every helper below is a no-op
+INSTRUMENTATION = os.getenv("INSTRUMENTATION", "1") == "1"
+# Fraction of requests/batches that emit a structured log line (0 disables)
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "0.01"))
+
+STAGE_SECONDS = Histogram(
+    "ev_predict_stage_seconds",
+    "Time spent in each /predict stage; inference stages are observed once per scored batch",
+    ["stage"],
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+
+class _NoopTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+# Shared instance, so disabled timers allocate nothing
+NOOP_TIMER = _NoopTimer()
+
+
+class _StageTimer:
+    __slots__ = ("timings", "stage", "start")
+
+    def __init__(self, timings, stage):
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.timings[self.stage] = self.timings.get(self.stage, 0.0) + time.perf_counter() - self.start
+        return False
+
+
+def new_timings():
+    """A stage -> seconds dict to thread through inference, or None when instrumentation is off."""
+    return {} if INSTRUMENTATION else None
+
+
+def timed(timings, stage):
+    """
+    Add the duration of the with-block to timings[stage]. Used inside
+    inference, which may run in a worker process: the dict travels back to
+    the API process and is recorded there with observe().
+    """
+    if timings is None:
+        return NOOP_TIMER
+    return _StageTimer(timings, stage)
+
+
+def stage_timer(stage):
+    """Observe the duration of the with-block on ev_predict_stage_seconds{stage}."""
+    if not INSTRUMENTATION:
+        return NOOP_TIMER
+    return STAGE_SECONDS.labels(stage=stage).time()
+
+
+def observe(timings):
+    """Record timings collected with timed() on the stage histogram."""
+    if timings:
+        for stage, seconds in timings.items():
+            STAGE_SECONDS.labels(stage=stage).observe(seconds)
+
+
+def sampled():
+    return LOG_SAMPLE_RATE > 0 and random.random() < LOG_SAMPLE_RATE
+
+
+def log_event(logger, event, **fields):
+    """Log `event` with structured fields (rendered as JSON keys with LOG_FORMAT=json)."""
+    logger.info(event, extra={"fields": fields})
+
+
+def stages_ms(timings):
+    return {stage: round(seconds * 1e3, 3) for stage, seconds in (timings or {}).items()}
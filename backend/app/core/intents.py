@@ -0,0 +1,167 @@
+"""
+Rule-based intent engine for /chat.
+
+Intents, keywords, priorities and response templates come from a JSON file
+(chat_intents.json next to this module, or CHAT_INTENTS_PATH). A query is
+tokenized once into lowercase words and scanned left to right against a
+precompiled keyword index, so keywords only match whole words ("hi" no
+longer matches "charging") and the cost depends on the query length, not
+on the number of rules. The highest-priority matched intent answers.
+"""
+import json
+import os
+import re
+
+
+CHAT_INTENTS_PATH = os.getenv(
+    "CHAT_INTENTS_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "chat_intents.json")
+)
+
+_WORD = re.compile(r"[a-z0-9]+")
+# Marks the end of a keyword in the tries below
+_END = ""
+_NO_VALUES = frozenset()
+# Distinct query words whose trie lookups are memoized (cleared when full)
+TOKEN_CACHE_SIZE = 50000
+
+
+def tokenize(text):
+    return _WORD.findall(text.lower())
+
+
+class KeywordIndex:
+    """
+    Maps keywords to values. Whole words and multi-word phrases live in a
+    trie with one level per word; stems (single words ending in *) live in
+    a character trie that each token is walked through once. match() does
+    a leftmost-longest scan: at each position the longest phrase wins and
+    its words are not matched again, so "good morning" doesn't also count
+    as "good".
+    """
+
+    def __init__(self):
+        self._phrases = {}
+        self._stems = {}
+        self._tokens = {}   # token -> (phrase trie child or None, stem values)
+
+    def add(self, keyword, value):
+        words = tokenize(keyword)
+        if not words:
+            raise ValueError(f"Keyword {keyword!r} has no words")
+        if keyword.rstrip().endswith("*"):
+            if len(words) != 1:
+                raise ValueError(f"Stem {keyword!r} must be a single word")
+            node = self._stems
+            for char in words[0]:
+                node = node.setdefault(char, {})
+        else:
+            node = self._phrases
+            for word in words:
+                node = node.setdefault(word, {})
+        node.setdefault(_END, set()).add(value)
+        self._tokens.clear()
+
+    def _lookup(self, token):
+        entry = self._tokens.get(token)
+        if entry is None:
+            found = set()
+            node = self._stems
+            for char in token:
+                node = node.get(char)
+                if node is None:
+                    break
+                found |= node.get(_END, _NO_VALUES)
+            entry = (self._phrases.get(token), frozenset(found))
+            if len(self._tokens) >= TOKEN_CACHE_SIZE:
+                self._tokens.clear()
+            self._tokens[token] = entry
+        return entry
+
+    def match(self, tokens):
+        """Values of every keyword found in the token list."""
+        found = set()
+        position = 0
+        while position < len(tokens):
+            node, stem_values = self._lookup(tokens[position])
+            # Longest phrase starting here
+            length, values = 0, _NO_VALUES
+            offset = position
+            while node is not None:
+                if _END in node:
+                    length, values = offset - position + 1, node[_END]
+                offset += 1
+                if offset == len(tokens):
+                    break
+                node = node.get(tokens[offset])
+            if length > 1:
+                found |= values
+                position += length
+                continue
+            found |= values
+            found |= stem_values
+            position += 1
+        return found
+
+
+def context_fields(context):
+    """Template fields derived from a /predict result passed as chat context."""
+    soh = context.get('predicted_soh', 0)
+    try:
+        rating = "excellent" if soh > 90 else "good" if soh > 80 else "fair" if soh > 70 else "poor"
+    except TypeError:
+        rating = "unknown"
+    materials = context.get('material_composition') or {}
+    return {
+        "soh": soh,
+        "rating": rating,
+        "anomaly": bool(context.get('anomaly_warning', False)),
+        "risk": context.get('risk_rating', 'Unknown'),
+        "resale_value": context.get('resale_value_usd', 0),
+        "lithium_g": materials.get('lithium_g', 0),
+        "cobalt_g": materials.get('cobalt_g', 0),
+        "cycles": (context.get('latent_features') or {}).get('pred_charging_cycles', 0),
+    }
+
+
+class IntentEngine:
+    """Resolves queries to intents and renders their templates."""
+
+    def __init__(self, spec):
+        self.intents = spec["intents"]
+        self.fallback = spec["fallback"]
+        self.error = spec["error"]
+        self.index = KeywordIndex()
+        for i, intent in enumerate(self.intents):
+            for keyword in intent["keywords"]:
+                self.index.add(keyword, i)
+        # Rank 0 is the highest priority; ties go to the intent listed first
+        order = sorted(range(len(self.intents)), key=lambda i: -self.intents[i]["priority"])
+        self._rank = [0] * len(order)
+        for rank, i in enumerate(order):
+            self._rank[i] = rank
+        self._needs_context = [bool(intent.get("requires_context")) for intent in self.intents]
+
+    @classmethod
+    def load(cls, path=CHAT_INTENTS_PATH):
+        with open(path, encoding="utf-8") as f:
+            return cls(json.load(f))
+
+    def resolve(self, query, has_context=False):
+        """The highest-priority intent matched by the query, or None."""
+        best = None
+        for i in self.index.match(tokenize(query)):
+            if (has_context or not self._needs_context[i]) and (best is None or self._rank[i] < self._rank[best]):
+                best = i
+        return None if best is None else self.intents[best]
+
+    def respond(self, query, context=None):
+        intent = self.resolve(query, bool(context))
+        if intent is None:
+            return self.fallback
+        fields = context_fields(context) if context and intent.get("requires_context") else {}
+        templates = intent["templates"]
+        template = templates["anomaly"] if fields.get("anomaly") and "anomaly" in templates else templates["default"]
+        return template.format(**fields)
+
+
+intent_engine = IntentEngine.load()
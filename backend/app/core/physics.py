@@ -0,0 +1,231 @@
+"""
+Physics-guided fusion and valuation on top of the model cascade, as pure
+NumPy functions. Every function takes arrays (or scalars) and broadcasts,
+so the same code scores one /predict request, a fleet batch or a what-if
+grid:
+
+    cd backend
+    python -m app.core.physics sweep --km-points 1000 --charge-points 1000 \\
+        --raw-soh 8 --cycles 400 --battery-type LFP --out sweep.npz
+
+The sweep holds the model outputs (raw SOH, charging cycles) fixed and
+varies mileage and charging time, i.e. it shows what the physics layer does
+with a given cascade prediction.
+"""
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+
+# --- Degradation fusion ---
+# The Student Model (R2 ~ 0.016) is too conservative/flat due to limited training
+# features, so its prediction is blended with a physics-based degradation curve.
+FUSION_MODEL_WEIGHT = float(os.getenv("PHYSICS_MODEL_WEIGHT", "0.4"))  # physics gets the rest
+MILEAGE_FADE_PER_1000KM = 0.15   # % SOH (15% at 100k km)
+CYCLE_FADE_PER_100 = 0.5         # additional % SOH per 100 charging cycles
+MAX_DEGRADATION = 40.0
+# Heuristic anomaly flag on the fused degradation (the 3SD threshold was ~27)
+ANOMALY_DEGRADATION = 27.0
+
+# --- State of charge after a DC fast charge ---
+# Linear 0-80% at the average charging power, half speed above 80%.
+# 50 kW into a 60 kWh pack is ~1.38 % per minute; that rounded rate is what
+# /predict has always reported. A pack size or charging power (environment
+# or keyword) derives the rate from them instead.
+CHARGE_RATE_PER_MIN = 1.38
+DEFAULT_PACK_KWH = 60.0
+DEFAULT_CHARGE_POWER_KW = 50.0
+BATTERY_PACK_KWH = float(os.environ["BATTERY_PACK_KWH"]) if os.getenv("BATTERY_PACK_KWH") else None
+CHARGE_POWER_KW = float(os.environ["CHARGE_POWER_KW"]) if os.getenv("CHARGE_POWER_KW") else None
+START_SOC = 20.0                 # typical SOC when plugging in
+TAPER_SOC = 80.0
+TAPER_FACTOR = 0.5
+
+# --- Resale value: straight-line market depreciation ---
+AGE_DEPRECIATION_PER_YEAR = 0.08
+AGE_FACTOR_FLOOR = 0.3
+MILEAGE_LIFE_KM = 180000
+MILEAGE_FACTOR_FLOOR = 0.4
+
+# --- Chemistry table ---
+# Values based on BatPaC model (Argonne National Lab) for 60kWh pack.
+# A battery_type containing one of `markers` belongs to the chemistry;
+# anything unmatched is DEFAULT_CHEMISTRY.
+CHEMISTRIES = {
+    "LFP": {
+        # Lithium Iron Phosphate: no Co/Ni, high Fe
+        "markers": ("LFP", "LiFePO4"),
+        "materials": {
+            "lithium_g": 3600,  # ~60g/kWh
+            "nickel_g": 0,      # None
+            "cobalt_g": 0,      # None
+            "iron_g": 48000     # High Iron
+        },
+    },
+    "NMC": {
+        "markers": ("NMC", "NCM"),
+        "materials": {
+            "lithium_g": 5400,  # ~90g/kWh
+            "nickel_g": 28000,  # ~470g/kWh
+            "cobalt_g": 8000    # ~130g/kWh
+        },
+    },
+}
+DEFAULT_CHEMISTRY = "NMC"
+# Integer chemistry codes index this list
+CHEMISTRY_NAMES = list(CHEMISTRIES)
+
+
+def fuse_degradation(raw_soh, total_dist_km, charging_cycles, model_weight=FUSION_MODEL_WEIGHT,
+                     mileage_fade=MILEAGE_FADE_PER_1000KM, cycle_fade=CYCLE_FADE_PER_100,
+                     max_degradation=MAX_DEGRADATION):
+    """SOH degradation (%) blending the Stage 2 prediction with the mileage/cycle fade curve."""
+    physics = (np.asarray(total_dist_km, dtype=float) / 1000.0) * mileage_fade \
+        + (np.asarray(charging_cycles, dtype=float) / 100.0) * cycle_fade
+    fused = np.asarray(raw_soh, dtype=float) * model_weight + physics * (1.0 - model_weight)
+    return np.clip(fused, 0.0, max_degradation)
+
+
+def soh_from_degradation(degradation):
+    return 100.0 - degradation
+
+
+def charge_rate_per_min(pack_kwh=BATTERY_PACK_KWH, charge_power_kw=CHARGE_POWER_KW):
+    """
+    SOC percentage points gained per minute below the taper:
+    CHARGE_RATE_PER_MIN unless a pack size or charging power is given.
+    """
+    if pack_kwh is None and charge_power_kw is None:
+        return CHARGE_RATE_PER_MIN
+    pack_kwh = DEFAULT_PACK_KWH if pack_kwh is None else pack_kwh
+    charge_power_kw = DEFAULT_CHARGE_POWER_KW if charge_power_kw is None else charge_power_kw
+    return charge_power_kw / 60.0 / pack_kwh * 100.0
+
+
+def estimate_soc(charging_time_min, pack_kwh=BATTERY_PACK_KWH, charge_power_kw=CHARGE_POWER_KW,
+                 start_soc=START_SOC, taper_soc=TAPER_SOC, taper_factor=TAPER_FACTOR):
+    """SOC (%) reached after charging for `charging_time_min` from `start_soc`."""
+    added = np.asarray(charging_time_min, dtype=float) * charge_rate_per_min(pack_kwh, charge_power_kw)
+    linear = start_soc + added
+    # Taper measured on the added SOC, in the order /predict always computed it
+    soc = np.where(linear > taper_soc, taper_soc + (added - (taper_soc - start_soc)) * taper_factor, linear)
+    return np.minimum(100.0, soc)
+
+
+def age_years(buying_date, today):
+    """Whole days between buying_date and today (datetime64-like), in years of 365 days."""
+    days = np.datetime64(today, 'D') - np.asarray(buying_date, dtype='datetime64[D]')
+    return days.astype(float) / 365
+
+
+def resale_value(buying_price, vehicle_age_years, total_dist_km, soh,
+                 age_rate=AGE_DEPRECIATION_PER_YEAR, age_floor=AGE_FACTOR_FLOOR,
+                 mileage_life_km=MILEAGE_LIFE_KM, mileage_floor=MILEAGE_FACTOR_FLOOR):
+    """Value = price * age factor * mileage factor * SOH/100, each factor floored."""
+    age_factor = np.maximum(age_floor, 1 - np.asarray(vehicle_age_years, dtype=float) * age_rate)
+    mileage_factor = np.maximum(mileage_floor, 1 - np.asarray(total_dist_km, dtype=float) / mileage_life_km)
+    return np.asarray(buying_price, dtype=float) * age_factor * mileage_factor * (np.asarray(soh) / 100)
+
+
+def chemistry_of(battery_type):
+    name = str(battery_type)
+    for chemistry, spec in CHEMISTRIES.items():
+        if any(marker in name for marker in spec["markers"]):
+            return chemistry
+    return DEFAULT_CHEMISTRY
+
+
+def chemistry_codes(battery_types):
+    """Index into CHEMISTRY_NAMES for each battery type; each distinct type is classified once."""
+    types, inverse = np.unique(np.asarray(battery_types, dtype=str), return_inverse=True)
+    codes = np.array([CHEMISTRY_NAMES.index(chemistry_of(t)) for t in types], dtype=np.int8)
+    return codes[inverse].reshape(np.shape(battery_types))
+
+
+def materials(code):
+    """Material composition (grams per pack) for a chemistry code."""
+    return dict(CHEMISTRIES[CHEMISTRY_NAMES[code]]["materials"])
+
+
+def evaluate(raw_soh, charging_cycles, total_dist_km, charging_time_min, buying_price, vehicle_age_years,
+             fusion=None, soc=None, depreciation=None):
+    """
+    Everything /predict derives from the cascade outputs, as broadcast
+    arrays. `fusion`, `soc` and `depreciation` are optional keyword
+    overrides for fuse_degradation, estimate_soc and resale_value.
+    """
+    degradation = fuse_degradation(raw_soh, total_dist_km, charging_cycles, **(fusion or {}))
+    soh = soh_from_degradation(degradation)
+    return {
+        "degradation_rate": degradation,
+        "predicted_soh": soh,
+        "is_anomaly": degradation > ANOMALY_DEGRADATION,
+        "estimated_soc": estimate_soc(charging_time_min, **(soc or {})),
+        "resale_value_usd": resale_value(buying_price, vehicle_age_years, total_dist_km, soh, **(depreciation or {})),
+    }
+
+
+def sweep(total_dist_km, charging_time_min, raw_soh, charging_cycles, buying_price, vehicle_age_years, **overrides):
+    """
+    What-if grid: evaluate() for every (mileage, charging time) pair. Returns
+    arrays of shape (len(total_dist_km), len(charging_time_min)); they are
+    broadcast views, so quantities depending on one axis only are not copied.
+    """
+    km = np.asarray(total_dist_km, dtype=float)[:, None]
+    minutes = np.asarray(charging_time_min, dtype=float)[None, :]
+    result = evaluate(raw_soh, charging_cycles, km, minutes, buying_price, vehicle_age_years, **overrides)
+    grids = np.broadcast_arrays(*result.values())
+    return dict(zip(result, grids))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    grid = commands.add_parser('sweep', help="Evaluate a mileage x charging-time grid.")
+    grid.add_argument('--km-max', type=float, default=300000)
+    grid.add_argument('--km-points', type=int, default=1000)
+    grid.add_argument('--charge-max', type=float, default=600, help="Minutes.")
+    grid.add_argument('--charge-points', type=int, default=1000)
+    grid.add_argument('--raw-soh', type=float, default=8.0, help="Stage 2 degradation prediction to hold fixed.")
+    grid.add_argument('--cycles', type=float, default=400.0, help="Stage 1 charging cycles to hold fixed.")
+    grid.add_argument('--price', type=float, default=40000.0)
+    grid.add_argument('--age', type=float, default=3.0, help="Vehicle age in years.")
+    grid.add_argument('--battery-type', default='LFP')
+    grid.add_argument('--model-weight', type=float, default=FUSION_MODEL_WEIGHT)
+    grid.add_argument('--pack-kwh', type=float, default=BATTERY_PACK_KWH,
+                      help="Derive the charge rate from pack size/power (default: CHARGE_RATE_PER_MIN).")
+    grid.add_argument('--charge-kw', type=float, default=CHARGE_POWER_KW)
+    grid.add_argument('--out', help="Write the grids to this .npz file.")
+    args = parser.parse_args()
+
+    km = np.linspace(0, args.km_max, args.km_points)
+    minutes = np.linspace(0, args.charge_max, args.charge_points)
+    start = time.perf_counter()
+    result = sweep(km, minutes, args.raw_soh, args.cycles, args.price, args.age,
+                   fusion={"model_weight": args.model_weight},
+                   soc={"pack_kwh": args.pack_kwh, "charge_power_kw": args.charge_kw})
+    elapsed = time.perf_counter() - start
+
+    soh = result["predicted_soh"][:, 0]
+    below_80 = km[soh < 80]
+    print(json.dumps({
+        "grid_points": int(km.size * minutes.size),
+        "sweep_ms": round(elapsed * 1e3, 3),
+        "chemistry": chemistry_of(args.battery_type),
+        "materials": materials(CHEMISTRY_NAMES.index(chemistry_of(args.battery_type))),
+        "soh_range": [float(soh.min()), float(soh.max())],
+        "km_to_soh_80": float(below_80[0]) if below_80.size else None,
+        "minutes_to_soc_80": float(minutes[np.argmax(result["estimated_soc"][0] >= 80)])
+        if (result["estimated_soc"][0] >= 80).any() else None,
+        "resale_range_usd": [float(result["resale_value_usd"].min()), float(result["resale_value_usd"].max())],
+    }, indent=2))
+    if args.out:
+        np.savez(args.out, total_dist_km=km, charging_time_min=minutes,
+                 **{name: np.ascontiguousarray(grid) for name, grid in result.items()})
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,199 @@
+"""
+Recording of /predict results: each vehicle's latest score into the fleet
+summaries (see FleetSummaryRepository) and, unless RECORD_READINGS=0,
+every reading into the `reading` time series. Also the daily
+rollup/retention job behind the trend endpoints.
+
+    cd backend
+    python -m app.core.readings rollup [--days N | --all]
+"""
+import argparse
+import logging
+import os
+import queue
+import threading
+import time
+
+from prometheus_client import Counter, Histogram
+
+from app.core.database import fleet_summaries, readings as reading_repo
+
+
+RECORD_READINGS = os.getenv("RECORD_READINGS", "1") == "1"
+# A batch is written once it has this many rows or its oldest row waited this long
+READINGS_BATCH_SIZE = int(os.getenv("READINGS_BATCH_SIZE", "500"))
+READINGS_FLUSH_INTERVAL = float(os.getenv("READINGS_FLUSH_INTERVAL", "1.0"))   # seconds
+# Readings buffered beyond this are dropped (and counted) rather than slowing /predict
+READINGS_QUEUE_SIZE = int(os.getenv("READINGS_QUEUE_SIZE", "100000"))
+READINGS_ROLLUP_INTERVAL = float(os.getenv("READINGS_ROLLUP_INTERVAL", "300"))  # seconds, 0 disables
+# Raw readings older than this are deleted after being rolled up (0 keeps everything)
+READINGS_RETENTION_DAYS = float(os.getenv("READINGS_RETENTION_DAYS", "0"))
+
+DAY_MS = 86_400_000
+
+READINGS_WRITTEN = Counter("ev_readings_written", "Readings appended to the time series")
+READINGS_DROPPED = Counter("ev_readings_dropped", "Readings lost to a full buffer or a failed write")
+SUMMARY_WRITE_ERRORS = Counter("ev_fleet_summary_write_errors", "Failed fleet summary writes (retried)")
+READINGS_FLUSH_SECONDS = Histogram(
+    "ev_readings_flush_seconds",
+    "Time to write one batch of readings",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0)
+)
+
+logger = logging.getLogger(__name__)
+
+
+def now_ms():
+    return time.time_ns() // 1_000_000
+
+
+class ReadingWriter:
+    """
+    Buffers /predict results in memory and writes them from a background
+    thread, so /predict never waits on a database write. Readings are
+    appended with one executemany transaction per batch; when the buffer
+    is full they are dropped. The fleet summaries only need each vehicle's
+    latest score, which is kept aside, one entry per vehicle, and applied
+    after every batch (or flush interval), also when readings are disabled.
+    It is never dropped: a failed write is retried with the next one.
+    """
+
+    _STOP = object()
+
+    def __init__(self, repo=reading_repo, batch_size=READINGS_BATCH_SIZE,
+                 flush_interval=READINGS_FLUSH_INTERVAL, max_queue=READINGS_QUEUE_SIZE, enabled=RECORD_READINGS,
+                 summaries=fleet_summaries):
+        self.repo = repo
+        self.summaries = summaries
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self._queue = queue.Queue(max_queue)
+        self._scores = {}  # vehicle_id -> (vehicle_id, ts, soh, resale_value, anomaly)
+        self._scores_lock = threading.Lock()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="readings-writer", daemon=True)
+            self._thread.start()
+
+    def record(self, vehicle_id, total_dist_km, charging_time_min, response):
+        """Queue one /predict response as the vehicle's latest score and a reading; never blocks."""
+        if self._thread is None:
+            return
+        reading = (
+            vehicle_id, now_ms(), total_dist_km, charging_time_min,
+            response["predicted_soh"], response["degradation_rate"], int(response["anomaly_warning"]),
+            response.get("resale_value_usd")
+        )
+        # Same ts as the reading, so the reading_summary trigger re-applying it is a no-op
+        self._keep_latest([(vehicle_id, reading[1], reading[4], reading[7], reading[6])])
+        if not self.enabled:
+            return
+        try:
+            self._queue.put_nowait(reading)
+        except queue.Full:
+            READINGS_DROPPED.inc()
+
+    def _keep_latest(self, scores):
+        with self._scores_lock:
+            for score in scores:
+                current = self._scores.get(score[0])
+                if current is None or current[1] <= score[1]:
+                    self._scores[score[0]] = score
+
+    def _run(self):
+        while True:
+            try:
+                batch = [self._queue.get(timeout=self.flush_interval)]
+            except queue.Empty:
+                self._flush_scores()
+                continue
+            if batch[0] is self._STOP:
+                self._flush_scores()
+                return
+            deadline = time.monotonic() + self.flush_interval
+            stopping = False
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    row = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if row is self._STOP:
+                    stopping = True
+                    break
+                batch.append(row)
+            self._flush(batch)
+            self._flush_scores()
+            if stopping:
+                return
+
+    def _flush(self, batch):
+        try:
+            with READINGS_FLUSH_SECONDS.time():
+                self.repo.insert_many(batch)
+            READINGS_WRITTEN.inc(len(batch))
+        except Exception:
+            READINGS_DROPPED.inc(len(batch))
+            logger.exception("Failed to write %d readings", len(batch))
+
+    def _flush_scores(self):
+        with self._scores_lock:
+            scores, self._scores = self._scores, {}
+        if not scores:
+            return
+        try:
+            self.summaries.score(scores.values())
+        except Exception:
+            SUMMARY_WRITE_ERRORS.inc()
+            logger.exception("Failed to update the fleet summaries for %d vehicles", len(scores))
+            # Scores recorded meanwhile are newer and win
+            self._keep_latest(scores.values())
+
+    def stop(self):
+        """Write everything still buffered, then stop the thread."""
+        if self._thread is not None:
+            self._queue.put(self._STOP)
+            self._thread.join()
+            self._thread = None
+
+
+def run_rollup(repo=reading_repo, days=2, retention_days=READINGS_RETENTION_DAYS):
+    """
+    Refresh reading_daily for the last `days` UTC days (None = all history)
+    and apply the raw-reading retention. Returns (days rolled up, readings pruned).
+    """
+    now = now_ms()
+    rolled = repo.rollup(0 if days is None else now - (days - 1) * DAY_MS)
+    pruned = 0
+    if retention_days > 0:
+        # Only whole days that have been rolled up are pruned
+        cutoff = now - int(retention_days * DAY_MS)
+        pruned = repo.prune(min(cutoff - cutoff % DAY_MS, now - (days or 1) * DAY_MS))
+    return rolled, pruned
+
+
+reading_writer = ReadingWriter()
+
+
+def main():
+    from app.core.database import init_db
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    rollup = commands.add_parser('rollup', help="Refresh the daily rollups and apply retention.")
+    rollup.add_argument('--days', type=int, default=2, help="UTC days to recompute, counting today.")
+    rollup.add_argument('--all', action='store_true', help="Recompute every day in the raw table.")
+    args = parser.parse_args()
+
+    init_db()
+    rolled, pruned = run_rollup(days=None if args.all else args.days)
+    print(f"Rolled up {rolled} vehicle-days, pruned {pruned} raw readings")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,227 @@
+"""
+Versioned model registry.
+
+    <root>/
+      CURRENT                   id of the active version (replaced atomically)
+      versions/<version>/
+        manifest.json           file hashes, training metrics, feature schema,
+                                stage1_mode and anomaly_threshold
+        stage1_*.pkl/.npz, stage2_soh_model.pkl/.npz, anomaly_metrics.csv
+        *.arrays/               the .npz files unpacked for memory-mapping
+
+Versions are immutable once published. Publish a retrained model with
+
+    cd backend
+    python -m app.core.registry publish --models ../models \\
+        --metrics ../features_evaluation.csv --anomaly-metrics ../results/anomaly_metrics.csv --activate
+
+Running servers pick up a new CURRENT through their file watcher or
+POST /admin/reload.
+"""
+import argparse
+import csv
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+from app.core.compiled import COMPILED_SUFFIX, unpack
+from app.core.inference import (
+    BASE_COLUMNS, LATENT_FEATURES, STAGE1_MODELS, STAGE1_MULTI_MODEL, STAGE2_MODEL, load_model
+)
+
+
+MODEL_REGISTRY_DIR = os.getenv(
+    "MODEL_REGISTRY_DIR",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "models", "registry")
+)
+MANIFEST = 'manifest.json'
+ANOMALY_METRICS_FILE = 'anomaly_metrics.csv'
+DEFAULT_ANOMALY_THRESHOLD = 10.0
+
+
+def read_anomaly_threshold(path):
+    """The 'Threshold (3SD)' row of anomaly_detection.py's metrics CSV, or the fallback."""
+    with open(path, newline='') as f:
+        for row in csv.DictReader(f):
+            if row.get('Metric') == 'Threshold (3SD)':
+                return float(row['Value'])
+    return DEFAULT_ANOMALY_THRESHOLD
+
+
+def file_sha256(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_files(stage1_mode):
+    """Pickles a version must contain for the given Stage 1 mode."""
+    stage1 = [STAGE1_MULTI_MODEL] if stage1_mode == 'multi' else list(STAGE1_MODELS.values())
+    return stage1 + [STAGE2_MODEL]
+
+
+def feature_schema(model_dir, stage1_mode):
+    stage2 = load_model(os.path.join(model_dir, STAGE2_MODEL), use_compiled=True, mmap=False)
+    if hasattr(stage2, 'categories'):
+        battery_types = stage2.categories[0]
+    else:
+        battery_types = stage2.named_steps['preprocessor'].named_transformers_['cat'].categories_[0]
+    return {
+        'stage1_mode': stage1_mode,
+        'stage1_inputs': BASE_COLUMNS,
+        'latent_features': LATENT_FEATURES,
+        'stage2_inputs': BASE_COLUMNS + [f'pred_{name}' for name in LATENT_FEATURES],
+        'battery_types': [str(t) for t in battery_types],
+    }
+
+
+class ModelRegistry:
+    """Publish, list and activate model versions under `root`."""
+
+    def __init__(self, root):
+        self.root = root
+        self.versions_dir = os.path.join(root, 'versions')
+        self.pointer = os.path.join(root, 'CURRENT')
+
+    def version_dir(self, version):
+        return os.path.join(self.versions_dir, version)
+
+    def versions(self):
+        if not os.path.isdir(self.versions_dir):
+            return []
+        return sorted(v for v in os.listdir(self.versions_dir)
+                      if not v.startswith('.') and os.path.exists(os.path.join(self.versions_dir, v, MANIFEST)))
+
+    def current(self):
+        """Active version id, or None when nothing has been activated."""
+        try:
+            with open(self.pointer) as f:
+                return f.read().strip() or None
+        except FileNotFoundError:
+            return None
+
+    def manifest(self, version):
+        with open(os.path.join(self.version_dir(version), MANIFEST)) as f:
+            return json.load(f)
+
+    def verify(self, version):
+        """Raise ValueError if a file of the version is missing or differs from its manifest hash."""
+        manifest = self.manifest(version)
+        for filename, info in manifest['files'].items():
+            path = os.path.join(self.version_dir(version), filename)
+            if not os.path.exists(path) or file_sha256(path) != info['sha256']:
+                raise ValueError(f"Model version {version}: {filename} is missing or corrupted")
+        return manifest
+
+    def activate(self, version):
+        """Point CURRENT at `version`. The pointer file is replaced atomically."""
+        self.verify(version)
+        fd, tmp = tempfile.mkstemp(prefix='.CURRENT-', dir=self.root)
+        with os.fdopen(fd, 'w') as f:
+            f.write(version + '\n')
+        os.replace(tmp, self.pointer)
+
+    def publish(self, model_dir, anomaly_metrics, metrics=None, stage1_mode='separate', activate=False):
+        """
+        Copy the models trained into `model_dir` (pickles plus compiled
+        sidecars) and the anomaly metrics into a new immutable version.
+        `metrics` is an optional list of dicts (features_evaluation.csv rows).
+        Returns the new version id.
+        """
+        sources = []
+        for filename in model_files(stage1_mode):
+            path = os.path.join(model_dir, filename)
+            if not os.path.exists(path):
+                raise FileNotFoundError(f"Model file not found: {path}")
+            sources.append(path)
+            compiled = os.path.splitext(path)[0] + COMPILED_SUFFIX
+            if os.path.exists(compiled):
+                sources.append(compiled)
+
+        files = {os.path.basename(path): {'sha256': file_sha256(path), 'bytes': os.path.getsize(path)}
+                 for path in sources}
+        files[ANOMALY_METRICS_FILE] = {'sha256': file_sha256(anomaly_metrics),
+                                       'bytes': os.path.getsize(anomaly_metrics)}
+        content_id = hashlib.sha256(json.dumps(files, sort_keys=True).encode()).hexdigest()[:12]
+        created = datetime.now(timezone.utc)
+        version = f"{created:%Y%m%dT%H%M%SZ}-{content_id}"
+
+        manifest = {
+            'version': version,
+            'created_at': created.isoformat(),
+            'stage1_mode': stage1_mode,
+            'anomaly_threshold': read_anomaly_threshold(anomaly_metrics),
+            'metrics': metrics or [],
+            'feature_schema': feature_schema(model_dir, stage1_mode),
+            'files': files,
+        }
+
+        # Assemble next to the final location and rename, so a version is never seen half-copied
+        os.makedirs(self.versions_dir, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.publish-', dir=self.versions_dir)
+        try:
+            for path in sources:
+                shutil.copy2(path, staging)
+                if path.endswith(COMPILED_SUFFIX):
+                    # Servers never write into a published version, so unpack it now
+                    unpack(os.path.join(staging, os.path.basename(path)))
+            shutil.copy2(anomaly_metrics, os.path.join(staging, ANOMALY_METRICS_FILE))
+            with open(os.path.join(staging, MANIFEST), 'w') as f:
+                json.dump(manifest, f, indent=2)
+            # mkdtemp creates 0700; versions may be served by another user
+            os.chmod(staging, 0o755)
+            os.rename(staging, self.version_dir(version))
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+        if activate:
+            self.activate(version)
+        return version
+
+
+def _read_metrics(path):
+    if not path:
+        return None
+    with open(path, newline='') as f:
+        return list(csv.DictReader(f))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--root', default=MODEL_REGISTRY_DIR, help="Registry directory.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    publish = commands.add_parser('publish', help="Publish the models in a training output directory.")
+    publish.add_argument('--models', required=True, help="Directory written by train_student_model.py.")
+    publish.add_argument('--anomaly-metrics', required=True, help="anomaly_metrics.csv for these models.")
+    publish.add_argument('--metrics', help="features_evaluation.csv to record in the manifest.")
+    publish.add_argument('--stage1-mode', choices=['separate', 'multi'], default='separate')
+    publish.add_argument('--activate', action='store_true', help="Make the new version current.")
+
+    activate = commands.add_parser('activate', help="Make an existing version current (e.g. roll back).")
+    activate.add_argument('version')
+
+    commands.add_parser('list', help="List versions; the current one is marked with *.")
+    args = parser.parse_args()
+
+    registry = ModelRegistry(args.root)
+    if args.command == 'publish':
+        version = registry.publish(args.models, args.anomaly_metrics, _read_metrics(args.metrics),
+                                   args.stage1_mode, args.activate)
+        print(version)
+    elif args.command == 'activate':
+        registry.activate(args.version)
+        print(args.version)
+    else:
+        current = registry.current()
+        for version in registry.versions():
+            print(f"{'*' if version == current else ' '} {version}")
+
+
+if __name__ == "__main__":
+    main()
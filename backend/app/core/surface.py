@@ -0,0 +1,329 @@
+"""
+Precomputed SOH surface: the Stage 1 + Stage 2 cascade evaluated on a
+regular (total_dist_km, charging_time_min) grid for every battery type,
+answered by bilinear interpolation instead of walking the forests.
+
+    <model dir>/soh_surface/
+      meta.json        grid axes, battery types, outputs, Stage 1 mode and
+                       the fingerprint of the model files it was built from
+      values.npy       float32 [battery type, km, minutes, output]
+      cell_error.npy   float32 [battery type, km cell, minutes cell, output]:
+                       largest |interpolated - exact| found when verifying
+
+Every cell is verified against the real cascade at its centre and at
+`--samples-per-cell` random points. At load time the per-output errors are
+turned into an SOH error bound per cell (the fusion is linear in the
+cascade outputs), and only cells within SURFACE_MAX_SOH_ERROR are answered
+from the surface; inputs outside the grid or in other cells fall back to
+exact inference. The forests are step functions, so the bound is
+empirical: `verify` reports how often fresh random inputs exceed it.
+
+Build it next to the models being served (rebuild after retraining; a
+surface whose fingerprint no longer matches the models is ignored):
+
+    cd backend
+    python -m app.core.surface --models app/models build
+    python -m app.core.surface --version current build   # registry version
+    python -m app.core.surface --models app/models verify --points 20000
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import shutil
+import tempfile
+import time
+from datetime import date
+
+import numpy as np
+import pandas as pd
+from prometheus_client import Counter
+
+from app.core import physics
+from app.core.features import FeatureFrame
+from app.core.inference import LATENT_FEATURES, _build_responses, load_models, run_cascade, score_arrays
+from app.core.registry import MODEL_REGISTRY_DIR, ModelRegistry, feature_schema, file_sha256, model_files
+
+
+SURFACE_DIR = 'soh_surface'
+OUTPUTS = ['raw_soh'] + [f'pred_{name}' for name in LATENT_FEATURES]
+# Largest SOH error (percentage points) a surface answer may carry; cells verified worse fall back
+SURFACE_MAX_SOH_ERROR = float(os.getenv("SURFACE_MAX_SOH_ERROR", "0.5"))
+
+SURFACE_PREDICTIONS = Counter(
+    "ev_surface_predictions",
+    "Fast-mode /predict requests answered from the SOH surface or falling back to the models",
+    ["result"]
+)
+
+logger = logging.getLogger(__name__)
+
+
+def model_fingerprint(model_dir, stage1_mode):
+    """Hash of the model pickles a surface is derived from."""
+    digest = hashlib.sha256(stage1_mode.encode())
+    for filename in model_files(stage1_mode):
+        digest.update(f"{filename}:{file_sha256(os.path.join(model_dir, filename))}".encode())
+    return digest.hexdigest()
+
+
+def _cascade(models, battery_type, total_dist_km, charging_time_min, chunk_size=20000):
+    """Cascade outputs for one battery type, as a float64 [n, len(OUTPUTS)] array."""
+    out = np.empty((len(total_dist_km), len(OUTPUTS)))
+    for start in range(0, len(total_dist_km), chunk_size):
+        stop = start + chunk_size
+        km = total_dist_km[start:stop]
+        frame = FeatureFrame.from_columns([battery_type] * len(km), km, charging_time_min[start:stop])
+        latent, raw_soh = run_cascade(models, frame)
+        out[start:stop] = np.column_stack([raw_soh] + [latent[name] for name in OUTPUTS[1:]])
+    return out
+
+
+def _bilinear(values, i, j, fx, fy):
+    """Interpolate values[i:i+2, j:j+2] at fractional offsets (fx, fy); leading axes are per point."""
+    fx = fx[..., None]
+    fy = fy[..., None]
+    return ((1 - fx) * (1 - fy) * values[i, j] + fx * (1 - fy) * values[i + 1, j]
+            + (1 - fx) * fy * values[i, j + 1] + fx * fy * values[i + 1, j + 1])
+
+
+def build_surface(model_dir, stage1_mode='separate', km_max=200000.0, km_step=1000.0,
+                  minutes_max=120.0, minutes_step=1.0, samples_per_cell=7, seed=0):
+    """
+    Evaluate and verify the surface for the models in `model_dir` and write
+    it to <model_dir>/soh_surface (replaced atomically). Returns the metadata.
+    """
+    models = load_models(model_dir, stage1_mode=stage1_mode, lazy=False)
+    battery_types = feature_schema(model_dir, stage1_mode)['battery_types']
+    km = np.arange(0.0, km_max + km_step / 2, km_step)
+    minutes = np.arange(0.0, minutes_max + minutes_step / 2, minutes_step)
+    grid_km, grid_minutes = np.meshgrid(km, minutes, indexing='ij')
+
+    values = np.empty((len(battery_types), len(km), len(minutes), len(OUTPUTS)), dtype=np.float32)
+    error = np.zeros((len(battery_types), len(km) - 1, len(minutes) - 1, len(OUTPUTS)), dtype=np.float32)
+    cell_i, cell_j = (a.ravel() for a in np.meshgrid(np.arange(len(km) - 1), np.arange(len(minutes) - 1),
+                                                      indexing='ij'))
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    for t, battery_type in enumerate(battery_types):
+        values[t] = _cascade(models, battery_type, grid_km.ravel(), grid_minutes.ravel()).reshape(values.shape[1:])
+        # Cell centre plus random points, interpolated from the stored float32 values
+        offsets = [(np.full(cell_i.size, 0.5), np.full(cell_i.size, 0.5))]
+        offsets += [(rng.random(cell_i.size), rng.random(cell_i.size)) for _ in range(samples_per_cell)]
+        for fx, fy in offsets:
+            exact = _cascade(models, battery_type, km[cell_i] + fx * km_step, minutes[cell_j] + fy * minutes_step)
+            approx = _bilinear(values[t].astype(float), cell_i, cell_j, fx, fy)
+            cell = np.abs(approx - exact).reshape(error.shape[1:])
+            error[t] = np.maximum(error[t], cell)
+        logger.info("Surface for %s done after %.1fs", battery_type, time.perf_counter() - started)
+
+    meta = {
+        'stage1_mode': stage1_mode,
+        'fingerprint': model_fingerprint(model_dir, stage1_mode),
+        'battery_types': battery_types,
+        'outputs': OUTPUTS,
+        'km': {'start': 0.0, 'step': km_step, 'size': len(km)},
+        'minutes': {'start': 0.0, 'step': minutes_step, 'size': len(minutes)},
+        'samples_per_cell': samples_per_cell + 1,
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        'build_seconds': round(time.perf_counter() - started, 1),
+    }
+
+    target = os.path.join(model_dir, SURFACE_DIR)
+    staging = tempfile.mkdtemp(prefix='.surface-', dir=model_dir)
+    try:
+        np.save(os.path.join(staging, 'values.npy'), values)
+        np.save(os.path.join(staging, 'cell_error.npy'), error)
+        with open(os.path.join(staging, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=2)
+        # mkdtemp creates 0700; the models may be served by another user
+        os.chmod(staging, 0o755)
+        if os.path.isdir(target):
+            shutil.rmtree(target)
+        os.rename(staging, target)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return meta
+
+
+class SohSurface:
+    """A loaded surface; lookups return None wherever exact inference is needed."""
+
+    def __init__(self, meta, values, cell_error, max_soh_error=SURFACE_MAX_SOH_ERROR):
+        self.meta = meta
+        self.values = values
+        self.type_index = {battery_type: t for t, battery_type in enumerate(meta['battery_types'])}
+        self.km_step = meta['km']['step']
+        self.km_cells = meta['km']['size'] - 1
+        self.minutes_step = meta['minutes']['step']
+        self.minutes_cells = meta['minutes']['size'] - 1
+        # SOH error bound per cell: |dSOH| <= w*|d raw_soh| + (1-w)*cycle_fade/100*|d cycles|
+        w = physics.FUSION_MODEL_WEIGHT
+        soh_error = (w * cell_error[..., OUTPUTS.index('raw_soh')]
+                     + (1 - w) * physics.CYCLE_FADE_PER_100 / 100 * cell_error[..., OUTPUTS.index('pred_charging_cycles')])
+        self.trusted = soh_error <= max_soh_error
+
+    @classmethod
+    def load(cls, path, mmap=True, **kwargs):
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        mode = 'r' if mmap else None
+        return cls(meta, np.load(os.path.join(path, 'values.npy'), mmap_mode=mode),
+                   np.load(os.path.join(path, 'cell_error.npy')), **kwargs)
+
+    @property
+    def coverage(self):
+        """Fraction of grid cells answered from the surface."""
+        return float(self.trusted.mean())
+
+    def lookup(self, battery_type, total_dist_km, charging_time_min):
+        """Interpolated cascade outputs as a float64 array in OUTPUTS order, or None."""
+        t = self.type_index.get(battery_type)
+        if t is None:
+            return None
+        x = total_dist_km / self.km_step
+        y = charging_time_min / self.minutes_step
+        if not (0.0 <= x <= self.km_cells and 0.0 <= y <= self.minutes_cells):
+            return None
+        # The last grid line belongs to the last cell
+        i = min(int(x), self.km_cells - 1)
+        j = min(int(y), self.minutes_cells - 1)
+        if not self.trusted[t, i, j]:
+            return None
+        corners = self.values[t, i:i + 2, j:j + 2].astype(float)
+        fx, fy = x - i, y - j
+        return ((1 - fx) * (1 - fy) * corners[0, 0] + fx * (1 - fy) * corners[1, 0]
+                + (1 - fx) * fy * corners[0, 1] + fx * fy * corners[1, 1])
+
+    def predict(self, battery_type, total_dist_km, charging_time_min, buying_price, buying_date,
+                anomaly_threshold, today=None):
+        """A /predict response computed from the surface, or None to fall back to the models."""
+        outputs = self.lookup(battery_type, total_dist_km, charging_time_min)
+        if outputs is None:
+            SURFACE_PREDICTIONS.labels(result="fallback").inc()
+            return None
+        try:
+            vehicle_age_years = physics.age_years(np.array([buying_date], dtype='datetime64[D]'), today or date.today())
+        except ValueError:
+            # Not an ISO date; the exact path parses it with pandas
+            SURFACE_PREDICTIONS.labels(result="fallback").inc()
+            return None
+        latent = {name: outputs[k:k + 1] for k, name in enumerate(OUTPUTS) if k > 0}
+        raw_soh = outputs[:1]
+        scored = physics.evaluate(raw_soh, latent['pred_charging_cycles'], total_dist_km, charging_time_min,
+                                  buying_price, vehicle_age_years)
+        scored["latent_features"] = latent
+        scored["raw_soh"] = raw_soh
+        scored["estimated_soc"] = np.atleast_1d(scored["estimated_soc"])
+        scored["chemistry"] = [physics.CHEMISTRY_NAMES.index(physics.chemistry_of(battery_type))]
+        SURFACE_PREDICTIONS.labels(result="hit").inc()
+        return _build_responses(scored, 1, anomaly_threshold)[0]
+
+
+def load_surface(model_dir, stage1_mode='separate', mmap=True):
+    """The surface built for the models in `model_dir`, or None if there is none or it is stale."""
+    path = os.path.join(model_dir, SURFACE_DIR)
+    if not os.path.isdir(path):
+        return None
+    surface = SohSurface.load(path, mmap=mmap)
+    if (surface.meta['stage1_mode'] != stage1_mode
+            or surface.meta['fingerprint'] != model_fingerprint(model_dir, stage1_mode)):
+        logger.warning("Ignoring %s: built from different models, rebuild it with app.core.surface build", path)
+        return None
+    return surface
+
+
+def verify_surface(model_dir, stage1_mode='separate', points=20000, seed=1, today=None):
+    """
+    Compare surface answers with exact inference on random in-domain
+    vehicles. Returns coverage, SOH error statistics and per-call latency.
+    """
+    surface = load_surface(model_dir, stage1_mode)
+    if surface is None:
+        raise FileNotFoundError(f"No up-to-date {SURFACE_DIR} in {model_dir}")
+    models = load_models(model_dir, stage1_mode=stage1_mode, lazy=False)
+    rng = np.random.default_rng(seed)
+    today = today or date.today()
+    df = pd.DataFrame({
+        'battery_type': rng.choice(surface.meta['battery_types'], points),
+        'total_dist_km': rng.uniform(0, surface.km_cells * surface.km_step, points),
+        'charging_time_min': rng.uniform(0, surface.minutes_cells * surface.minutes_step, points),
+        'buying_price': rng.uniform(15000, 60000, points),
+        'buying_date': '2021-06-01',
+    })
+    exact = score_arrays(models, df, today=pd.Timestamp(today))['predicted_soh']
+
+    errors, started = [], time.perf_counter()
+    for k, row in enumerate(df.itertuples(index=False)):
+        result = surface.predict(row.battery_type, row.total_dist_km, row.charging_time_min,
+                                 row.buying_price, row.buying_date, 0.0, today)
+        if result is not None:
+            errors.append(abs(result['predicted_soh'] - exact[k]))
+    per_call_ms = (time.perf_counter() - started) / points * 1e3
+
+    start = time.perf_counter()
+    for k in range(50):
+        score_arrays(models, df.iloc[k:k + 1], today=pd.Timestamp(today))
+    exact_row_ms = (time.perf_counter() - start) / 50 * 1e3
+    errors = np.array(errors)
+    return {
+        'points': points,
+        'hit_rate': len(errors) / points,
+        'cell_coverage': surface.coverage,
+        'max_soh_error': SURFACE_MAX_SOH_ERROR,
+        'observed_soh_error': {
+            'max': float(errors.max()) if errors.size else None,
+            'p99': float(np.percentile(errors, 99)) if errors.size else None,
+            'mean': float(errors.mean()) if errors.size else None,
+            'over_bound_rate': float((errors > SURFACE_MAX_SOH_ERROR).mean()) if errors.size else None,
+        },
+        'surface_predict_ms': per_call_ms,
+        'exact_predict_ms': exact_row_ms,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--models', help="Model directory (default: the registry version given by --version).")
+    parser.add_argument('--version', help="Registry version id, or 'current'.")
+    parser.add_argument('--stage1-mode', choices=['separate', 'multi'], default=None,
+                        help="Default: the version's manifest, else 'separate'.")
+    commands = parser.add_subparsers(dest='command', required=True)
+    build = commands.add_parser('build', help="Evaluate, verify and store the surface.")
+    build.add_argument('--km-max', type=float, default=200000.0)
+    build.add_argument('--km-step', type=float, default=1000.0)
+    build.add_argument('--minutes-max', type=float, default=120.0)
+    build.add_argument('--minutes-step', type=float, default=1.0)
+    build.add_argument('--samples-per-cell', type=int, default=7,
+                       help="Random verification points per cell, on top of its centre.")
+    verify = commands.add_parser('verify', help="Compare surface answers with the models on random inputs.")
+    verify.add_argument('--points', type=int, default=20000)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    stage1_mode = args.stage1_mode
+    if args.models:
+        model_dir = args.models
+    elif args.version:
+        registry = ModelRegistry(MODEL_REGISTRY_DIR)
+        version = registry.current() if args.version == 'current' else args.version
+        if version is None:
+            parser.error("No registry version is active")
+        model_dir = registry.version_dir(version)
+        stage1_mode = stage1_mode or registry.manifest(version)['stage1_mode']
+    else:
+        parser.error("Give --models or --version")
+    stage1_mode = stage1_mode or 'separate'
+
+    if args.command == 'build':
+        meta = build_surface(model_dir, stage1_mode, args.km_max, args.km_step,
+                             args.minutes_max, args.minutes_step, args.samples_per_cell)
+        surface = load_surface(model_dir, stage1_mode)
+        print(json.dumps(dict(meta, cell_coverage=surface.coverage, max_soh_error=SURFACE_MAX_SOH_ERROR), indent=2))
+    else:
+        print(json.dumps(verify_surface(model_dir, stage1_mode, args.points), indent=2))
+
+
+if __name__ == "__main__":
+    main()
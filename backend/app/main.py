@@ -1,18 +1,35 @@
 
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Header, Request
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, StreamingResponse
 from prometheus_client import make_asgi_app
 from app.core.logging_config import setup_logging
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
+from pydantic import BaseModel, TypeAdapter, ValidationError
 import pandas as pd
 import joblib
 import numpy as np
 import os
-from datetime import date
-import sqlite3
-from app.core.database import init_db
+import asyncio
+import csv
+import hmac
+import io
+import json
+import logging
+import time
+from datetime import date, datetime, timedelta, timezone
+from app.core.database import init_db, vehicles as vehicle_repo, readings as reading_repo, anomalies as anomaly_repo
+from app.core.readings import reading_writer, run_rollup, READINGS_ROLLUP_INTERVAL
+from app.core.inference import load_models
+from app.core.executors import InferenceExecutor, InferenceSaturated, run_db
+from app.core.batching import MicroBatcher
+from app.core.cache import prediction_cache
+from app.core.instrumentation import stage_timer, sampled, log_event
+from app.core.registry import ModelRegistry, MODEL_REGISTRY_DIR, read_anomaly_threshold
+from app.core.surface import load_surface
+from app.core.intents import intent_engine
+from app.core.fleet_summary import GROUP_BY, fleet_summary
+from typing import List, Literal, Optional
 import os
 from dotenv import load_dotenv
 
@@ -21,18 +38,47 @@ load_dotenv()
 setup_logging()
 init_db()
 
+logger = logging.getLogger(__name__)
+
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 MODEL_DIR = os.path.join(BASE_DIR, "models")
 ANOMALY_METRICS = os.path.join(BASE_DIR, "results", "anomaly_metrics.csv")
-
-STAGE1_MODELS = {
-    'charging_cycles': 'stage1_charging_cycles.pkl',
-    'efficiency': 'stage1_efficiency.pkl',
-    'battery_temp': 'stage1_battery_temp.pkl'
+STATIC_DIR = os.path.join(BASE_DIR, "static")
+
+# Serve from the compiled NumPy sidecars (.npz) when they exist next to the pickles
+USE_COMPILED_MODELS = os.getenv("USE_COMPILED_MODELS", "1") == "1"
+# 'separate' (three Stage 1 forests) or 'multi' (stage1_multi.pkl); must match how Stage 2 was trained
+STAGE1_MODE = os.getenv("STAGE1_MODE", "separate")
+# Open models on first use, memory-mapping the compiled arrays so all workers share them
+MODEL_LAZY = os.getenv("MODEL_LAZY", "1") == "1"
+MODEL_MMAP = os.getenv("MODEL_MMAP", "1") == "1"
+# Abort startup instead of serving without models when they can't be loaded
+REQUIRE_MODELS = os.getenv("REQUIRE_MODELS", "0") == "1"
+MODEL_LOAD_OPTIONS = {
+    "use_compiled": USE_COMPILED_MODELS,
+    "stage1_mode": STAGE1_MODE,
+    "lazy": MODEL_LAZY,
+    "mmap": MODEL_MMAP,
 }
-STAGE2_MODEL = 'stage2_soh_model.pkl'
+# Seconds between checks of the registry's CURRENT pointer (0 disables the watcher)
+MODEL_WATCH_INTERVAL = float(os.getenv("MODEL_WATCH_INTERVAL", "5"))
+# Required in the X-Admin-Token header of /admin/* requests; unset disables them
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+# Largest page /get_vehicles returns, and the page size its NDJSON stream reads with
+VEHICLE_PAGE_MAX = int(os.getenv("VEHICLE_PAGE_MAX", "1000"))
+# Rows accepted by one /register_vehicle/bulk or /update_vehicle/bulk request
+BULK_MAX_ROWS = int(os.getenv("BULK_MAX_ROWS", "50000"))
+# Rows of a /predict_batch request sent to the inference pool at a time
+PREDICT_BATCH_CHUNK = int(os.getenv("PREDICT_BATCH_CHUNK", "512"))
+
+# Default /predict mode: "exact" runs the models, "fast" answers from the SOH
+# surface where it is built and within its error bound (per request: ?mode=)
+PREDICT_MODE = os.getenv("PREDICT_MODE", "exact")
+
+# Versioned models; without an activated version the flat MODEL_DIR is served
+model_registry = ModelRegistry(MODEL_REGISTRY_DIR)
 
 app = FastAPI(title="EV Battery Health Intelligence Platform")
 app.add_middleware(
@@ -56,48 +102,190 @@ app.add_middleware(
 # Load Models
 models = {}
 anomaly_threshold = 0.0
+inference_executor = None
+predict_batcher = None
+model_load_error = None
+model_version = None
+soh_surface = None
+model_watcher = None
+rollup_job = None
+reload_lock = asyncio.Lock()
 
 # Health check
 @app.get("/health")
 def health():
     return {"status": "healthy"}
 
+# Readiness: 503 until the models are loaded, with the load error if any
+@app.get("/ready")
+def ready():
+    if inference_executor is None:
+        raise HTTPException(status_code=503, detail=f"Models not loaded: {model_load_error}")
+    return {"status": "ready", "model_version": model_version}
+
+# Active model version and its manifest (metrics, feature schema, threshold)
+@app.get("/model_info")
+def model_info():
+    manifest = model_registry.manifest(model_version) if model_version else None
+    return {
+        "model_version": model_version,
+        "anomaly_threshold": anomaly_threshold if inference_executor is not None else None,
+        "manifest": manifest and {k: v for k, v in manifest.items() if k != "files"},
+        "soh_surface": soh_surface and dict(
+            built_at=soh_surface.meta["built_at"], cell_coverage=soh_surface.coverage
+        ),
+    }
+
+class ReloadRequest(BaseModel):
+    version: Optional[str] = None
+
+@app.post("/admin/reload")
+async def admin_reload(request: Optional[ReloadRequest] = None, x_admin_token: Optional[str] = Header(None)):
+    """Activate `version` (if given) and hot-swap to the registry's current version."""
+    if not ADMIN_TOKEN or not hmac.compare_digest(x_admin_token or "", ADMIN_TOKEN):
+        raise HTTPException(status_code=403, detail="Forbidden")
+    if request is not None and request.version:
+        if request.version not in model_registry.versions():
+            raise HTTPException(status_code=404, detail=f"Unknown model version {request.version}")
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, model_registry.activate, request.version)
+        except ValueError as e:
+            raise HTTPException(status_code=409, detail=str(e))
+    try:
+        version = await reload_models()
+    except Exception as e:
+        logger.exception("Model reload failed")
+        raise HTTPException(status_code=500, detail=f"Reload failed, still serving {model_version}: {e}")
+    return {"model_version": version}
+
 # Metrics
 metrics_app = make_asgi_app()
 app.mount("/metrics", metrics_app)
 
 # Serve frontend
 # Serve frontend correctly
-app.mount("/static", StaticFiles(directory="app/static"), name="static")
+# (skipped when the build isn't present, e.g. API-only deployments and benchmarks)
+if os.path.isdir(STATIC_DIR):
+    app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
 
 @app.get("/")
 def serve_frontend():
-    return FileResponse("app/static/index.html")
+    return FileResponse(os.path.join(STATIC_DIR, "index.html"))
+
+def open_models():
+    """
+    Load the registry's current version (or the flat MODEL_DIR when none is
+    activated) and start an inference pool for it. Blocking; the result is
+    put into service with install_models().
+    """
+    version = model_registry.current()
+    if version is None:
+        model_dir, options = MODEL_DIR, MODEL_LOAD_OPTIONS
+        threshold = read_anomaly_threshold(ANOMALY_METRICS)
+    else:
+        manifest = model_registry.verify(version)
+        model_dir = model_registry.version_dir(version)
+        # Published versions are read-only: their .arrays were unpacked at publish
+        options = dict(MODEL_LOAD_OPTIONS, stage1_mode=manifest['stage1_mode'], unpack_arrays=False)
+        threshold = manifest['anomaly_threshold']
+
+    loaded = load_models(model_dir, **options)
+    surface = load_surface(model_dir, options['stage1_mode'], mmap=options['mmap'])
+    executor = InferenceExecutor(model_dir, options, lambda: loaded)
+    try:
+        executor.warm_up()
+    except Exception:
+        executor.shutdown()
+        raise
+    return version, loaded, threshold, executor, surface
+
+def install_models(version, loaded, threshold, executor, surface):
+    """Switch traffic to a set returned by open_models(); returns the executor it replaced."""
+    global models, anomaly_threshold, inference_executor, model_version, model_load_error, soh_surface
+    previous = inference_executor
+    # Plain assignments on the event loop thread: the next dispatched batch uses the new set
+    models, anomaly_threshold, inference_executor, model_version = loaded, threshold, executor, version
+    soh_surface = surface
+    model_load_error = None
+    # Cached responses came from the previous models/threshold
+    prediction_cache.clear()
+    return previous
+
+async def reload_models():
+    """Load the current registry version in the background, then swap it in without pausing traffic."""
+    async with reload_lock:
+        loop = asyncio.get_running_loop()
+        opened = await loop.run_in_executor(None, open_models)
+        previous = install_models(*opened)
+        if previous is not None:
+            # Batches already handed to the old pool finish there
+            loop.run_in_executor(None, previous.shutdown, False)
+        logger.info("Serving model version %s", model_version)
+        return model_version
 
 @app.on_event("startup")
 def load_artifacts():
-    global models, anomaly_threshold
+    global predict_batcher, model_load_error
+    # Concurrent /predict calls are coalesced into one batched cascade pass; the
+    # lambda resolves the executor per batch so reloads take effect immediately
+    predict_batcher = MicroBatcher(lambda df: inference_executor.predict(df, anomaly_threshold))
     try:
-        # Load Stage 1
-        for name, filename in STAGE1_MODELS.items():
-            models[name] = joblib.load(os.path.join(MODEL_DIR, filename))
-        
-        # Load Stage 2
-        models['stage2'] = joblib.load(os.path.join(MODEL_DIR, STAGE2_MODEL))
-        
-        # Load Anomaly Threshold
-        metrics_df = pd.read_csv(ANOMALY_METRICS)
-        # Assuming metrics csv has 'Metric' and 'Value' columns
-        # We need the 'Threshold (3SD)' row
-        thresh_row = metrics_df[metrics_df['Metric'] == 'Threshold (3SD)']
-        if not thresh_row.empty:
-            anomaly_threshold = float(thresh_row.iloc[0]['Value'])
-        else:
-            anomaly_threshold = 10.0 # Fallback
-            
-        print("Models and artifacts loaded successfully.")
+        install_models(*open_models())
+        logger.info("Models and artifacts loaded successfully (version %s).", model_version)
     except Exception as e:
-        print(f"Error loading models: {e}")
+        models.clear()
+        model_load_error = str(e)
+        logger.exception("Error loading models")
+        if REQUIRE_MODELS:
+            raise
+
+async def watch_model_registry():
+    failed_version = None
+    while True:
+        await asyncio.sleep(MODEL_WATCH_INTERVAL)
+        current = model_registry.current()
+        if current is None or current == model_version or current == failed_version:
+            continue
+        try:
+            await reload_models()
+            failed_version = None
+        except Exception:
+            # Keep serving the old version; retried once CURRENT changes again
+            failed_version = current
+            logger.exception("Could not load model version %s, still serving %s", current, model_version)
+
+@app.on_event("startup")
+async def start_model_watcher():
+    global model_watcher
+    if MODEL_WATCH_INTERVAL > 0:
+        model_watcher = asyncio.get_running_loop().create_task(watch_model_registry())
+
+async def rollup_readings():
+    while True:
+        await asyncio.sleep(READINGS_ROLLUP_INTERVAL)
+        try:
+            await run_db(run_rollup)
+        except Exception:
+            logger.exception("Readings rollup failed")
+
+@app.on_event("startup")
+async def start_readings():
+    global rollup_job
+    reading_writer.start()
+    if READINGS_ROLLUP_INTERVAL > 0:
+        rollup_job = asyncio.get_running_loop().create_task(rollup_readings())
+
+@app.on_event("shutdown")
+def shutdown_executors():
+    if model_watcher is not None:
+        model_watcher.cancel()
+    if rollup_job is not None:
+        rollup_job.cancel()
+    reading_writer.stop()
+    if predict_batcher is not None:
+        predict_batcher.stop()
+    if inference_executor is not None:
+        inference_executor.shutdown()
 
 class InputData(BaseModel):
     user_id: str
@@ -114,188 +302,201 @@ class VehicleRegister(BaseModel):
     buying_date: date
     manufacture_date: date
 
-import traceback
 @app.post("/register_vehicle")
-def register_vehicle(data: VehicleRegister):
-
-    conn = sqlite3.connect("vehicle.db")
-    cursor = conn.cursor()
- 
-    cursor.execute("""
-    INSERT OR IGNORE INTO vehicle
-    VALUES(?,?,?,?,?,?)
-    """,
-    (
+async def register_vehicle(data: VehicleRegister):
+
+    inserted = await run_db(
+        vehicle_repo.register,
         data.user_id,
         data.vehicle_id,
         data.battery_type,
         data.buying_price,
         data.buying_date,
         data.manufacture_date
-    ))
+    )
 
-    if cursor.rowcount == 0:
-        conn.close()
+    if not inserted:
         return {"message":"Vehicle already saved"}
 
-    conn.commit()
-    conn.close()
-
     return {"message":"Vehicle Registered Successfully"}
 
+VEHICLE_ROWS = TypeAdapter(List[VehicleRegister])
+
+def _parse_vehicle_rows(body, content_type):
+    """
+    Decode a JSON array or text/csv body (header row with VehicleRegister's
+    fields) and validate every row in one pass. Returns (raw rows,
+    [(index, VehicleRegister)] of valid rows, {index: error} of invalid ones).
+    """
+    if content_type.startswith("text/csv"):
+        rows = list(csv.DictReader(io.StringIO(body.decode("utf-8-sig"))))
+    else:
+        try:
+            rows = json.loads(body)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or text/csv")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=422, detail="Body must be a JSON array of vehicles")
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=413, detail=f"At most {BULK_MAX_ROWS} rows per request")
+
+    try:
+        return rows, list(enumerate(VEHICLE_ROWS.validate_python(rows))), {}
+    except ValidationError as e:
+        errors = {}
+        for error in e.errors():
+            field = ".".join(str(part) for part in error["loc"][1:])
+            errors.setdefault(error["loc"][0], f"{field}: {error['msg']}" if field else error["msg"])
+    # Everything left validates, so the second pass can't raise
+    indices = [i for i in range(len(rows)) if i not in errors]
+    return rows, list(zip(indices, VEHICLE_ROWS.validate_python([rows[i] for i in indices]))), errors
+
+async def _read_vehicle_rows(request):
+    body = await request.body()
+    return await asyncio.get_running_loop().run_in_executor(
+        None, _parse_vehicle_rows, body, request.headers.get("content-type", "")
+    )
+
+def _vehicle_row(v):
+    return (v.user_id, v.vehicle_id, v.battery_type, v.buying_price, v.buying_date, v.manufacture_date)
+
+def _bulk_results(rows, valid, errors, flags, hit, miss):
+    """Per-row status list (input order) and counts per status."""
+    results = [None] * len(rows)
+    for index, error in errors.items():
+        row = rows[index]
+        results[index] = {
+            "row": index,
+            "vehicle_id": row.get("vehicle_id") if isinstance(row, dict) else None,
+            "status": "invalid",
+            "error": error
+        }
+    for (index, vehicle), ok in zip(valid, flags):
+        results[index] = {"row": index, "vehicle_id": vehicle.vehicle_id, "status": hit if ok else miss}
+    summary = {hit: 0, miss: 0, "invalid": len(errors)}
+    for ok in flags:
+        summary[hit if ok else miss] += 1
+    return {"summary": summary, "results": results}
+
+@app.post("/register_vehicle/bulk")
+async def register_vehicles_bulk(request: Request):
+    """
+    Register many vehicles from a JSON array or a text/csv body of
+    VehicleRegister rows. Valid rows are written with executemany in
+    DB_BULK_CHUNK-row transactions; every row gets a status of inserted,
+    duplicate or invalid.
+    """
+    rows, valid, errors = await _read_vehicle_rows(request)
+    inserted = await run_db(vehicle_repo.register_many, [_vehicle_row(v) for _, v in valid])
+    return _bulk_results(rows, valid, errors, inserted, "inserted", "duplicate")
+
 @app.post("/predict")
-def predict_health(data: InputData):
-    conn = sqlite3.connect("vehicle.db")
-    cursor = conn.cursor()
-
-    cursor.execute("""
-        SELECT battery_type, buying_price, buying_date 
-        FROM vehicle 
-        WHERE user_id = ? AND vehicle_id = ?
-    """, (data.user_id, data.vehicle_id))
-    
-    vehicle = cursor.fetchone()
-    conn.close()
+async def predict_health(data: InputData, mode: Optional[Literal["exact", "fast"]] = None):
+    # Decided up front so unsampled requests skip the clock entirely
+    sample = sampled()
+    started = time.perf_counter() if sample else 0.0
+    total_dist_km, charging_time_min = prediction_cache.quantize(data.total_dist_km, data.charging_time_min)
+    cache_token = prediction_cache.token()
+
+    with stage_timer("db_fetch"):
+        vehicle = await run_db(vehicle_repo.get, data.user_id, data.vehicle_id)
 
     if not vehicle:
         raise HTTPException(status_code=404, detail="Vehicle Not Registered")
+    # The row is part of the key, so an update through any worker makes older entries unreachable
+    cache_key = prediction_cache.key(data.user_id, data.vehicle_id, vehicle, total_dist_km, charging_time_min)
+    cached = prediction_cache.get(cache_key)
+    if cached is not None:
+        reading_writer.record(data.vehicle_id, total_dist_km, charging_time_min, cached)
+        if sample:
+            log_event(logger, "predict", vehicle_id=data.vehicle_id, cache_hit=True,
+                      duration_ms=round((time.perf_counter() - started) * 1e3, 3))
+        return cached
+    if inference_executor is None:
+        raise HTTPException(status_code=503, detail=f"Models not loaded: {model_load_error}")
 
     battery_type, buying_price, buying_date = vehicle
+    if (mode or PREDICT_MODE) == "fast" and soh_surface is not None:
+        # Interpolated answers are not cached, so exact requests never see them
+        result = soh_surface.predict(battery_type, total_dist_km, charging_time_min,
+                                     buying_price, buying_date, anomaly_threshold)
+        if result is not None:
+            reading_writer.record(data.vehicle_id, total_dist_km, charging_time_min, result)
+            if sample:
+                log_event(logger, "predict", vehicle_id=data.vehicle_id, cache_hit=False, surface=True,
+                          duration_ms=round((time.perf_counter() - started) * 1e3, 3))
+            return result
+
     try:
-        # Prepare input dataframe
-        input_dict = {
-    'battery_type': [battery_type],
-    'total_dist_km': [data.total_dist_km],
-    'charging_time_min': [data.charging_time_min]
-}
+        result = await predict_batcher.submit({
+            'battery_type': battery_type,
+            'total_dist_km': total_dist_km,
+            'charging_time_min': charging_time_min,
+            'buying_price': buying_price,
+            'buying_date': buying_date
+        })
+        prediction_cache.put(cache_key, result, cache_token)
+        reading_writer.record(data.vehicle_id, total_dist_km, charging_time_min, result)
+    except InferenceSaturated:
+        raise HTTPException(status_code=503, detail="Inference capacity exhausted, retry shortly",
+                            headers={"Retry-After": "1"})
+    except Exception as e:
+        logger.exception("Prediction failed")
+        raise HTTPException(status_code=500, detail=str(e))
 
-        df_input = pd.DataFrame(input_dict)
-        print(f"Input Data: {df_input.to_dict()}")
-        
-        # Stage 1: Latent Feature Estimation
-        latent_features = {}
-        for name in STAGE1_MODELS.keys():
-            print(f"Predicting {name}...")
-            model = models[name]
-            pred = model.predict(df_input)[0]
-            latent_features[f'pred_{name}'] = pred
-            df_input[f'pred_{name}'] = pred
-            
-        # Stage 2: SOH Estimation
-        print("Predicting Stage 2 SOH...")
-        # Ensure column order matches training
-        # Training cols: battery_type, total_dist_km, charging_time_min, pred_charging_cycles, pred_efficiency, pred_battery_temp
-        raw_soh_pred = models['stage2'].predict(df_input)[0]
-        
-        # --- PHYSICS-GUIDED ADJUSTMENT ---
-        # The Student Model (R2 ~ 0.016) is too conservative/flat due to limited training features.
-        # To satisfy the user requirement "change output value when input changes", 
-        # we fuse the Model Prediction with a Physics-Based Degradation curve.
-        # Physics Rule: Capacity fades ~0.05% per 1000km on average (varies by chemistry).
-        
-        mileage_decay = (data.total_dist_km / 1000.0) * 0.15  # 0.15% per 1000km (15% at 100k km)
-        cycle_decay = (latent_features['pred_charging_cycles'] / 100.0) * 0.5 # Additional fade per cycle
-        
-        # Weighted Ensemble: 40% Model + 60% Physics Rule (for Demo Reactivity)
-        # Note: In a real strict paper, we would improve the model. For the "Product", we ensure UX is responsive.
-        physics_soh_degradation = mileage_decay + cycle_decay
-        
-        # Base SOH (New) is 0 degradation.
-        # The model predicts "SOH_teacher" which is Degradation.
-        final_degradation = (raw_soh_pred * 0.4) + (physics_soh_degradation * 0.6)
-        
-        # Clamp to realistic bounds
-        final_degradation = max(0.0, min(final_degradation, 40.0))
-        predicted_soh = 100.0 - final_degradation
-        
-        print(f"Raw Pred: {raw_soh_pred:.2f}, Physics: {physics_soh_degradation:.2f}, Final Deg: {final_degradation:.2f}")
-        
-        # Anomaly Detection (Heuristic)
-        # 3SD Threshold was ~27. 
-        is_anomaly = final_degradation > 27.0
-        
-        # --- ROBUST ESTIMATION LOGIC (Non-Hallucinated) ---
-        
-        # 1. State of Charge (SOC) Estimation
-        # User provides 'charging_time_min'. We estimate the FINAL SOC achieved.
-        # Physics: Standard DC Fast Charge Curve (0-80% fast, 80-100% slow).
-        # Assumption: Start SOC = 20% (typical). Battery Size = 60kWh. Charging Power = 50kW (average).
-        # 50kW = 0.83 kWh/min. 
-        # % gain/min = (0.83 / 60) * 100 = ~1.38% per minute.
-        
-        start_soc = 20.0
-        charge_rate_per_min = 1.38 # Linear approx
-        
-        # Simple non-linear saturation logic
-        estimated_added_soc = data.charging_time_min * charge_rate_per_min
-        
-        # If going above 80%, slow down (Logarithmic tapering)
-        if (start_soc + estimated_added_soc) > 80:
-             excess_time = (estimated_added_soc - 60) # mins after hitting 80%
-             # Slow charge region
-             final_est_soc = 80 + (excess_time * 0.5) # 0.5x speed
-        else:
-             final_est_soc = start_soc + estimated_added_soc
-             
-        final_est_soc = min(100.0, final_est_soc)
-
-
-        # 2. Resale Value Estimation (Market Depreciation Model)
-        # Formula: Value = Base * (Age_Depreciation) * (SOH_Penalty)
-        # Base Price (avg EV): $45,000
-        # Mileage Depreciation: -10% per 20,000km.
-        # SOH Penalty: Linear drop if SOH < 90%. Severe drop if SOH < 80%.
-        
-        
-        vehicle_age_years = (pd.Timestamp.today() - pd.to_datetime(buying_date)).days / 365
-
-        age_factor = max(0.3, 1 - (vehicle_age_years * 0.08))
-        mileage_factor = max(0.4, 1 - (data.total_dist_km / 180000))
-        soh_factor = predicted_soh / 100
-
-        resale_value = buying_price * age_factor * mileage_factor * soh_factor
-
-        
-        # 3. Material Value (Chemistry Specific)
-        # Values based on BatPaC model (Argonne National Lab) for 60kWh pack.
-        # NMC (Nickel Manganese Cobalt): High Ni, Co.
-        # LFP (Lithium Iron Phosphate): No Co/Ni, High Fe.
-        
-        if "LFP" in battery_type or "LiFePO4" in battery_type:
-
-             # LFP Composition
-             material_value = {
-                 "lithium_g": 3600,  # ~60g/kWh
-                 "nickel_g": 0,      # None
-                 "cobalt_g": 0,      # None
-                 "iron_g": 48000     # High Iron
-             }
-        else:
-             # Default NMC Composition (Standard Li-ion)
-             material_value = {
-                 "lithium_g": 5400,  # ~90g/kWh
-                 "nickel_g": 28000,  # ~470g/kWh
-                 "cobalt_g": 8000    # ~130g/kWh
-             }
-
-        
-        return {
-            "predicted_soh": predicted_soh,
-            "degradation_rate": final_degradation,
-            "estimated_soc": round(final_est_soc, 1),
-            "latent_features": latent_features,
-            "anomaly_warning": bool(is_anomaly),
-            "anomaly_threshold": anomaly_threshold,
-            "resale_value_usd": round(resale_value, 2),
-            "material_composition": material_value,
-            "risk_rating": "Low Risk" if not is_anomaly else "High Risk",
-            "calculation_note": "Estimates based on ANL BatPaC Model & Straight-line Depreciation."
-        }
+    if sample:
+        log_event(logger, "predict", vehicle_id=data.vehicle_id, cache_hit=False,
+                  duration_ms=round((time.perf_counter() - started) * 1e3, 3))
+    return result
+
+
+@app.post("/predict_batch")
+async def predict_health_batch(data: List[InputData]):
+    """
+    Score many registered vehicles in one request. Rows go to the inference
+    pool in chunks of PREDICT_BATCH_CHUNK, one model call per stage per
+    chunk, so a large batch neither blocks the event loop nor bypasses the
+    pool's backpressure. Results follow input order; unregistered vehicles
+    get an error entry instead of failing the batch.
+    """
+    with stage_timer("db_fetch"):
+        registered = await run_db(vehicle_repo.get_many, [(item.user_id, item.vehicle_id) for item in data])
+
+    found = [item for item in data if (item.user_id, item.vehicle_id) in registered]
+    if found and inference_executor is None:
+        raise HTTPException(status_code=503, detail=f"Models not loaded: {model_load_error}")
+    try:
+        scored = []
+        vehicles = [registered[(item.user_id, item.vehicle_id)] for item in found]
+        for start in range(0, len(found), PREDICT_BATCH_CHUNK):
+            chunk = slice(start, start + PREDICT_BATCH_CHUNK)
+            df_input = pd.DataFrame({
+                'battery_type': [v[0] for v in vehicles[chunk]],
+                'total_dist_km': [item.total_dist_km for item in found[chunk]],
+                'charging_time_min': [item.charging_time_min for item in found[chunk]],
+                'buying_price': [v[1] for v in vehicles[chunk]],
+                'buying_date': [v[2] for v in vehicles[chunk]]
+            })
+            scored.extend(await inference_executor.predict(df_input, anomaly_threshold))
+        scored = iter(scored)
+    except InferenceSaturated:
+        raise HTTPException(status_code=503, detail="Inference capacity exhausted, retry shortly",
+                            headers={"Retry-After": "1"})
     except Exception as e:
-        traceback.print_exc()
-        print(f"Error encountered: {e}")
+        logger.exception("Batch prediction failed")
         raise HTTPException(status_code=500, detail=str(e))
 
+    results = []
+    for item in data:
+        entry = {"user_id": item.user_id, "vehicle_id": item.vehicle_id}
+        if (item.user_id, item.vehicle_id) in registered:
+            entry.update(next(scored))
+            reading_writer.record(item.vehicle_id, item.total_dist_km, item.charging_time_min, entry)
+        else:
+            entry["error"] = "Vehicle Not Registered"
+        results.append(entry)
+    return {"results": results}
+
 
 class ChatRequest(BaseModel):
     query: str
@@ -304,118 +505,138 @@ class ChatRequest(BaseModel):
 @app.post("/chat")
 def chat_response(request: ChatRequest):
     try:
-        query = request.query.lower()
-        context = request.context
-
-        # HELLO / GREETING
-        if any(w in query for w in ['hi', 'hello', 'hey', 'start']):
-            return {"response": "Hello! I am your EV Intelligence Assistant. I have analyzed your battery data. Ask me about your SOH, range, resale value, or potential anomalies."}
-
-        # CONTEXTUAL ANALYSIS (Requires Analysis Result)
-        if context:
-            # SOH / HEALTH
-            if any(w in query for w in ['soh', 'health', 'condition', 'good']):
-                soh = context.get('predicted_soh', 0)
-                rating = "excellent" if soh > 90 else "good" if soh > 80 else "fair" if soh > 70 else "poor"
-                return {"response": f"Your battery Health (SOH) is {soh:.1f}%. This is considered {rating}. It means you have {soh:.1f}% of the original capacity remaining."}
-            
-            # ANOMALY / RISK
-            if any(w in query for w in ['risk', 'anomaly', 'warning', 'safe', 'danger']):
-                is_anomaly = context.get('anomaly_warning', False)
-                risk = context.get('risk_rating', 'Unknown')
-                if is_anomaly:
-                    return {"response": f"⚠️ ALERT: I have detected an anomaly in your degradation patterns. The risk rating is '{risk}'. The degradation rate is higher than expected for your mileage. I recommend scheduling a physical inspection immediately."}
-                else:
-                    return {"response": f"✅ Good news. No anomalies were detected. Your risk rating is '{risk}'. The battery is aging normally according to our models."}
-
-            # RESALE VALUE
-            if any(w in query for w in ['resale', 'value', 'price', 'worth', 'sell']):
-                val = context.get('resale_value_usd', 0)
-                return {"response": f"Based on your battery SOH and mileage, the estimated resale value contribution of the battery pack is ${val:,.2f}. A healthy battery significantly boosts your car's trade-in value."}
-
-            # MATERIALS / RECYCLING
-            if any(w in query for w in ['material', 'lithium', 'cobalt', 'recycle', 'composition']):
-                mats = context.get('material_composition', {})
-                li = mats.get('lithium_g', 0)
-                co = mats.get('cobalt_g', 0)
-                return {"response": f"Your battery contains approximately {li}g of Lithium and {co}g of Cobalt. These materials are highly valuable and should be recycled at the end of the battery's life."}
-            
-            # CYCLES / USAGE
-            if any(w in query for w in ['cycle', 'charge', 'usage', 'life']):
-                cycles = context.get('latent_features', {}).get('pred_charging_cycles', 0)
-                return {"response": f"I estimate this battery has undergone approximately {cycles:.0f} equivalent full charge cycles. Most Li-ion batteries last 1500-2000 cycles before significant capacity loss."}
-
-            # WARRANTY
-            if 'warranty' in query:
-                is_anomaly = context.get('anomaly_warning', False)
-                if is_anomaly:
-                    return {"response": "Due to the detected anomaly, this battery is currently NOT eligible for automatic warranty extension. A service center verification is required."}
-                else:
-                    return {"response": "Your battery is in good health and IS ELIGIBLE for our Platinum Shield Extended Warranty. You can activate it in the 'Extend Warranty' tab."}
-
-        # GENERAL KNOWLEDGE (Fallback)
-        if 'charge' in query:
-            return {"response": "Tip: To maximize life, try to keep your daily charge between 20% and 80%. Avoid leaving the car at 100% or 0% for long periods."}
-        
-        if 'range' in query:
-            return {"response": "Your range depends heavily on SOH. As SOH drops, your maximum range drops proportionally. Keep tires inflated and drive smoothly to maximize range."}
-
-        return {"response": "I can help you analyze your specific battery report. Please run an analysis first, then ask me about 'SOH', 'Risk', or 'Value'."}
-
-    except Exception as e:
-        print(f"Chat Error: {e}")
-        return {"response": "I encountered an error processing your question. Please try again."}
+        return {"response": intent_engine.respond(request.query, request.context)}
+    except Exception:
+        logger.exception("Chat error")
+        return {"response": intent_engine.error}
 
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
 
 @app.get("/get_vehicles/{user_id}")
-def get_vehicles(user_id: str):
-
-    conn = sqlite3.connect("vehicle.db")
-    cursor = conn.cursor()
-    cursor.execute("SELECT * FROM vehicle WHERE user_id=?", (user_id,))
-    rows = cursor.fetchall()
-    conn.close()
-    vehicles = []
-    for r in rows:
-        vehicles.append({
-            "user_id": r[0],
-            "vehicle_id": r[1],
-            "battery_type": r[2],
-            "buying_price": r[3],
-            "buying_date": r[4],
-            "manufacture_date": r[5]
-        })
-    return {"vehicles": vehicles}
+async def get_vehicles(user_id: str, limit: Optional[int] = None, after: Optional[str] = None):
+    """
+    Vehicles of a user in vehicle_id order. Without `limit` the whole list is
+    returned; with it, one page plus `next_cursor` to pass as `after` for the
+    following page (null on the last one).
+    """
+    if limit is None and after is None:
+        vehicles = await run_db(vehicle_repo.list_for_user, user_id)
+        return {"vehicles": vehicles}
+
+    limit = max(1, min(limit or VEHICLE_PAGE_MAX, VEHICLE_PAGE_MAX))
+    vehicles = await run_db(vehicle_repo.page_for_user, user_id, after, limit)
+    next_cursor = vehicles[-1]["vehicle_id"] if len(vehicles) == limit else None
+    return {"vehicles": vehicles, "next_cursor": next_cursor}
+
+@app.get("/get_vehicles/{user_id}/stream")
+async def stream_vehicles(user_id: str):
+    """
+    Every vehicle of a user as NDJSON, one object per line. Pages are read
+    on demand, so memory stays at one page and no connection is held while
+    the client is reading.
+    """
+    async def lines():
+        after = ""
+        while True:
+            page = await run_db(vehicle_repo.page_for_user, user_id, after, VEHICLE_PAGE_MAX)
+            if page:
+                yield "".join(json.dumps(vehicle) + "\n" for vehicle in page)
+            if len(page) < VEHICLE_PAGE_MAX:
+                return
+            after = page[-1]["vehicle_id"]
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+def _epoch_ms(value, default):
+    value = value or default
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return int(value.timestamp() * 1000)
+
+@app.get("/get_soh_trend/{vehicle_id}")
+async def get_soh_trend(vehicle_id: str, start: Optional[datetime] = None, end: Optional[datetime] = None,
+                        resolution: str = "raw", limit: int = 1000):
+    """
+    SOH history of one vehicle between start and end (ISO datetimes, UTC if
+    naive; default the last 30 days). resolution=raw returns every reading
+    (up to `limit`), resolution=daily the rolled-up days.
+    """
+    now = datetime.now(timezone.utc)
+    start_ms = _epoch_ms(start, now - timedelta(days=30))
+    end_ms = _epoch_ms(end, now)
+    if resolution == "daily":
+        start_day = datetime.fromtimestamp(start_ms / 1000, timezone.utc).date().isoformat()
+        end_day = datetime.fromtimestamp(end_ms / 1000, timezone.utc).date().isoformat()
+        points = await run_db(reading_repo.daily_history, vehicle_id, start_day, end_day)
+    elif resolution == "raw":
+        points = await run_db(reading_repo.history, vehicle_id, start_ms, end_ms, max(1, min(limit, 10000)))
+        for point in points:
+            point["timestamp"] = datetime.fromtimestamp(point.pop("ts") / 1000, timezone.utc).isoformat()
+    else:
+        raise HTTPException(status_code=422, detail="resolution must be 'raw' or 'daily'")
+    return {"vehicle_id": vehicle_id, "resolution": resolution, "points": points}
+
+@app.get("/get_fleet_stats")
+async def get_fleet_stats(start: Optional[date] = None, end: Optional[date] = None,
+                          battery_type: Optional[str] = None):
+    """Per-day fleet SOH aggregates from the daily rollups (default: the last 30 days)."""
+    end = end or datetime.now(timezone.utc).date()
+    start = start or end - timedelta(days=30)
+    days = await run_db(reading_repo.fleet_daily, start.isoformat(), end.isoformat(), battery_type)
+    return {"start": start, "end": end, "battery_type": battery_type, "days": days}
+
+@app.get("/get_fleet_anomalies")
+async def get_fleet_anomalies(limit: int = 100, anomalies_only: bool = False):
+    """
+    Vehicles ranked by fused degradation, as scored by the last fleet
+    anomaly run (python -m app.core.fleet_anomalies run).
+    """
+    limit = max(1, min(limit, VEHICLE_PAGE_MAX))
+    ranked = await run_db(anomaly_repo.ranked, limit, anomalies_only)
+    return {"vehicles": ranked}
+
+@app.get("/get_fleet_summary")
+async def get_fleet_summary(group_by: str = "none", user_id: Optional[str] = None,
+                            after: Optional[str] = None, limit: int = 100):
+    """
+    Fleet (or one user's) vehicle count, average SOH, anomalies, resale value
+    and material totals grouped by none, chemistry, battery_type, age_bucket
+    or user, from the trigger-maintained summary tables. group_by=user pages
+    through users: pass the returned next_after as `after`.
+    """
+    if group_by not in GROUP_BY:
+        raise HTTPException(status_code=422, detail=f"group_by must be one of {', '.join(GROUP_BY)}")
+    return await run_db(fleet_summary, group_by, user_id, after, max(1, min(limit, VEHICLE_PAGE_MAX)))
 
 @app.post("/update_vehicle")
 def update_vehicle(data: VehicleRegister):
 
-    conn = sqlite3.connect("vehicle.db")
-    cursor = conn.cursor()
-
-    cursor.execute("""
-    UPDATE vehicle
-    SET battery_type=?,
-        buying_price=?,
-        buying_date=?,
-        manufacture_date=?
-    WHERE user_id=? AND vehicle_id=?
-    """,
-    (
+    vehicle_repo.update(
+        data.user_id,
+        data.vehicle_id,
         data.battery_type,
         data.buying_price,
         data.buying_date,
-        data.manufacture_date,
-        data.user_id,
-        data.vehicle_id
-    ))
-
-    conn.commit()
-    conn.close()
+        data.manufacture_date
+    )
+    prediction_cache.invalidate_vehicle(data.user_id, data.vehicle_id)
     return {"message":"Vehicle Updated Successfully"}
 
+@app.post("/update_vehicle/bulk")
+async def update_vehicles_bulk(request: Request):
+    """
+    Update many vehicles from a JSON array or a text/csv body of
+    VehicleRegister rows; every row gets a status of updated, not_found
+    or invalid.
+    """
+    rows, valid, errors = await _read_vehicle_rows(request)
+    updated = await run_db(vehicle_repo.update_many, [_vehicle_row(v) for _, v in valid])
+    for (_, vehicle), ok in zip(valid, updated):
+        if ok:
+            prediction_cache.invalidate_vehicle(vehicle.user_id, vehicle.vehicle_id)
+    return _bulk_results(rows, valid, errors, updated, "updated", "not_found")
+
 ##uvicorn main:app --host 0.0.0.0 --port $PORT
 ## uvicorn main:app --reload
\ No newline at end of file
@@ -0,0 +1,311 @@
+"""
+End-to-end API benchmark: drives the FastAPI app in-process over ASGI
+(httpx.ASGITransport, no network) with a synthetic fleet.
+
+    cd backend
+    python -m benchmarks.bench_api --concurrency 1 8 32 --requests 400 > bench.json
+
+Reports p50/p95/p99 latency and requests/sec for /predict, /register_vehicle,
+/get_vehicles and /chat at every concurrency level, plus a per-stage
+breakdown of one /predict (DB lookup, DataFrame build, each Stage 1 model,
+Stage 2, post-processing). Output is JSON so runs can be diffed between
+commits.
+
+When the Stage 1/Stage 2 pickles are missing from app/models (they are not
+all checked in) stand-in pipelines with the same architecture are fitted on
+synthetic data into a temporary directory. The database is a temporary
+file and the prediction cache is off unless --cache is given.
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BATTERY_TYPES = ['LFP', 'NCM_Type1', 'NCM_Type2']
+CHAT_QUERIES = [
+    ("hello", None),
+    ("what is my soh", {'predicted_soh': 87.2}),
+    ("is there any risk", {'anomaly_warning': False, 'risk_rating': 'Low'}),
+    ("what is the resale value", {'resale_value_usd': 18250.5}),
+    ("how many cycles", {'latent_features': {'pred_charging_cycles': 640}}),
+    ("tell me about range", None),
+]
+
+
+def build_standin_models(model_dir, n_rows=2000, seed=42):
+    """Fit Stage 1/Stage 2 pipelines shaped like train_student_model.py's on synthetic data."""
+    import joblib
+    from sklearn.compose import ColumnTransformer
+    from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+    from sklearn.pipeline import Pipeline
+    from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+    from app.core.inference import LATENT_FEATURES, STAGE1_MODELS, STAGE2_MODEL
+
+    rng = np.random.default_rng(seed)
+    df = pd.DataFrame({
+        'battery_type': rng.choice(BATTERY_TYPES, n_rows),
+        'total_dist_km': rng.uniform(1000, 200000, n_rows),
+        'charging_time_min': rng.uniform(20, 600, n_rows),
+    })
+    targets = {
+        'charging_cycles': df['total_dist_km'] / 300 + rng.normal(0, 20, n_rows),
+        'efficiency': 95 - df['total_dist_km'] / 40000 + rng.normal(0, 1, n_rows),
+        'battery_temp': 25 + df['charging_time_min'] / 60 + rng.normal(0, 2, n_rows),
+    }
+
+    def pipeline(num_columns, regressor):
+        return Pipeline(steps=[
+            ('preprocessor', ColumnTransformer(transformers=[
+                ('num', StandardScaler(), num_columns),
+                ('cat', OneHotEncoder(handle_unknown='ignore', sparse_output=False), ['battery_type'])
+            ])),
+            ('regressor', regressor)
+        ])
+
+    for name in LATENT_FEATURES:
+        model = pipeline(['total_dist_km', 'charging_time_min'],
+                         RandomForestRegressor(n_estimators=100, random_state=seed))
+        model.fit(df, targets[name])
+        df[f'pred_{name}'] = model.predict(df)
+        joblib.dump(model, os.path.join(model_dir, STAGE1_MODELS[name]))
+
+    soh = 100 - df['total_dist_km'] / 10000 - df['pred_charging_cycles'] / 200 + rng.normal(0, 2, n_rows)
+    stage2 = pipeline(['total_dist_km', 'charging_time_min'] + [f'pred_{n}' for n in LATENT_FEATURES],
+                      GradientBoostingRegressor(random_state=seed))
+    stage2.fit(df, soh)
+    joblib.dump(stage2, os.path.join(model_dir, STAGE2_MODEL))
+
+
+def synthetic_fleet(n_vehicles, n_users, seed):
+    rng = random.Random(seed)
+    return [
+        {
+            'user_id': f'bench-user-{i % n_users}',
+            'vehicle_id': f'bench-vehicle-{i}',
+            'battery_type': rng.choice(BATTERY_TYPES),
+            'buying_price': round(rng.uniform(15000, 60000), 2),
+            'buying_date': f'{rng.randint(2016, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}',
+            'manufacture_date': '2015-06-01',
+        }
+        for i in range(n_vehicles)
+    ]
+
+
+def summarize(latencies, elapsed, statuses):
+    lat = np.array(latencies)
+    return {
+        "requests": int(len(lat)),
+        "requests_per_sec": len(lat) / elapsed if elapsed > 0 else 0.0,
+        "latency_ms": {
+            "p50": float(np.percentile(lat, 50) * 1e3),
+            "p95": float(np.percentile(lat, 95) * 1e3),
+            "p99": float(np.percentile(lat, 99) * 1e3),
+            "mean": float(lat.mean() * 1e3),
+        },
+        "status_codes": {str(code): statuses.count(code) for code in sorted(set(statuses))},
+    }
+
+
+async def run_load(client, make_request, n_requests, concurrency):
+    """Issue n_requests from `concurrency` workers; make_request(i) -> (method, url, json)."""
+    latencies, statuses = [], []
+    counter = iter(range(n_requests))
+
+    async def worker():
+        for i in counter:
+            method, url, body = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, json=body)
+            latencies.append(time.perf_counter() - start)
+            statuses.append(response.status_code)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    return summarize(latencies, time.perf_counter() - start, statuses)
+
+
+def endpoint_requests(fleet, n_users, seed):
+    rng = random.Random(seed)
+    run_id = f'{os.getpid()}-{time.time_ns()}'
+
+    def predict(i):
+        vehicle = rng.choice(fleet)
+        return ("POST", "/predict", {
+            'user_id': vehicle['user_id'],
+            'vehicle_id': vehicle['vehicle_id'],
+            'battery_type': vehicle['battery_type'],
+            'total_dist_km': rng.uniform(1000, 200000),
+            'charging_time_min': rng.uniform(20, 600),
+        })
+
+    def chat(i):
+        query, context = rng.choice(CHAT_QUERIES)
+        # The frontend omits the context before the first analysis
+        return ("POST", "/chat", {'query': query, 'context': context} if context else {'query': query})
+
+    return {
+        "predict": predict,
+        "register_vehicle": lambda i: ("POST", "/register_vehicle", {
+            **rng.choice(fleet), 'vehicle_id': f'bench-new-{run_id}-{i}'
+        }),
+        "get_vehicles": lambda i: ("GET", f"/get_vehicles/bench-user-{rng.randrange(n_users)}", None),
+        "chat": chat,
+    }
+
+
+def _median_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings) * 1e3)
+
+
+def stage_timings(models, repo, fleet, anomaly_threshold, repeats):
+    """Median time of each step of a single-vehicle /predict, run directly against the components."""
+    from app.core.features import FeatureFrame
+    from app.core.inference import BASE_COLUMNS, LATENT_FEATURES, STAGE2_COLUMNS, _predict, predict_batch, run_cascade
+
+    vehicle = fleet[0]
+    battery_type, buying_price, buying_date = repo.get(vehicle['user_id'], vehicle['vehicle_id'])
+    row = {
+        'battery_type': battery_type,
+        'total_dist_km': 54000.0,
+        'charging_time_min': 45.0,
+        'buying_price': buying_price,
+        'buying_date': buying_date,
+    }
+    df_input = pd.DataFrame([row])
+    frame = FeatureFrame.from_frame(df_input)
+    stages = {
+        "db_lookup": _median_ms(lambda: repo.get(vehicle['user_id'], vehicle['vehicle_id']), repeats),
+        "dataframe_build": _median_ms(lambda: pd.DataFrame([row]), repeats),
+        "feature_frame_build": _median_ms(lambda: FeatureFrame.from_frame(df_input), repeats),
+    }
+    if 'stage1_multi' in models:
+        stages["stage1_multi"] = _median_ms(lambda: _predict(models['stage1_multi'], frame, BASE_COLUMNS), repeats)
+        frame.set_latent(_predict(models['stage1_multi'], frame, BASE_COLUMNS).reshape(1, -1))
+    else:
+        for name in LATENT_FEATURES:
+            stages[f"stage1_{name}"] = _median_ms(lambda: _predict(models[name], frame, BASE_COLUMNS), repeats)
+            frame.set_column(f'pred_{name}', _predict(models[name], frame, BASE_COLUMNS))
+    stages["stage2"] = _median_ms(lambda: _predict(models['stage2'], frame, STAGE2_COLUMNS), repeats)
+
+    cascade = _median_ms(lambda: run_cascade(models, df_input), repeats)
+    total = _median_ms(lambda: predict_batch(models, df_input, anomaly_threshold), repeats)
+    # Physics, resale and response formatting: everything predict_batch does after the cascade
+    stages["postprocess"] = max(total - cascade, 0.0)
+    stages["inference_total"] = total
+    return stages
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(args, tmp):
+    # Configure the app through its environment before it is imported
+    os.environ["VEHICLE_DB_PATH"] = os.path.join(tmp, "bench.db")
+    if not args.cache:
+        os.environ["PREDICTION_CACHE_SIZE"] = "0"
+    if args.workers is not None:
+        os.environ["INFERENCE_WORKERS"] = str(args.workers)
+
+    import httpx
+    from app import main
+    from app.core.inference import STAGE1_MODELS, STAGE2_MODEL
+    from app.core.registry import ModelRegistry
+
+    required = list(STAGE1_MODELS.values()) + [STAGE2_MODEL]
+    standin = args.standin or not all(os.path.exists(os.path.join(main.MODEL_DIR, f)) for f in required)
+    if standin:
+        model_dir = os.path.join(tmp, "models")
+        os.makedirs(model_dir)
+        build_standin_models(model_dir, seed=args.seed)
+        main.MODEL_DIR = model_dir
+        # Serve the flat stand-in directory even if a registry version is active
+        main.model_registry = ModelRegistry(os.path.join(tmp, "registry"))
+
+    main.load_artifacts()
+    if main.inference_executor is None:
+        raise SystemExit("Models failed to load, see the error above")
+
+    fleet = synthetic_fleet(args.vehicles, args.users, args.seed)
+    rows = [(v['user_id'], v['vehicle_id'], v['battery_type'], v['buying_price'],
+             v['buying_date'], v['manufacture_date']) for v in fleet]
+    with main.vehicle_repo._pool().transaction() as conn:
+        conn.executemany(main.vehicle_repo.INSERT, rows)
+
+    report = {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "standin_models": standin,
+        "config": vars(args),
+        "endpoints": {},
+    }
+    requests = endpoint_requests(fleet, args.users, args.seed)
+    try:
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            for name in args.endpoints:
+                # Warm-up pass so first-call costs (imports, worker start) are not measured
+                await run_load(client, requests[name], min(20, args.requests), 1)
+                report["endpoints"][name] = {
+                    str(c): await run_load(client, requests[name], args.requests, c)
+                    for c in args.concurrency
+                }
+        report["predict_stages_ms"] = stage_timings(
+            main.models, main.vehicle_repo, fleet, main.anomaly_threshold, args.stage_repeats
+        )
+    finally:
+        main.shutdown_executors()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 8, 32],
+                        help="In-flight requests per load level.")
+    parser.add_argument('--requests', type=int, default=400, help="Requests per endpoint and concurrency level.")
+    parser.add_argument('--endpoints', nargs='+', default=["predict", "register_vehicle", "get_vehicles", "chat"],
+                        choices=["predict", "register_vehicle", "get_vehicles", "chat"])
+    parser.add_argument('--vehicles', type=int, default=1000, help="Synthetic vehicles registered up front.")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=None,
+                        help="INFERENCE_WORKERS for the run (default: the app's own default).")
+    parser.add_argument('--cache', action='store_true', help="Leave the /predict response cache on.")
+    parser.add_argument('--standin', action='store_true', help="Use stand-in models even if the pickles exist.")
+    parser.add_argument('--stage-repeats', type=int, default=50, help="Repetitions per stage timing.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Also write the JSON report to this file.")
+    args = parser.parse_args()
+
+    # The app prints its own progress; keep stdout for the JSON report
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(run(args, tmp))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
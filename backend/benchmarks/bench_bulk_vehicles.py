@@ -0,0 +1,127 @@
+"""
+Vehicle onboarding throughput: one request per vehicle (/register_vehicle,
+/update_vehicle) versus the bulk endpoints with JSON and CSV bodies.
+
+    cd backend
+    python -m benchmarks.bench_bulk_vehicles --vehicles 20000 --batch-size 5000
+
+Drives the app in-process over ASGI against a temporary database; no models
+are loaded. Every mode writes its own fresh vehicles (updates rewrite the
+ones registered by the JSON bulk run). Prints JSON with rows/sec per mode
+and the speedup over the single-row path.
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+
+from benchmarks.bench_api import synthetic_fleet
+
+FIELDS = ['user_id', 'vehicle_id', 'battery_type', 'buying_price', 'buying_date', 'manufacture_date']
+
+
+def to_csv(rows):
+    out = io.StringIO()
+    writer = csv.DictWriter(out, fieldnames=FIELDS)
+    writer.writeheader()
+    writer.writerows(rows)
+    return out.getvalue()
+
+
+def fleet_for(mode, n_vehicles, n_users, seed):
+    fleet = synthetic_fleet(n_vehicles, n_users, seed)
+    for vehicle in fleet:
+        vehicle['vehicle_id'] = f"{mode}-{vehicle['vehicle_id']}"
+    return fleet
+
+
+async def single_rows(client, url, fleet, concurrency):
+    rows = iter(fleet)
+
+    async def worker():
+        for vehicle in rows:
+            response = await client.post(url, json=vehicle)
+            response.raise_for_status()
+
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+
+async def bulk_rows(client, url, fleet, batch_size, as_csv):
+    statuses = {}
+    for start in range(0, len(fleet), batch_size):
+        batch = fleet[start:start + batch_size]
+        if as_csv:
+            response = await client.post(url, content=to_csv(batch), headers={"content-type": "text/csv"})
+        else:
+            response = await client.post(url, json=batch)
+        response.raise_for_status()
+        for status, count in response.json()["summary"].items():
+            statuses[status] = statuses.get(status, 0) + count
+    return statuses
+
+
+async def run(args, tmp):
+    os.environ["VEHICLE_DB_PATH"] = os.path.join(tmp, "bench.db")
+
+    import httpx
+    from app import main
+
+    report = {"config": vars(args), "modes": {}}
+
+    async def measure(name, n_rows, coro):
+        start = time.perf_counter()
+        statuses = await coro
+        elapsed = time.perf_counter() - start
+        report["modes"][name] = {"rows": n_rows, "seconds": elapsed, "rows_per_sec": n_rows / elapsed}
+        if statuses:
+            report["modes"][name]["statuses"] = statuses
+
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        single = fleet_for("single", args.single_vehicles, args.users, args.seed)
+        await measure("register_single", len(single),
+                      single_rows(client, "/register_vehicle", single, args.concurrency))
+        await measure("update_single", len(single),
+                      single_rows(client, "/update_vehicle", single, args.concurrency))
+
+        bulk = fleet_for("json", args.vehicles, args.users, args.seed)
+        await measure("register_bulk_json", len(bulk),
+                      bulk_rows(client, "/register_vehicle/bulk", bulk, args.batch_size, False))
+        await measure("update_bulk_json", len(bulk),
+                      bulk_rows(client, "/update_vehicle/bulk", bulk, args.batch_size, False))
+
+        bulk_csv = fleet_for("csv", args.vehicles, args.users, args.seed)
+        await measure("register_bulk_csv", len(bulk_csv),
+                      bulk_rows(client, "/register_vehicle/bulk", bulk_csv, args.batch_size, True))
+
+    main.shutdown_executors()
+    base = {"register": report["modes"]["register_single"]["rows_per_sec"],
+            "update": report["modes"]["update_single"]["rows_per_sec"]}
+    for name, result in report["modes"].items():
+        result["speedup_vs_single"] = result["rows_per_sec"] / base[name.split("_")[0]]
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=20000, help="Rows per bulk mode.")
+    parser.add_argument('--single-vehicles', type=int, default=2000, help="Rows sent one request at a time.")
+    parser.add_argument('--batch-size', type=int, default=5000, help="Rows per bulk request.")
+    parser.add_argument('--concurrency', type=int, default=8, help="In-flight single-row requests.")
+    parser.add_argument('--users', type=int, default=100)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp, contextlib.redirect_stdout(sys.stderr):
+        report = asyncio.run(run(args, tmp))
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+"""
+/chat intent matching: the previous substring if-chain versus the keyword
+index in app.core.intents.
+
+    cd backend
+    python -m benchmarks.bench_chat_intents --queries 100000
+
+Generates a synthetic query corpus (questions for every intent, greetings,
+filler words, with and without an analysis context) and reports:
+
+  - queries/sec for the legacy chain and for IntentEngine.respond()
+  - how many answers differ, with examples (word-boundary fixes such as
+    "charging history" no longer being answered as a greeting)
+  - match time as the rule set grows to thousands of synthetic intents,
+    which should stay flat
+
+Prints JSON.
+"""
+import argparse
+import json
+import random
+import time
+
+from app.core.intents import IntentEngine, intent_engine
+
+CONTEXT = {
+    'predicted_soh': 86.4, 'anomaly_warning': False, 'risk_rating': 'Low Risk', 'resale_value_usd': 18250.5,
+    'material_composition': {'lithium_g': 3600, 'cobalt_g': 0}, 'latent_features': {'pred_charging_cycles': 640},
+}
+TOPICS = [
+    "what is my soh", "how is the battery health", "is the battery condition good", "state of health please",
+    "is there any risk", "any anomalies detected", "is it safe to drive", "warnings on my pack",
+    "what is the resale value", "how much is it worth", "should I sell it now", "trade in price",
+    "how much lithium is inside", "can the materials be recycled", "cobalt composition",
+    "how many cycles", "how long is the battery life", "usage so far",
+    "is my warranty still valid", "tell me about range", "how far can I go",
+    "tips for charging", "show my charging history", "this chip is weird", "hi", "hello there",
+    "good morning", "what should I do next", "thanks",
+]
+FILLER = ["please", "can you", "tell me", "I wonder", "quick question", "ok", "so", "now", "today"]
+
+
+def legacy_response(query, context):
+    """The substring if-chain /chat used before the intent engine (responses abbreviated to the intent)."""
+    query = query.lower()
+    if any(w in query for w in ['hi', 'hello', 'hey', 'start']):
+        return "greeting"
+    if context:
+        if any(w in query for w in ['soh', 'health', 'condition', 'good']):
+            return "soh"
+        if any(w in query for w in ['risk', 'anomaly', 'warning', 'safe', 'danger']):
+            return "anomaly"
+        if any(w in query for w in ['resale', 'value', 'price', 'worth', 'sell']):
+            return "resale"
+        if any(w in query for w in ['material', 'lithium', 'cobalt', 'recycle', 'composition']):
+            return "materials"
+        if any(w in query for w in ['cycle', 'charge', 'usage', 'life']):
+            return "cycles"
+        if 'warranty' in query:
+            return "warranty"
+    if 'charge' in query:
+        return "charging_tip"
+    if 'range' in query:
+        return "range"
+    return None
+
+
+def corpus(n, seed):
+    rng = random.Random(seed)
+    queries = []
+    for _ in range(n):
+        words = [rng.choice(TOPICS)]
+        if rng.random() < 0.5:
+            words.insert(0, rng.choice(FILLER))
+        if rng.random() < 0.3:
+            words.append(rng.choice(FILLER))
+        queries.append((" ".join(words).capitalize() + rng.choice(["?", "", "!"]),
+                        CONTEXT if rng.random() < 0.6 else None))
+    return queries
+
+
+def rate(fn, queries):
+    start = time.perf_counter()
+    for query, context in queries:
+        fn(query, context)
+    elapsed = time.perf_counter() - start
+    return {"queries_per_sec": len(queries) / elapsed, "us_per_query": elapsed / len(queries) * 1e6}
+
+
+def scaled_engine(extra_intents, seed):
+    """The shipped intents plus `extra_intents` synthetic ones with 5 random keywords each."""
+    rng = random.Random(seed)
+    spec = {"fallback": intent_engine.fallback, "error": intent_engine.error, "intents": list(intent_engine.intents)}
+    for i in range(extra_intents):
+        keywords = ["".join(rng.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rng.randint(4, 9)))
+                    for _ in range(5)]
+        keywords[0] += "*"
+        spec["intents"].append({"name": f"synthetic_{i}", "priority": 0, "keywords": keywords,
+                                "templates": {"default": "synthetic"}})
+    return IntentEngine(spec)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--queries', type=int, default=100000)
+    parser.add_argument('--rule-counts', type=int, nargs='+', default=[0, 100, 1000, 10000],
+                        help="Synthetic intents added for the scaling run.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    queries = corpus(args.queries, args.seed)
+    report = {
+        "config": vars(args),
+        "legacy": rate(legacy_response, queries),
+        "engine": rate(intent_engine.respond, queries),
+    }
+
+    differences = {}
+    for query, context in queries:
+        old = legacy_response(query, context)
+        intent = intent_engine.resolve(query, bool(context))
+        new = intent["name"] if intent else None
+        if old != new:
+            key = f"{old} -> {new}"
+            entry = differences.setdefault(key, {"count": 0, "example": query, "with_context": bool(context)})
+            entry["count"] += 1
+    report["differences"] = dict(sorted(differences.items(), key=lambda item: -item[1]["count"]))
+
+    report["scaling"] = {}
+    for extra in args.rule_counts:
+        engine = scaled_engine(extra, args.seed)
+        report["scaling"][str(len(engine.intents))] = rate(engine.resolve, queries)["us_per_query"]
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Check the compiled NumPy models against their sklearn pipelines and time both.
+
+    cd backend
+    python -m benchmarks.bench_compiled --rows 10000
+
+Every pickle in app/models with a compiled .npz sidecar is compared on
+synthetic inputs; the script exits non-zero if any output differs beyond
+float tolerance.
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from app.core.compiled import CompiledPipeline, COMPILED_SUFFIX
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "models")
+
+# Rough input ranges of the training data, used to generate synthetic rows
+COLUMN_RANGES = {
+    'total_dist_km': (0.0, 250000.0),
+    'charging_time_min': (0.0, 180.0),
+    'pred_charging_cycles': (0.0, 2000.0),
+    'pred_efficiency': (80.0, 100.0),
+    'pred_battery_temp': (10.0, 50.0),
+}
+
+
+def synthetic_frame(compiled, n, rng):
+    data = {}
+    for col in compiled.num_columns:
+        low, high = COLUMN_RANGES.get(col, (0.0, 1.0))
+        data[col] = rng.uniform(low, high, n)
+    for col, categories in zip(compiled.cat_columns, compiled.categories):
+        data[col] = rng.choice(list(categories) + ['UNKNOWN'], n)
+    return pd.DataFrame(data)
+
+
+def median_seconds(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+    return float(np.median(times))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=10000, help="Batch size for the batch timing.")
+    parser.add_argument('--repeat', type=int, default=50, help="Repetitions for the single-row timing.")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    report = {}
+    ok = True
+    for pkl_path in sorted(glob.glob(os.path.join(MODEL_DIR, '*.pkl'))):
+        npz_path = os.path.splitext(pkl_path)[0] + COMPILED_SUFFIX
+        if not os.path.exists(npz_path):
+            continue
+        pipeline = joblib.load(pkl_path)
+        compiled = CompiledPipeline.load(npz_path)
+
+        df_batch = synthetic_frame(compiled, args.rows, rng)
+        df_row = df_batch.iloc[:1].reset_index(drop=True)
+
+        expected = pipeline.predict(df_batch)
+        actual = compiled.predict(df_batch)
+        max_abs_diff = float(np.max(np.abs(expected - actual)))
+        matches = bool(np.allclose(expected, actual, rtol=1e-9, atol=1e-9))
+        ok = ok and matches
+
+        sklearn_row = median_seconds(lambda: pipeline.predict(df_row), args.repeat)
+        compiled_row = median_seconds(lambda: compiled.predict(df_row), args.repeat)
+        sklearn_batch = median_seconds(lambda: pipeline.predict(df_batch), 3)
+        compiled_batch = median_seconds(lambda: compiled.predict(df_batch), 3)
+
+        report[os.path.basename(pkl_path)] = {
+            'kind': compiled.kind,
+            'matches': matches,
+            'max_abs_diff': max_abs_diff,
+            'single_row_ms': {'sklearn': sklearn_row * 1e3, 'compiled': compiled_row * 1e3,
+                              'speedup': sklearn_row / compiled_row},
+            f'batch_{args.rows}_ms': {'sklearn': sklearn_batch * 1e3, 'compiled': compiled_batch * 1e3,
+                                      'speedup': sklearn_batch / compiled_batch},
+        }
+
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == "__main__":
+    main()
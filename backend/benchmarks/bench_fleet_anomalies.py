@@ -0,0 +1,97 @@
+"""
+Fleet anomaly job (app.core.fleet_anomalies) on a synthetic fleet.
+
+    cd backend
+    python -m benchmarks.bench_fleet_anomalies --vehicles 100000 --changed 0.01 --workers 2
+
+Registers the fleet with a few readings per vehicle in a temporary database,
+then times:
+
+  - per_vehicle: one cascade call per vehicle (what scoring the fleet through
+    /predict one request at a time costs), on a sample, extrapolated
+  - full: first run, every vehicle scored
+  - unchanged: a second run with nothing to do (the cost of the change scan)
+  - incremental: after new readings for `--changed` of the fleet
+
+Prints JSON.
+"""
+import argparse
+import json
+import os
+import random
+import tempfile
+import time
+
+from benchmarks.bench_api import synthetic_fleet
+
+
+def seed_readings(reading_repo, fleet, per_vehicle, start_ms, rng):
+    rows = []
+    for vehicle in fleet:
+        km = rng.uniform(0, 150000)
+        for i in range(per_vehicle):
+            km += rng.uniform(0, 2000)
+            rows.append((vehicle['vehicle_id'], start_ms + i * 3_600_000, round(km, 1),
+                         round(rng.uniform(5, 120), 1), None, None, None, None))
+    for start in range(0, len(rows), 50000):
+        reading_repo.insert_many(rows[start:start + 50000])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=100000)
+    parser.add_argument('--users', type=int, default=5000)
+    parser.add_argument('--readings-per-vehicle', type=int, default=3)
+    parser.add_argument('--changed', type=float, default=0.01, help="Fraction of the fleet with new readings.")
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--chunk-size', type=int, default=5000)
+    parser.add_argument('--per-vehicle-sample', type=int, default=300)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["VEHICLE_DB_PATH"] = os.path.join(tmp, "bench.db")
+        from app.core.database import init_db, anomalies, readings, vehicles
+        from app.core.fleet_anomalies import resolve_models, run, score_chunk
+        from app.core.inference import load_models
+
+        init_db()
+        rng = random.Random(args.seed)
+        fleet = synthetic_fleet(args.vehicles, args.users, args.seed)
+        vehicles.register_many([
+            (v['user_id'], v['vehicle_id'], v['battery_type'], v['buying_price'], v['buying_date'],
+             v['manufacture_date'])
+            for v in fleet
+        ])
+        seed_readings(readings, fleet, args.readings_per_vehicle, 1_700_000_000_000, rng)
+
+        model_dir, stage1_mode, model_key, threshold = resolve_models(version='current')
+        report = {"config": vars(args), "model_key": model_key, "anomaly_threshold": threshold}
+
+        models = load_models(model_dir, stage1_mode=stage1_mode)
+        sample = fleet[:args.per_vehicle_sample]
+        start = time.perf_counter()
+        for vehicle in sample:
+            score_chunk(models, [vehicle['battery_type']], [50000.0], [30.0])
+        per_vehicle = (time.perf_counter() - start) / len(sample)
+        report["per_vehicle"] = {"ms_per_vehicle": round(per_vehicle * 1e3, 3),
+                                 "extrapolated_seconds": round(per_vehicle * args.vehicles, 1)}
+
+        def timed_run(name):
+            stats = run(model_dir, stage1_mode, model_key, threshold,
+                        workers=args.workers, chunk_size=args.chunk_size)
+            report[name] = {k: stats[k] for k in ("vehicles_scored", "anomalies", "seconds", "vehicles_per_sec")}
+
+        timed_run("full")
+        timed_run("unchanged")
+        changed = rng.sample(fleet, int(args.vehicles * args.changed))
+        seed_readings(readings, changed, 1, 1_800_000_000_000, rng)
+        timed_run("incremental")
+
+        top = anomalies.ranked(1)
+        report["top_vehicle"] = top[0] if top else None
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
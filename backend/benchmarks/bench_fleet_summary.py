@@ -0,0 +1,117 @@
+"""
+Fleet aggregate endpoints (app.core.fleet_summary) on a synthetic fleet.
+
+    cd backend
+    python -m benchmarks.bench_fleet_summary --vehicles 1000000 --users 50000
+
+Builds two temporary databases with the same vehicles and one scored reading
+per vehicle: one at the current schema (summary tables maintained by
+trigger), one stopped before the summary migration. Reports:
+
+  - write cost: bulk registration and reading inserts, with and without the
+    summary triggers
+  - query: median latency of fleet_summary() per group_by, one user's
+    chemistry breakdown and a page of users
+  - scan: the same chemistry aggregate computed from vehicle + latest
+    reading, which is what the summaries replace
+
+Prints JSON.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+
+from benchmarks.bench_api import synthetic_fleet
+
+SCAN_BY_BATTERY_TYPE = """
+    SELECT v.battery_type, count(*), count(r.predicted_soh), avg(r.predicted_soh),
+           sum(r.resale_value), sum(r.anomaly)
+    FROM vehicle v
+    LEFT JOIN reading r ON r.rowid = (
+        SELECT rowid FROM reading WHERE vehicle_id = v.vehicle_id ORDER BY ts DESC LIMIT 1
+    )
+    GROUP BY v.battery_type
+"""
+INSERT_READING_V4 = """
+    INSERT INTO reading(vehicle_id, ts, total_dist_km, charging_time_min,
+                        predicted_soh, degradation_rate, anomaly)
+    VALUES(?,?,?,?,?,?,?)
+"""
+
+
+def median_ms(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return round(statistics.median(timings) * 1e3, 3)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--vehicles', type=int, default=1000000)
+    parser.add_argument('--users', type=int, default=50000)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--repeats', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ["VEHICLE_DB_PATH"] = os.path.join(tmp, "summary.db")
+        from app.core.database import (MIGRATIONS, ConnectionPool, VehicleRepository, get_pool, init_db,
+                                       migrate, readings, vehicles)
+        from app.core.fleet_summary import GROUP_BY, fleet_summary
+
+        init_db()
+        baseline_pool = ConnectionPool(os.path.join(tmp, "baseline.db"))
+        with baseline_pool.connection() as conn:
+            migrate(conn, MIGRATIONS[:4])
+        baseline_vehicles = VehicleRepository(lambda: baseline_pool)
+
+        rng = random.Random(args.seed)
+        fleet = [(v['user_id'], v['vehicle_id'], v['battery_type'], v['buying_price'], v['buying_date'],
+                  f"{rng.randint(2012, 2025)}-{rng.randint(1, 12):02d}-01")
+                 for v in synthetic_fleet(args.vehicles, args.users, args.seed)]
+        reading_rows = [(v[1], 1_700_000_000_000 + i, rng.uniform(0, 150000), rng.uniform(5, 120),
+                         rng.uniform(70, 100), rng.uniform(0, 30), int(rng.random() < 0.05), rng.uniform(5000, 50000))
+                        for i, v in enumerate(fleet)]
+        report = {"config": vars(args), "write": {}}
+
+        def timed_write(name, write, rows):
+            start = time.perf_counter()
+            for i in range(0, len(rows), args.chunk_size):
+                write(rows[i:i + args.chunk_size])
+            elapsed = time.perf_counter() - start
+            report["write"][name] = {"seconds": round(elapsed, 2), "rows_per_sec": round(len(rows) / elapsed)}
+
+        def baseline_readings(rows):
+            with baseline_pool.transaction() as conn:
+                conn.executemany(INSERT_READING_V4, [row[:7] for row in rows])
+
+        timed_write("register_without_summaries", baseline_vehicles.register_many, fleet)
+        timed_write("register_with_summaries", vehicles.register_many, fleet)
+        timed_write("readings_without_summaries", baseline_readings, reading_rows)
+        timed_write("readings_with_summaries", readings.insert_many, reading_rows)
+
+        report["query_ms"] = {group_by: median_ms(lambda: fleet_summary(group_by), args.repeats)
+                              for group_by in GROUP_BY if group_by != "user"}
+        user_id = fleet[0][0]
+        report["query_ms"]["one_user_by_chemistry"] = median_ms(
+            lambda: fleet_summary("chemistry", user_id=user_id), args.repeats)
+        report["query_ms"]["user_page_100"] = median_ms(lambda: fleet_summary("user", limit=100), args.repeats)
+
+        with get_pool().connection() as conn:
+            report["scan_ms"] = {"by_battery_type": median_ms(
+                lambda: conn.execute(SCAN_BY_BATTERY_TYPE).fetchall(), 3)}
+        report["totals"] = fleet_summary("chemistry")["groups"]
+        baseline_pool.close()
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
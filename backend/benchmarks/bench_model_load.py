@@ -0,0 +1,137 @@
+"""
+Startup time and per-worker memory for the model loading strategies.
+
+    cd backend
+    python -m benchmarks.bench_model_load --workers 4
+
+For each strategy, `--workers` fresh processes are started at the same time
+(as uvicorn/inference workers would be). Each one loads the models from
+app/models, scores one row and then reports while all of them are still
+alive:
+
+  load_s            load_models() wall time (includes unpacking on a cold run)
+  first_predict_s   first prediction, which is where lazy models are opened
+  rss_mb            resident set size
+  pss_mb            proportional set size: shared pages split between sharers
+  private_mb        pages no other process shares (USS)
+
+Strategies: `pickle` (joblib.load of the sklearn pipelines), `compiled`
+(.npz sidecars read into private memory) and `mmap_lazy` (.arrays
+directories memory-mapped on first use, the server default).
+Prints JSON. Linux only (reads /proc/self/smaps_rollup).
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import queue
+import time
+
+import numpy as np
+import pandas as pd
+
+MODEL_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app", "models")
+
+STRATEGIES = {
+    "pickle": {"use_compiled": False, "lazy": False, "mmap": False},
+    "compiled": {"use_compiled": True, "lazy": False, "mmap": False},
+    "mmap_lazy": {"use_compiled": True, "lazy": True, "mmap": True},
+}
+
+
+def memory_mb():
+    """RSS, PSS and private (USS) memory of this process from smaps_rollup."""
+    fields = {}
+    with open("/proc/self/smaps_rollup") as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) >= 3 and parts[2] == "kB":
+                fields[parts[0].rstrip(":")] = int(parts[1]) / 1024
+    return {
+        "rss_mb": fields.get("Rss", 0.0),
+        "pss_mb": fields.get("Pss", 0.0),
+        "private_mb": fields.get("Private_Clean", 0.0) + fields.get("Private_Dirty", 0.0),
+    }
+
+
+def worker(model_dir, options, stage1_mode, barrier, results):
+    # Imported here so the import cost is not counted as model loading
+    from app.core.inference import predict_batch, load_models
+
+    before = memory_mb()
+    start = time.perf_counter()
+    models = load_models(model_dir, stage1_mode=stage1_mode, **options)
+    load_s = time.perf_counter() - start
+
+    df = pd.DataFrame([{
+        'battery_type': 'LFP', 'total_dist_km': 54000.0, 'charging_time_min': 45.0,
+        'buying_price': 40000.0, 'buying_date': '2022-01-01',
+    }])
+    start = time.perf_counter()
+    predict_batch(models, df, 10.0)
+    first_predict_s = time.perf_counter() - start
+
+    # Measure once every worker holds its models, so shared pages are split between them
+    barrier.wait()
+    after = memory_mb()
+    results.put({
+        "load_s": load_s,
+        "first_predict_s": first_predict_s,
+        **after,
+        "models_rss_mb": after["rss_mb"] - before["rss_mb"],
+    })
+    barrier.wait()
+
+
+def run_strategy(name, args):
+    ctx = multiprocessing.get_context("spawn")
+    barrier = ctx.Barrier(args.workers)
+    results = ctx.Queue()
+    procs = [
+        ctx.Process(target=worker, args=(args.model_dir, STRATEGIES[name], args.stage1_mode, barrier, results))
+        for _ in range(args.workers)
+    ]
+    for p in procs:
+        p.start()
+    rows = []
+    while len(rows) < len(procs):
+        try:
+            rows.append(results.get(timeout=1))
+        except queue.Empty:
+            if any(p.exitcode not in (None, 0) for p in procs):
+                for p in procs:
+                    p.terminate()
+                raise RuntimeError(f"A '{name}' worker failed, see its traceback above")
+    for p in procs:
+        p.join()
+
+    def stat(key, agg=np.mean):
+        return float(agg([r[key] for r in rows]))
+
+    return {
+        "load_s": stat("load_s"),
+        "first_predict_s": stat("first_predict_s"),
+        "startup_to_first_prediction_s": stat("load_s") + stat("first_predict_s"),
+        "rss_mb_per_worker": stat("rss_mb"),
+        "models_rss_mb_per_worker": stat("models_rss_mb"),
+        "pss_mb_total": stat("pss_mb", np.sum),
+        "private_mb_per_worker": stat("private_mb"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--workers', type=int, default=4, help="Processes loading the models concurrently.")
+    parser.add_argument('--model-dir', default=MODEL_DIR)
+    parser.add_argument('--stage1-mode', choices=['separate', 'multi'], default='separate')
+    parser.add_argument('--strategies', nargs='+', choices=list(STRATEGIES), default=list(STRATEGIES))
+    args = parser.parse_args()
+
+    report = {"config": vars(args), "strategies": {}}
+    for name in args.strategies:
+        report["strategies"][name] = run_strategy(name, args)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Concurrent read/write load test: per-request sqlite3.connect (the old handler
+pattern) versus the pooled WAL repository in app.core.database.
+
+    cd backend
+    python -m benchmarks.db_load_test --processes 4 --threads 8 --seconds 5
+
+Each process simulates a uvicorn worker running `--threads` request threads
+that mix vehicle lookups, per-user listings and registrations. Prints JSON
+with throughput, latency percentiles and "database is locked" failures.
+"""
+import argparse
+import json
+import os
+import random
+import sqlite3
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from app.core.database import ConnectionPool, VehicleRepository
+
+SEED_VEHICLES = 2000
+USERS = 50
+
+
+class ConnectPerRequest:
+    """The pre-pool access pattern: a fresh default connection for every call."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def register(self, *row):
+        conn = sqlite3.connect(self.path)
+        cursor = conn.cursor()
+        cursor.execute("INSERT OR IGNORE INTO vehicle VALUES(?,?,?,?,?,?)", row)
+        conn.commit()
+        conn.close()
+
+    def get(self, user_id, vehicle_id):
+        conn = sqlite3.connect(self.path)
+        row = conn.execute(
+            "SELECT battery_type, buying_price, buying_date FROM vehicle WHERE user_id = ? AND vehicle_id = ?",
+            (user_id, vehicle_id)
+        ).fetchone()
+        conn.close()
+        return row
+
+    def list_for_user(self, user_id):
+        conn = sqlite3.connect(self.path)
+        rows = conn.execute("SELECT * FROM vehicle WHERE user_id=?", (user_id,)).fetchall()
+        conn.close()
+        return rows
+
+
+def create_db(path, wal):
+    conn = sqlite3.connect(path)
+    if wal:
+        conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("""
+    CREATE TABLE vehicle(
+        user_id TEXT, vehicle_id TEXT, battery_type TEXT, buying_price REAL,
+        buying_date TEXT, manufacture_date TEXT, PRIMARY KEY(vehicle_id)
+    )
+    """)
+    conn.executemany(
+        "INSERT INTO vehicle VALUES(?,?,?,?,?,?)",
+        [(f"u{i % USERS}", f"seed{i}", "LFP", 40000.0, "2022-01-01", "2021-06-01") for i in range(SEED_VEHICLES)]
+    )
+    conn.commit()
+    conn.close()
+
+
+def run_worker(mode, path, threads, seconds, write_ratio, worker_id):
+    if mode == "connect":
+        repo = ConnectPerRequest(path)
+    else:
+        pool = ConnectionPool(path, size=threads)
+        repo = VehicleRepository(lambda: pool)
+    deadline = time.perf_counter() + seconds
+    latencies = [[] for _ in range(threads)]
+    errors = [0] * threads
+
+    def loop(t):
+        rng = random.Random(worker_id * 1000 + t)
+        n = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                roll = rng.random()
+                if roll < write_ratio:
+                    repo.register(f"u{rng.randrange(USERS)}", f"w{worker_id}-{t}-{n}", "NCM_Type1",
+                                  35000.0, "2023-03-01", "2022-11-01")
+                elif roll < write_ratio + (1 - write_ratio) / 2:
+                    i = rng.randrange(SEED_VEHICLES)
+                    repo.get(f"u{i % USERS}", f"seed{i}")
+                else:
+                    repo.list_for_user(f"u{rng.randrange(USERS)}")
+                latencies[t].append(time.perf_counter() - start)
+            except sqlite3.OperationalError:
+                errors[t] += 1
+            n += 1
+
+    workers = [threading.Thread(target=loop, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return [x for lat in latencies for x in lat], sum(errors)
+
+
+def run_mode(mode, args):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "vehicle.db")
+        create_db(path, wal=(mode == "pooled"))
+        with ProcessPoolExecutor(max_workers=args.processes) as pool:
+            futures = [
+                pool.submit(run_worker, mode, path, args.threads, args.seconds, args.write_ratio, p)
+                for p in range(args.processes)
+            ]
+            results = [f.result() for f in futures]
+    latencies = np.array([x for lat, _ in results for x in lat])
+    errors = sum(e for _, e in results)
+    return {
+        "ops": int(len(latencies)),
+        "ops_per_sec": len(latencies) / args.seconds,
+        "locked_errors": int(errors),
+        "latency_ms": {
+            "p50": float(np.percentile(latencies, 50) * 1e3),
+            "p95": float(np.percentile(latencies, 95) * 1e3),
+            "p99": float(np.percentile(latencies, 99) * 1e3),
+        } if len(latencies) else {},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--processes', type=int, default=4, help="Simulated uvicorn workers.")
+    parser.add_argument('--threads', type=int, default=8, help="Request threads per worker.")
+    parser.add_argument('--seconds', type=float, default=5.0)
+    parser.add_argument('--write-ratio', type=float, default=0.2, help="Fraction of requests that register a vehicle.")
+    args = parser.parse_args()
+
+    report = {
+        "config": vars(args),
+        "connect_per_request": run_mode("connect", args),
+        "pooled_wal": run_mode("pooled", args),
+    }
+    report["speedup"] = report["pooled_wal"]["ops_per_sec"] / max(report["connect_per_request"]["ops_per_sec"], 1e-9)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
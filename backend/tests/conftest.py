@@ -0,0 +1,111 @@
+"""
+Fixtures shared by the model and API tests. Trains a small model set (same
+pipeline shapes as train_student_model.py) in a temporary directory, so no
+trained models are needed, and serves it from the API on an empty database.
+"""
+import os
+import sys
+
+import joblib
+import numpy as np
+import pandas as pd
+import pytest
+from sklearn.base import clone
+from sklearn.compose import ColumnTransformer
+from sklearn.ensemble import GradientBoostingRegressor, RandomForestRegressor
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+sys.path.insert(0, os.path.dirname(BACKEND_DIR))
+
+import train_student_model as training  # noqa: E402
+from app.core.features import BASE_COLUMNS, LATENT_FEATURES, NUMERIC_COLUMNS, STAGE2_COLUMNS  # noqa: E402
+from app.core.inference import STAGE1_MODELS, STAGE1_MULTI_MODEL, STAGE2_MODEL  # noqa: E402
+
+BATTERY_TYPES = ['LFP', 'NMC', 'NCA']
+ROWS = 2000
+
+
+def synthetic_inputs(n, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'battery_type': rng.choice(BATTERY_TYPES, n),
+        'total_dist_km': rng.uniform(0, 200000, n),
+        'charging_time_min': rng.uniform(5, 180, n),
+    })
+
+
+def stage2_pipeline(regressor):
+    preprocessor = ColumnTransformer(transformers=[
+        ('num', StandardScaler(), NUMERIC_COLUMNS),
+        ('cat', OneHotEncoder(handle_unknown='ignore', sparse_output=False), ['battery_type'])
+    ])
+    return Pipeline(steps=[('preprocessor', preprocessor), ('regressor', regressor)])
+
+
+def export(model, model_dir, filename):
+    path = os.path.join(model_dir, filename)
+    joblib.dump(model, path)
+    training.export_compiled_model(model, os.path.splitext(path)[0] + '.npz')
+
+
+@pytest.fixture(scope='session')
+def model_dir(tmp_path_factory):
+    """Separate and multi-output Stage 1 forests plus a boosted Stage 2, pickled and compiled."""
+    model_dir = str(tmp_path_factory.mktemp('models'))
+    X = synthetic_inputs(ROWS, seed=0)
+    chemistry = X['battery_type'].map({'LFP': 0.0, 'NMC': 1.0, 'NCA': 2.0})
+    targets = pd.DataFrame({
+        'charging_cycles': X['total_dist_km'] / 300 + 50 * chemistry,
+        'efficiency': 0.9 - X['charging_time_min'] / 2000 - 0.01 * chemistry,
+        'battery_temp': 25 + X['charging_time_min'] / 10 + 3 * chemistry,
+    })
+    for name, filename in STAGE1_MODELS.items():
+        forest = Pipeline(steps=[
+            ('preprocessor', training.stage1_preprocessor()),
+            ('regressor', RandomForestRegressor(n_estimators=10, max_depth=8, random_state=0)),
+        ])
+        export(forest.fit(X[BASE_COLUMNS], targets[name]), model_dir, filename)
+    multi = Pipeline(steps=[
+        ('preprocessor', training.stage1_preprocessor()),
+        ('regressor', clone(training.STAGE1_MULTI_REGRESSOR).set_params(regressor__n_estimators=10)),
+    ])
+    export(multi.fit(X[BASE_COLUMNS], targets[LATENT_FEATURES]), model_dir, STAGE1_MULTI_MODEL)
+
+    features = X.assign(**{f'pred_{name}': targets[name] for name in LATENT_FEATURES})
+    soh = 100 - features['total_dist_km'] / 5000 - features['pred_battery_temp'] / 10
+    stage2 = stage2_pipeline(GradientBoostingRegressor(n_estimators=30, max_depth=3, random_state=0))
+    export(stage2.fit(features[STAGE2_COLUMNS], soh), model_dir, STAGE2_MODEL)
+    return model_dir
+
+
+@pytest.fixture
+def client(model_dir, tmp_path, monkeypatch):
+    """The API on an empty database, serving model_dir in-process (no worker pool)."""
+    monkeypatch.setenv('VEHICLE_DB_PATH', str(tmp_path / 'vehicles.db'))
+    monkeypatch.setenv('MODEL_REGISTRY_DIR', str(tmp_path / 'registry'))
+    monkeypatch.setenv('INFERENCE_WORKERS', '0')
+    monkeypatch.setenv('MODEL_WATCH_INTERVAL', '0')
+    monkeypatch.setenv('READINGS_ROLLUP_INTERVAL', '0')
+    monkeypatch.setenv('RECORD_READINGS', '0')
+    monkeypatch.setenv('PREDICTION_CACHE_SIZE', '0')
+    monkeypatch.setenv('PREDICT_BATCH_CHUNK', '16')
+    monkeypatch.setenv('READINGS_FLUSH_INTERVAL', '0.05')
+    # Read when app.main and its database/executor modules are first imported, i.e. here
+    from fastapi.testclient import TestClient
+    from app import main
+    from app.core import database
+
+    # app.main migrates its database on import; later tests get their own too
+    pool = database.ConnectionPool(str(tmp_path / 'vehicles.db'))
+    monkeypatch.setattr(database, '_pool', pool)
+    database.init_db()
+    metrics = tmp_path / 'anomaly_metrics.csv'
+    metrics.write_text('Metric,Value\nThreshold (3SD),2.5\n')
+    monkeypatch.setattr(main, 'MODEL_DIR', model_dir)
+    monkeypatch.setattr(main, 'ANOMALY_METRICS', str(metrics))
+    with TestClient(main.app) as client:
+        yield client
+    pool.close()
@@ -0,0 +1,94 @@
+"""
+The compiled NumPy models must predict what the pickled sklearn pipelines
+predict, however they are loaded, and the API must serve the models that
+are on disk now.
+
+    cd backend
+    python -m pytest -q tests
+"""
+import os
+import shutil
+
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+
+import train_student_model as training
+from app.core.compiled import MMAP_SUFFIX, CompiledPipeline
+from app.core.features import LATENT_FEATURES, STAGE2_COLUMNS
+from app.core.inference import STAGE2_MODEL, load_model, load_models, run_cascade
+from conftest import ROWS, stage2_pipeline, synthetic_inputs
+
+
+@pytest.mark.parametrize('stage1_mode', ['separate', 'multi'])
+@pytest.mark.parametrize('options', [
+    {'mmap': False},
+    {'mmap': True},
+    {'mmap': True, 'lazy': True},
+], ids=['npz', 'mmap', 'lazy'])
+def test_compiled_cascade_matches_pipelines(model_dir, stage1_mode, options):
+    X = synthetic_inputs(5000, seed=1)
+    expected_latent, expected_soh = run_cascade(
+        load_models(model_dir, use_compiled=False, stage1_mode=stage1_mode), X)
+    compiled = load_models(model_dir, stage1_mode=stage1_mode, **options)
+    latent, soh = run_cascade(compiled, X)
+
+    np.testing.assert_allclose(soh, expected_soh, rtol=1e-9, atol=1e-9)
+    for name, values in expected_latent.items():
+        np.testing.assert_allclose(latent[name], values, rtol=1e-9, atol=1e-9)
+    loaded = [model.model if options.get('lazy') else model for model in compiled.values()]
+    assert all(isinstance(model, CompiledPipeline) for model in loaded)
+
+
+def test_load_model_picks_up_reexported_npz(model_dir, tmp_path):
+    for filename in os.listdir(model_dir):
+        if filename.startswith('stage2_soh_model') and not filename.endswith(MMAP_SUFFIX):
+            shutil.copy2(os.path.join(model_dir, filename), tmp_path)
+    path = str(tmp_path / STAGE2_MODEL)
+    X = synthetic_inputs(500, seed=2).assign(**{f'pred_{name}': 1.0 for name in LATENT_FEATURES})
+
+    before = load_model(path)
+    old_soh = before.predict(X[STAGE2_COLUMNS])
+    arrays_dir = os.path.splitext(path)[0] + MMAP_SUFFIX
+    assert os.stat(arrays_dir).st_mode & 0o777 == 0o755
+
+    # Retrain into the same directory, the default training flow
+    features = synthetic_inputs(ROWS, seed=3).assign(**{f'pred_{name}': 1.0 for name in LATENT_FEATURES})
+    retrained = stage2_pipeline(RandomForestRegressor(n_estimators=5, random_state=0))
+    retrained.fit(features[STAGE2_COLUMNS], features['charging_time_min'])
+    training.export_compiled_model(retrained, os.path.splitext(path)[0] + '.npz')
+
+    after = load_model(path)
+    np.testing.assert_allclose(after.predict(X[STAGE2_COLUMNS]), retrained.predict(X[STAGE2_COLUMNS]),
+                               rtol=1e-9, atol=1e-9)
+    assert not np.allclose(old_soh, after.predict(X[STAGE2_COLUMNS]))
+    # The stale copy was replaced under a process that still maps it
+    np.testing.assert_allclose(before.predict(X[STAGE2_COLUMNS]), old_soh)
+
+    # A .npz changed behind the loader's back is unpacked again, not served stale
+    np.savez(os.path.splitext(path)[0] + '.npz', **dict(before.to_arrays()))
+    np.testing.assert_allclose(load_model(path).predict(X[STAGE2_COLUMNS]), old_soh, rtol=1e-9, atol=1e-9)
+
+
+def test_predict_batch_matches_predict(client):
+    X = synthetic_inputs(40, seed=4)
+    rows = []
+    for i, row in X.iterrows():
+        vehicle = {'user_id': f'user-{i % 3}', 'vehicle_id': f'vehicle-{i}', 'battery_type': row['battery_type'],
+                   'buying_price': 30000 + 100 * i, 'buying_date': '2021-03-01', 'manufacture_date': '2020-11-01'}
+        assert client.post('/register_vehicle', json=vehicle).status_code == 200
+        rows.append({'user_id': vehicle['user_id'], 'vehicle_id': vehicle['vehicle_id'],
+                     'battery_type': row['battery_type'], 'total_dist_km': row['total_dist_km'],
+                     'charging_time_min': row['charging_time_min']})
+    unregistered = dict(rows[0], vehicle_id='missing')
+
+    response = client.post('/predict_batch', json=rows + [unregistered])
+    assert response.status_code == 200
+    results = response.json()['results']
+    assert results[-1] == {'user_id': unregistered['user_id'], 'vehicle_id': 'missing',
+                           'error': 'Vehicle Not Registered'}
+    for row, batched in zip(rows, results):
+        single = client.post('/predict', json=row)
+        assert single.status_code == 200
+        # Same cascade on the same inputs: equal, not just close
+        assert batched == dict(single.json(), user_id=row['user_id'], vehicle_id=row['vehicle_id'])
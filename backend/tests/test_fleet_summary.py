@@ -0,0 +1,88 @@
+"""
+/get_fleet_summary must follow registrations, updates and the latest
+/predict or /predict_batch score of each vehicle, with the readings history
+disabled (the client fixture sets RECORD_READINGS=0).
+
+    cd backend
+    python -m pytest -q tests
+"""
+import time
+
+import pytest
+
+VEHICLES = [
+    ('user-a', 'ev-1', 'LFP', '2021-05-01'),
+    ('user-a', 'ev-2', 'NMC', '2019-02-01'),
+    ('user-b', 'ev-3', 'LFP', '2022-08-01'),
+]
+
+
+def register(client, user_id, vehicle_id, battery_type, manufacture_date, path='/register_vehicle'):
+    vehicle = {'user_id': user_id, 'vehicle_id': vehicle_id, 'battery_type': battery_type,
+               'buying_price': 35000, 'buying_date': '2022-01-01', 'manufacture_date': manufacture_date}
+    assert client.post(path, json=vehicle).status_code == 200
+
+
+def predict(client, user_id, vehicle_id, battery_type, total_dist_km):
+    response = client.post('/predict', json={'user_id': user_id, 'vehicle_id': vehicle_id,
+                                             'battery_type': battery_type, 'total_dist_km': total_dist_km,
+                                             'charging_time_min': 45})
+    assert response.status_code == 200
+    return response.json()
+
+
+def summary(client, scored, timeout=5.0, **params):
+    """Groups by key once `scored` vehicles are scored; scores are applied in the background."""
+    deadline = time.monotonic() + timeout
+    while True:
+        groups = {g['key']: g for g in client.get('/get_fleet_summary', params=params).json()['groups']}
+        if sum(g['scored_vehicles'] for g in groups.values()) == scored or time.monotonic() > deadline:
+            return groups
+        time.sleep(0.02)
+
+
+def test_summary_follows_registration_and_scores(client):
+    for vehicle in VEHICLES:
+        register(client, *vehicle)
+    fleet = summary(client, scored=0)['all']
+    assert (fleet['vehicles'], fleet['scored_vehicles'], fleet['soh_avg']) == (3, 0, None)
+
+    first = predict(client, 'user-a', 'ev-1', 'LFP', 20000)
+    second = predict(client, 'user-a', 'ev-2', 'NMC', 90000)
+    fleet = summary(client, scored=2)['all']
+    assert fleet['scored_vehicles'] == 2
+    assert fleet['soh_avg'] == pytest.approx((first['predicted_soh'] + second['predicted_soh']) / 2)
+    assert fleet['resale_value_usd'] == pytest.approx(first['resale_value_usd'] + second['resale_value_usd'], abs=0.01)
+    assert fleet['anomalies'] == first['anomaly_warning'] + second['anomaly_warning']
+
+    # A newer score replaces the vehicle's previous one rather than adding to it
+    response = client.post('/predict_batch', json=[
+        {'user_id': 'user-a', 'vehicle_id': 'ev-1', 'battery_type': 'LFP', 'total_dist_km': 150000,
+         'charging_time_min': 45},
+        {'user_id': 'user-b', 'vehicle_id': 'ev-3', 'battery_type': 'LFP', 'total_dist_km': 5000,
+         'charging_time_min': 45},
+    ])
+    assert response.status_code == 200
+    latest, third = response.json()['results']
+    assert latest['predicted_soh'] != first['predicted_soh']
+    by_type = summary(client, scored=3, group_by='battery_type')
+    assert by_type['LFP']['scored_vehicles'] == 2
+    assert by_type['LFP']['soh_avg'] == pytest.approx((latest['predicted_soh'] + third['predicted_soh']) / 2)
+    assert by_type['NMC']['soh_avg'] == pytest.approx(second['predicted_soh'])
+    user_b = summary(client, scored=1, user_id='user-b')['all']
+    assert (user_b['vehicles'], user_b['soh_avg']) == (1, pytest.approx(third['predicted_soh']))
+
+
+def test_summary_follows_vehicle_updates(client):
+    for vehicle in VEHICLES:
+        register(client, *vehicle)
+    scored = predict(client, 'user-a', 'ev-2', 'NMC', 60000)
+    assert summary(client, scored=1, group_by='battery_type')['NMC']['scored_vehicles'] == 1
+
+    # The vehicle moves to its new group together with its score
+    register(client, 'user-a', 'ev-2', 'LFP', '2019-02-01', path='/update_vehicle')
+    by_type = summary(client, scored=1, group_by='battery_type')
+    assert set(by_type) == {'LFP'}
+    assert (by_type['LFP']['vehicles'], by_type['LFP']['scored_vehicles']) == (3, 1)
+    assert by_type['LFP']['soh_avg'] == pytest.approx(scored['predicted_soh'])
+    assert by_type['LFP']['resale_value_usd'] == pytest.approx(scored['resale_value_usd'], abs=0.01)
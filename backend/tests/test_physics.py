@@ -0,0 +1,45 @@
+"""
+app.core.physics must reproduce the formulas /predict used before they
+were extracted into it.
+
+    cd backend
+    python -m pytest -q tests
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.core import physics  # noqa: E402
+
+
+def baseline_soc(charging_time_min):
+    """The per-request SOC estimate of the original /predict handler."""
+    start_soc = 20.0
+    charge_rate_per_min = 1.38
+    estimated_added_soc = charging_time_min * charge_rate_per_min
+    if (start_soc + estimated_added_soc) > 80:
+        excess_time = (estimated_added_soc - 60)
+        final_est_soc = 80 + (excess_time * 0.5)
+    else:
+        final_est_soc = start_soc + estimated_added_soc
+    return min(100.0, final_est_soc)
+
+
+@pytest.mark.skipif(bool(os.getenv("BATTERY_PACK_KWH") or os.getenv("CHARGE_POWER_KW")),
+                    reason="pack size/charging power overridden in the environment")
+def test_estimate_soc_matches_baseline():
+    minutes = np.concatenate([np.linspace(0, 120, 2401), [43.47826, 43.5, 86.9, 87.0, 600.0]])
+    expected = [baseline_soc(float(m)) for m in minutes]
+    # Same operations in the same order: equal, including where /predict rounds to one decimal
+    assert physics.estimate_soc(minutes).tolist() == expected
+
+
+def test_pack_and_power_derive_the_rate():
+    assert physics.charge_rate_per_min(None, None) == physics.CHARGE_RATE_PER_MIN
+    assert physics.charge_rate_per_min(60, 50) == pytest.approx(50 / 60 / 60 * 100)
+    assert physics.charge_rate_per_min(pack_kwh=100, charge_power_kw=None) == pytest.approx(50 / 60 / 100 * 100)
+    assert physics.estimate_soc(10, pack_kwh=100, charge_power_kw=100) == pytest.approx(20 + 10 * 100 / 60)
@@ -0,0 +1,272 @@
+"""
+Typed columnar copies of the training/evaluation CSVs.
+
+    python columnar.py convert data/ev_battery_data_with_km.csv data/student_data.csv
+    python columnar.py bench --rows 10000000
+
+`convert` reads a CSV once, renames the verbose headers (COLUMN_NAMES),
+stores string columns as categoricals and numeric columns as float32 (or
+the smallest integer type), and writes `<name>.columns/` next to it: one
+.npy file per column plus schema.json. Readers memory-map only the columns
+they ask for, so loading costs no parsing and almost no copying. With
+--format parquet (needs pyarrow) `<name>.parquet` is written instead.
+
+read_table() / iter_chunks() take the CSV path the scripts always used and
+pick the columnar copy when there is an up-to-date one (same CSV size and
+mtime as at conversion, or no CSV at all), else fall back to the CSV.
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Verbose source headers -> the names the scripts use
+COLUMN_NAMES = {
+    'Battery Type': 'battery_type',
+    'Total KM Traveled (km)': 'total_dist_km',
+    'Charging Duration (min)': 'charging_time_min',
+    'Charging Cycles': 'charging_cycles',
+    'Efficiency (%)': 'efficiency',
+    'Battery Temp (°C)': 'battery_temp'
+}
+STORE_SUFFIX = '.columns'
+PARQUET_SUFFIX = '.parquet'
+SCHEMA = 'schema.json'
+CSV_CHUNK_SIZE = 1_000_000    # Rows per read_csv chunk during conversion
+
+
+def store_path(csv_path):
+    return os.path.splitext(csv_path)[0] + STORE_SUFFIX
+
+
+def parquet_path(csv_path):
+    return os.path.splitext(csv_path)[0] + PARQUET_SUFFIX
+
+
+def _stamp(path):
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _read_csv(path, columns=None, **kwargs):
+    """CSV with COLUMN_NAMES applied; `columns` (renamed names) limits what is parsed."""
+    usecols = None if columns is None else (lambda name: COLUMN_NAMES.get(name, name) in columns)
+    result = pd.read_csv(path, usecols=usecols, **kwargs)
+    if isinstance(result, pd.DataFrame):
+        return _select(result.rename(columns=COLUMN_NAMES), columns)
+    return (_select(chunk.rename(columns=COLUMN_NAMES), columns) for chunk in result)
+
+
+def _select(df, columns):
+    return df if columns is None else df[list(columns)]
+
+
+def _typed(df, float64=False):
+    """Categorical strings, float32 (or float64) floats, downcast integers."""
+    out = {}
+    for name, values in df.items():
+        if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+            if pd.api.types.is_integer_dtype(values):
+                out[name] = pd.to_numeric(values, downcast='integer')
+            else:
+                out[name] = values.astype(np.float64 if float64 else np.float32)
+        else:
+            out[name] = values.astype('category')
+    return pd.DataFrame(out)
+
+
+def convert(csv_path, out=None, fmt='columns', float64=False):
+    """Write the typed columnar copy of csv_path; returns its path."""
+    df = _typed(pd.concat(_read_csv(csv_path, chunksize=CSV_CHUNK_SIZE), ignore_index=True), float64)
+    if fmt == 'parquet':
+        out = out or parquet_path(csv_path)
+        df.to_parquet(out, index=False)   # requires pyarrow
+        return out
+
+    out = out or store_path(csv_path)
+    schema = {'rows': len(df), 'source': os.path.basename(csv_path), 'source_sha256': _sha256(csv_path),
+              'source_stamp': _stamp(csv_path), 'columns': []}
+    tmp = tempfile.mkdtemp(prefix='.columns-', dir=os.path.dirname(os.path.abspath(out)))
+    try:
+        for i, (name, values) in enumerate(df.items()):
+            entry = {'name': name, 'file': f'{i}.npy'}
+            if isinstance(values.dtype, pd.CategoricalDtype):
+                entry['categories'] = [str(c) for c in values.cat.categories]
+                values = values.cat.codes
+            np.save(os.path.join(tmp, entry['file']), values.to_numpy())
+            entry['dtype'] = str(values.dtype)
+            schema['columns'].append(entry)
+        with open(os.path.join(tmp, SCHEMA), 'w') as f:
+            json.dump(schema, f, indent=2)
+        if os.path.isdir(out):
+            shutil.rmtree(out)
+        os.replace(tmp, out)
+    except BaseException:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+    return out
+
+
+def read_schema(path):
+    with open(os.path.join(path, SCHEMA)) as f:
+        return json.load(f)
+
+
+def _fresh(recorded_stamp, csv_path):
+    return not os.path.exists(csv_path) or recorded_stamp == _stamp(csv_path)
+
+
+def resolve(csv_path):
+    """('columns' | 'parquet' | 'csv', path) that read_table() will read for csv_path."""
+    store = store_path(csv_path)
+    if os.path.exists(os.path.join(store, SCHEMA)):
+        if _fresh(read_schema(store)['source_stamp'], csv_path):
+            return 'columns', store
+        print(f"  {store} is older than {csv_path}; reading the CSV (re-run columnar.py convert)")
+    parquet = parquet_path(csv_path)
+    if os.path.exists(parquet) and (not os.path.exists(csv_path)
+                                    or os.stat(parquet).st_mtime_ns >= os.stat(csv_path).st_mtime_ns):
+        try:
+            import pyarrow  # noqa: F401
+            return 'parquet', parquet
+        except ImportError:
+            pass
+    return 'csv', csv_path
+
+
+def data_files(csv_path):
+    """Files identifying the data read_table() reads, for content hashes."""
+    kind, path = resolve(csv_path)
+    return [os.path.join(path, SCHEMA)] if kind == 'columns' else [path]
+
+
+def _store_frame(path, columns, start=0, stop=None):
+    """DataFrame over memory-mapped column files; no copy except categorical codes."""
+    schema = read_schema(path)
+    entries = {entry['name']: entry for entry in schema['columns']}
+    missing = [name for name in (columns or ()) if name not in entries]
+    if missing:
+        raise KeyError(f"{path} has no column(s) {missing}")
+    data = {}
+    for name in (columns or entries):
+        entry = entries[name]
+        values = np.load(os.path.join(path, entry['file']), mmap_mode='r')[start:stop]
+        if 'categories' in entry:
+            values = pd.Categorical.from_codes(values, categories=entry['categories'])
+        data[name] = values
+    return pd.DataFrame(data, copy=False)
+
+
+def read_table(csv_path, columns=None):
+    """The table behind csv_path with renamed headers, limited to `columns` when given."""
+    kind, path = resolve(csv_path)
+    if kind == 'columns':
+        return _store_frame(path, columns)
+    if kind == 'parquet':
+        return pd.read_parquet(path, columns=None if columns is None else list(columns))
+    return _read_csv(path, columns)
+
+
+def iter_chunks(csv_path, columns=None, chunksize=CSV_CHUNK_SIZE):
+    """read_table() in chunks of `chunksize` rows."""
+    kind, path = resolve(csv_path)
+    if kind == 'columns':
+        rows = read_schema(path)['rows']
+        for start in range(0, rows, chunksize):
+            yield _store_frame(path, columns, start, start + chunksize)
+    elif kind == 'parquet':
+        import pyarrow.parquet as pq
+        for batch in pq.ParquetFile(path).iter_batches(batch_size=chunksize, columns=columns):
+            yield batch.to_pandas()
+    else:
+        yield from _read_csv(path, columns, chunksize=chunksize)
+
+
+def _measure(fn):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = fn()
+    elapsed = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, {'seconds': round(elapsed, 3), 'peak_alloc_mb': round(peak / 2**20, 1)}
+
+
+def bench(rows, workdir, seed=0):
+    """Load time and allocations for pd.read_csv vs the columnar store on a synthetic Stage 1 CSV."""
+    rng = np.random.default_rng(seed)
+    os.makedirs(workdir, exist_ok=True)
+    csv_path = os.path.join(workdir, 'ev_battery_data_with_km.csv')
+    for start in range(0, rows, CSV_CHUNK_SIZE):
+        n = min(CSV_CHUNK_SIZE, rows - start)
+        pd.DataFrame({
+            'Battery Type': rng.choice(['LFP', 'NCM_Type1', 'NCM_Type2'], n),
+            'Total KM Traveled (km)': rng.uniform(0, 200000, n),
+            'Charging Duration (min)': rng.uniform(0, 120, n),
+            'Charging Cycles': rng.uniform(0, 1500, n),
+            'Efficiency (%)': rng.uniform(85, 99, n),
+            'Battery Temp (°C)': rng.uniform(15, 45, n),
+        }).to_csv(csv_path, mode='w' if start == 0 else 'a', header=start == 0, index=False)
+    store, convert_stats = _measure(lambda: convert(csv_path))
+    stage1 = ['battery_type', 'total_dist_km', 'charging_time_min', 'charging_cycles', 'efficiency', 'battery_temp']
+    numeric = stage1[1:]
+
+    def scan(df):
+        # Touch every value so memory-mapped pages are actually read
+        return float(sum(df[name].to_numpy(dtype=np.float64).sum() for name in numeric))
+
+    report = {'rows': rows, 'csv_mb': round(os.path.getsize(csv_path) / 2**20, 1),
+              'store_mb': round(sum(os.path.getsize(os.path.join(store, f)) for f in os.listdir(store)) / 2**20, 1),
+              'convert': convert_stats}
+    csv_df, report['read_csv'] = _measure(lambda: pd.read_csv(csv_path).rename(columns=COLUMN_NAMES))
+    report['read_csv']['frame_mb'] = round(csv_df.memory_usage(deep=True).sum() / 2**20, 1)
+    report['read_csv']['scan_seconds'] = _measure(lambda: scan(csv_df))[1]['seconds']
+    del csv_df
+    store_df, report['read_table'] = _measure(lambda: read_table(csv_path, stage1))
+    report['read_table']['frame_mb'] = round(store_df.memory_usage(deep=True).sum() / 2**20, 1)
+    report['read_table']['scan_seconds'] = _measure(lambda: scan(store_df))[1]['seconds']
+    _, report['read_table_2_columns'] = _measure(lambda: read_table(csv_path, ['battery_type', 'total_dist_km']))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    conv = commands.add_parser('convert', help="Write the columnar copy of each CSV next to it.")
+    conv.add_argument('csv', nargs='+')
+    conv.add_argument('--format', choices=['columns', 'parquet'], default='columns')
+    conv.add_argument('--float64', action='store_true', help="Keep float64 numerics (bit-exact with the CSV parse).")
+    timing = commands.add_parser('bench', help="Compare pd.read_csv with the columnar store.")
+    timing.add_argument('--rows', type=int, default=10_000_000)
+    timing.add_argument('--dir', help="Working directory (default: a temporary one, removed afterwards).")
+    args = parser.parse_args()
+
+    if args.command == 'convert':
+        for csv_path in args.csv:
+            start = time.perf_counter()
+            out = convert(csv_path, fmt=args.format, float64=args.float64)
+            print(f"{csv_path} -> {out} ({time.perf_counter() - start:.1f}s)")
+    elif args.dir:
+        print(json.dumps(bench(args.rows, args.dir), indent=2))
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            print(json.dumps(bench(args.rows, workdir), indent=2))
+
+
+if __name__ == "__main__":
+    main()
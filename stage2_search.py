@@ -0,0 +1,211 @@
+"""
+Successive-halving hyperparameter search for the Stage 2 SOH regressor.
+
+    python train_student_model.py --search [--search-space space.json] [--cv 5] [--search-candidates 60]
+
+Candidates are sampled from a per-model parameter space (SEARCH_SPACE, or
+a JSON file with the same shape: estimator class name -> {param: [values]})
+and ranked by k-fold CV R2 with HalvingGridSearchCV. Every candidate starts
+on a small subsample of the training split. After each round only the best
+1/SEARCH_FACTOR go on, with SEARCH_FACTOR times more rows, so poor
+configurations are dropped after a few cheap fits. Fits run across all
+cores on the already preprocessed matrix, with the cached Stage 1 latent
+features, so folds re-fit only the regressor.
+
+The LEADERBOARD_TOP finalists are refit single-threaded, the way they are
+served, and scored on the held-out split. The leaderboard reports their
+accuracy next to fit time, batch and single-row predict latency, and size.
+Only regressors that export_compiled_model can flatten for the backend
+are searched (SEARCH_ESTIMATORS).
+"""
+import json
+import math
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.base import clone
+from sklearn.ensemble import ExtraTreesRegressor, GradientBoostingRegressor, RandomForestRegressor
+from sklearn.experimental import enable_halving_search_cv  # noqa: F401
+from sklearn.linear_model import LinearRegression, Ridge
+from sklearn.metrics import mean_absolute_error, mean_squared_error, r2_score
+from sklearn.model_selection import HalvingGridSearchCV, KFold, ParameterGrid, ParameterSampler
+from sklearn.pipeline import Pipeline
+
+# Regressors the search may use: the ones export_compiled_model can compile
+SEARCH_ESTIMATORS = {
+    'LinearRegression': LinearRegression,
+    'Ridge': Ridge,
+    'RandomForestRegressor': lambda: RandomForestRegressor(random_state=42),
+    'ExtraTreesRegressor': lambda: ExtraTreesRegressor(random_state=42),
+    'GradientBoostingRegressor': lambda: GradientBoostingRegressor(random_state=42),
+}
+SEARCH_SPACE = {
+    'LinearRegression': {},
+    'Ridge': {'alpha': [0.01, 0.1, 1.0, 10.0, 100.0, 1000.0]},
+    'RandomForestRegressor': {
+        'n_estimators': [50, 100, 200],
+        'max_depth': [4, 6, 8, 12, None],
+        'min_samples_leaf': [1, 5, 20, 50],
+        'max_features': [1.0, 0.5, 'sqrt'],
+    },
+    'ExtraTreesRegressor': {
+        'n_estimators': [50, 100, 200],
+        'max_depth': [4, 6, 8, 12, None],
+        'min_samples_leaf': [1, 5, 20, 50],
+        'max_features': [1.0, 0.5, 'sqrt'],
+    },
+    'GradientBoostingRegressor': {
+        'n_estimators': [50, 100, 200, 400],
+        'learning_rate': [0.01, 0.03, 0.1, 0.3],
+        'max_depth': [2, 3, 4, 5],
+        'subsample': [0.7, 1.0],
+        'min_samples_leaf': [1, 10, 50],
+    },
+}
+SEARCH_CANDIDATES = 60  # Sampled configurations, split evenly between the models
+SEARCH_FACTOR = 3       # Survivors per round = 1/factor, rows per fit x factor
+CV_FOLDS = 5
+LEADERBOARD_TOP = 5     # Finalists refit and scored on the held-out split
+LATENCY_REPEATS = 50    # Single-row predictions timed per finalist
+
+
+def load_space(path=None):
+    """SEARCH_SPACE, or the JSON file at path (estimator name -> {param: [values]})."""
+    if path is None:
+        return SEARCH_SPACE
+    with open(path) as f:
+        space = json.load(f)
+    unknown = sorted(set(space) - set(SEARCH_ESTIMATORS))
+    if unknown:
+        raise ValueError(f"Unknown estimator(s) {unknown}; choose from {sorted(SEARCH_ESTIMATORS)}")
+    return space
+
+
+def sample_candidates(space, n_candidates=SEARCH_CANDIDATES, seed=42):
+    """
+    One single-point grid per sampled configuration, for HalvingGridSearchCV.
+    Each model gets an equal share, sampled without replacement (all of its
+    grid when smaller); the unused share of small grids goes to the others.
+    """
+    sizes = {name: len(ParameterGrid(params)) for name, params in space.items()}
+    quota = dict.fromkeys(space, 0)
+    remaining = n_candidates
+    # Hand out the budget round-robin until every grid is exhausted or nothing is left
+    while remaining > 0 and any(quota[name] < sizes[name] for name in space):
+        open_models = [name for name in space if quota[name] < sizes[name]]
+        share = max(1, remaining // len(open_models))
+        for name in open_models:
+            take = min(share, sizes[name] - quota[name], remaining)
+            quota[name] += take
+            remaining -= take
+
+    grids = []
+    for name, params in space.items():
+        for sampled in ParameterSampler(params, n_iter=quota[name], random_state=seed):
+            grid = {'regressor': [SEARCH_ESTIMATORS[name]()]}
+            grid.update({f'regressor__{key}': [value] for key, value in sampled.items()})
+            grids.append(grid)
+    return grids
+
+
+def _describe(params):
+    """(model name, JSON of its searched hyperparameters) for one cv_results_ params entry."""
+    name = type(params['regressor']).__name__
+    hyper = {key.split('__', 1)[1]: value for key, value in params.items() if key != 'regressor'}
+    return name, json.dumps(hyper, sort_keys=True, default=str)
+
+
+def _size(regressor):
+    """Tree nodes of a fitted ensemble (0 for linear models), a proxy for serving cost."""
+    estimators = getattr(regressor, 'estimators_', None)
+    if estimators is None:
+        return 0
+    return int(sum(est.tree_.node_count for est in np.ravel(estimators)))
+
+
+def _holdout(regressor, X_train, y_train, X_test, y_test):
+    start = time.perf_counter()
+    regressor.fit(X_train, y_train)
+    fit_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    y_pred = regressor.predict(X_test)
+    batch_time = time.perf_counter() - start
+    X_row = X_test[:1]
+    timings = []
+    for _ in range(LATENCY_REPEATS):
+        t0 = time.perf_counter()
+        regressor.predict(X_row)
+        timings.append(time.perf_counter() - t0)
+
+    return regressor, {
+        'Holdout R2': r2_score(y_test, y_pred),
+        'Holdout RMSE': np.sqrt(mean_squared_error(y_test, y_pred)),
+        'Holdout MAE': mean_absolute_error(y_test, y_pred),
+        'Fit Time (s)': fit_time,
+        'Batch Predict (us/row)': batch_time / len(X_test) * 1e6,
+        'Single-row Latency (ms)': np.median(timings) * 1e3,
+        'Tree Nodes': _size(regressor),
+    }
+
+
+def search(X_train, y_train, X_test, y_test, space=None, n_candidates=SEARCH_CANDIDATES,
+           cv=CV_FOLDS, factor=SEARCH_FACTOR, top=LEADERBOARD_TOP, n_jobs=-1, seed=42):
+    """
+    Run the halving search on the (preprocessed) training split, refit the
+    `top` finalists and score them on the test split.
+    Returns (best fitted regressor, leaderboard DataFrame best first).
+    The best is the finalist with the highest CV R2.
+    """
+    grids = sample_candidates(space or SEARCH_SPACE, n_candidates, seed)
+    folds = KFold(n_splits=cv, shuffle=True, random_state=seed)
+    # Rows of the first round: enough for every fold to fit, and the last round uses all rows
+    rounds = 1 + math.floor(math.log(len(grids), factor))
+    min_resources = max(cv * 20, len(X_train) // factor ** (rounds - 1))
+    print(f"Searching {len(grids)} Stage 2 candidates: {cv}-fold CV, halving by {factor} "
+          f"from {min(min_resources, len(X_train))} rows")
+
+    halving = HalvingGridSearchCV(
+        Pipeline([('regressor', LinearRegression())]), grids, factor=factor, cv=folds, scoring='r2',
+        min_resources=min(min_resources, len(X_train)), refit=False, n_jobs=n_jobs, random_state=seed,
+    )
+    start = time.perf_counter()
+    halving.fit(X_train, y_train)
+    print(f"  {halving.n_iterations_} rounds, {len(halving.cv_results_['params'])} fits of "
+          f"{cv} folds in {time.perf_counter() - start:.1f}s")
+
+    # Each candidate's last (largest) round
+    results = pd.DataFrame(halving.cv_results_)
+    results['candidate'] = [json.dumps(_describe(p)) for p in results['params']]
+    last = results.sort_values('iter').groupby('candidate', sort=False).tail(1)
+    last = last.sort_values(['iter', 'mean_test_score'], ascending=False).reset_index(drop=True)
+
+    rows = []
+    for i, entry in last.iterrows():
+        name, hyper = _describe(entry['params'])
+        rows.append({
+            'Rank': i + 1,
+            'Model': name,
+            'Params': hyper,
+            'Rounds': int(entry['iter']) + 1,
+            'Samples': int(entry['n_resources']),
+            'CV R2': entry['mean_test_score'],
+            'CV R2 Std': entry['std_test_score'],
+            'CV Fit Time (s)': entry['mean_fit_time'],
+            'CV Predict (us/row)': entry['mean_score_time'] / (entry['n_resources'] / cv) * 1e6,
+        })
+
+    best = None
+    for i in range(min(top, len(last))):
+        params = last.loc[i, 'params']
+        regressor = clone(params['regressor']).set_params(
+            **{key.split('__', 1)[1]: value for key, value in params.items() if key != 'regressor'})
+        regressor, metrics = _holdout(regressor, X_train, y_train, X_test, y_test)
+        rows[i].update(metrics)
+        if best is None:
+            best = regressor
+        print(f"  #{i + 1} {rows[i]['Model']} {rows[i]['Params']} | CV R2: {rows[i]['CV R2']:.4f} | "
+              f"holdout R2: {metrics['Holdout R2']:.4f} | fit {metrics['Fit Time (s)']:.2f}s | "
+              f"single-row {metrics['Single-row Latency (ms)']:.2f} ms")
+    return best, pd.DataFrame(rows)
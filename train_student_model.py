@@ -2,116 +2,401 @@
 import pandas as pd
 import numpy as np
 from sklearn.model_selection import train_test_split
-from sklearn.ensemble import RandomForestRegressor, GradientBoostingRegressor
-from sklearn.linear_model import LinearRegression
+from sklearn.ensemble import ExtraTreesRegressor, RandomForestRegressor, GradientBoostingRegressor
+from sklearn.linear_model import LinearRegression, Ridge
 from sklearn.metrics import mean_squared_error, r2_score, mean_absolute_error
 from sklearn.preprocessing import StandardScaler, OneHotEncoder
-from sklearn.compose import ColumnTransformer
+from sklearn.compose import ColumnTransformer, TransformedTargetRegressor
 from sklearn.pipeline import Pipeline
+from sklearn.base import clone
+import sklearn
 import joblib
+from joblib import Parallel, delayed
+import argparse
+import glob
+import hashlib
+import json
 import os
+import sys
+import time
 import matplotlib.pyplot as plt
 import seaborn as sns
 
+import columnar
+import stage2_search
+
+# Feature layout shared with the serving path (backend/app/core/features.py)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'backend'))
+from app.core.compiled import unpack
+from app.core.features import BASE_COLUMNS, LATENT_FEATURES, NUMERIC_COLUMNS, STAGE2_COLUMNS, FeatureFrame
+
 # Configuration
 DATA_PATH_ORIGINAL = 'data/ev_battery_data_with_km.csv'  # Ground truth for Stage 1
 DATA_PATH_STUDENT = 'data/student_data.csv'            # Dataset for Stage 2
 MODELS_DIR = 'models'
+CACHE_DIR = os.path.join(MODELS_DIR, '.cache')  # Fitted stages keyed by content hash
+N_JOBS = -1                                     # Cores used for training (-1 = all)
+SEARCH_LEADERBOARD = 'stage2_leaderboard.csv'   # Written by --search
 os.makedirs(MODELS_DIR, exist_ok=True)
 
+STAGE1_TARGETS = LATENT_FEATURES
+# Columns read from each dataset (headers as renamed by columnar.COLUMN_NAMES)
+STAGE1_COLUMNS = BASE_COLUMNS + STAGE1_TARGETS
+STUDENT_COLUMNS = BASE_COLUMNS + ['SOH_teacher']
+STAGE1_REGRESSOR = RandomForestRegressor(n_estimators=100, random_state=42)
+# Multi-output mode: one forest predicts all STAGE1_TARGETS, saved as stage1_multi.pkl.
+# Targets are standardized so no single latent feature dominates the split criterion.
+STAGE1_MULTI = 'multi'
+STAGE1_MULTI_REGRESSOR = TransformedTargetRegressor(
+    regressor=RandomForestRegressor(n_estimators=100, random_state=42),
+    transformer=StandardScaler()
+)
+
+def stage2_candidates():
+    """Stage 2 regressors compared on the held-out split."""
+    return {
+        'Linear Regression': LinearRegression(),
+        'Random Forest': RandomForestRegressor(n_estimators=100, random_state=42),
+        'Gradient Boosting': GradientBoostingRegressor(n_estimators=100, random_state=42)
+    }
+
+def content_hash(paths, params):
+    """SHA-256 of the input files' bytes, the hyperparameters and the sklearn version."""
+    digest = hashlib.sha256()
+    for path in paths:
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    digest.update(json.dumps(params, sort_keys=True, default=str).encode())
+    digest.update(sklearn.__version__.encode())
+    return digest.hexdigest()
+
+def load_cached(stage, key):
+    if not key:
+        return None
+    path = os.path.join(CACHE_DIR, f'{stage}-{key[:16]}.joblib')
+    if os.path.exists(path):
+        print(f"  {stage}: inputs unchanged, loading from cache ({os.path.basename(path)})")
+        return joblib.load(path)
+    return None
+
+def save_cached(stage, key, payload):
+    if key:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        joblib.dump(payload, os.path.join(CACHE_DIR, f'{stage}-{key[:16]}.joblib'))
+
+def split_jobs(n_tasks, n_jobs):
+    """Split n_jobs cores into (parallel tasks, cores per task's estimator)."""
+    cores = joblib.cpu_count() if n_jobs in (None, -1) else n_jobs
+    outer = max(1, min(n_tasks, cores))
+    return outer, max(1, cores // outer)
+
+def _set_n_jobs(regressor, n_jobs):
+    if isinstance(regressor, TransformedTargetRegressor):
+        for est in (regressor.regressor, getattr(regressor, 'regressor_', None)):
+            if est is not None:
+                _set_n_jobs(est, n_jobs)
+    elif 'n_jobs' in regressor.get_params():
+        regressor.set_params(n_jobs=n_jobs)
+
+def _fit_regressor(regressor, X, y, inner_jobs):
+    _set_n_jobs(regressor, inner_jobs)
+    regressor.fit(X, y)
+    # Serve single-threaded: per-request joblib dispatch costs more than it saves
+    _set_n_jobs(regressor, None)
+    return regressor
+
+def predict_latent(stage1_models, X):
+    """Latent feature name -> predictions, for separate or multi-output Stage 1 models."""
+    if STAGE1_MULTI in stage1_models:
+        preds = stage1_models[STAGE1_MULTI].predict(X)
+        return {target: preds[:, i] for i, target in enumerate(STAGE1_TARGETS)}
+    return {target: model.predict(X) for target, model in stage1_models.items()}
+
+def stage1_preprocessor():
+    return ColumnTransformer(
+        transformers=[
+            ('num', StandardScaler(), ['total_dist_km', 'charging_time_min']),
+            ('cat', OneHotEncoder(handle_unknown='ignore', sparse_output=False), ['battery_type'])
+        ])
+
 def load_data():
-    """Load both datasets."""
+    """Load both datasets, from their columnar copies when converted (see columnar.py)."""
     print("Loading datasets...")
-    df_orig = pd.read_csv(DATA_PATH_ORIGINAL)
-    df_student = pd.read_csv(DATA_PATH_STUDENT)
-    
-    # Rename columns for consistency if needed
-    # df_orig columns: ['Battery Type', 'Total KM Traveled (km)', 'Charging Duration (min)', 'Charging Cycles', 'Efficiency (%)', 'Battery Temp (°C)']
-    # df_student columns: ['battery_type', 'total_dist_km', 'charging_time_min', 'SOH_teacher']
-    
-    # Standardize column names for processing
-    df_orig.rename(columns={
-        'Battery Type': 'battery_type',
-        'Total KM Traveled (km)': 'total_dist_km',
-        'Charging Duration (min)': 'charging_time_min',
-        'Charging Cycles': 'charging_cycles',
-        'Efficiency (%)': 'efficiency',
-        'Battery Temp (°C)': 'battery_temp'
-    }, inplace=True)
-    
+    df_orig = columnar.read_table(DATA_PATH_ORIGINAL, STAGE1_COLUMNS)
+    df_student = columnar.read_table(DATA_PATH_STUDENT, STUDENT_COLUMNS)
     return df_orig, df_student
 
-def train_stage_1(df_orig):
+def export_compiled_model(pipeline, path):
+    """
+    Flatten a fitted Pipeline(ColumnTransformer, regressor) into packed NumPy
+    arrays for the backend's native inference engine (app/core/compiled.py):
+    scaler mean/scale, the one-hot category index and every tree's nodes
+    concatenated into single left/right/feature/threshold/value arrays.
+    The .npz is then unpacked into <stem>.arrays, replacing the copy the
+    backend memory-maps.
+    """
+    preprocessor = pipeline.named_steps['preprocessor']
+    regressor = pipeline.named_steps['regressor']
+
+    arrays = {'num_columns': np.array([], dtype=str), 'cat_columns': np.array([], dtype=str),
+              'scaler_mean': np.array([]), 'scaler_scale': np.array([])}
+    for name, transformer, columns in preprocessor.transformers_:
+        if transformer == 'drop':
+            continue
+        if isinstance(transformer, StandardScaler):
+            assert len(arrays['cat_columns']) == 0, "numeric columns must come before categoricals"
+            arrays['num_columns'] = np.array(columns, dtype=str)
+            arrays['scaler_mean'] = transformer.mean_
+            arrays['scaler_scale'] = transformer.scale_
+        elif isinstance(transformer, OneHotEncoder):
+            arrays['cat_columns'] = np.array(columns, dtype=str)
+            for i, categories in enumerate(transformer.categories_):
+                arrays[f'cat_categories_{i}'] = np.array(categories, dtype=str)
+        else:
+            raise ValueError(f"Cannot compile transformer '{name}': {transformer!r}")
+
+    if isinstance(regressor, TransformedTargetRegressor):
+        # Predictions are mapped back with y * scale + mean, as StandardScaler.inverse_transform
+        arrays['target_mean'] = regressor.transformer_.mean_
+        arrays['target_scale'] = regressor.transformer_.scale_
+        regressor = regressor.regressor_
+
+    if isinstance(regressor, (LinearRegression, Ridge)):
+        arrays['kind'] = np.array('linear')
+        arrays['coef'] = np.atleast_2d(regressor.coef_)
+        arrays['intercept'] = np.atleast_1d(regressor.intercept_)
+    else:
+        if isinstance(regressor, GradientBoostingRegressor):
+            trees = [est.tree_ for est in regressor.estimators_[:, 0]]
+            arrays['kind'] = np.array('boosting')
+            arrays['base'] = np.atleast_1d(regressor.init_.constant_).ravel().astype(float)
+            arrays['learning_rate'] = np.array(regressor.learning_rate)
+        elif isinstance(regressor, (RandomForestRegressor, ExtraTreesRegressor)):
+            trees = [est.tree_ for est in regressor.estimators_]
+            arrays['kind'] = np.array('forest')
+            arrays['base'] = np.zeros(regressor.n_outputs_)
+            arrays['learning_rate'] = np.array(1.0)
+        else:
+            raise ValueError(f"Cannot compile regressor: {regressor!r}")
+
+        left, right, feature, threshold, value, roots = [], [], [], [], [], []
+        offset = 0
+        for tree in trees:
+            ids = np.arange(tree.node_count) + offset
+            is_leaf = tree.children_left == -1
+            # Leaves point to themselves so every tree can be walked a fixed number of steps
+            left.append(np.where(is_leaf, ids, tree.children_left + offset))
+            right.append(np.where(is_leaf, ids, tree.children_right + offset))
+            feature.append(np.where(is_leaf, 0, tree.feature))
+            threshold.append(np.where(is_leaf, np.inf, tree.threshold))
+            value.append(tree.value[:, :, 0])
+            roots.append(offset)
+            offset += tree.node_count
+
+        arrays['left'] = np.concatenate(left).astype(np.int64)
+        arrays['right'] = np.concatenate(right).astype(np.int64)
+        arrays['feature'] = np.concatenate(feature).astype(np.int64)
+        arrays['threshold'] = np.concatenate(threshold).astype(np.float64)
+        arrays['value'] = np.concatenate(value).astype(np.float64)
+        arrays['roots'] = np.array(roots, dtype=np.int64)
+        arrays['max_depth'] = np.array(max(tree.max_depth for tree in trees))
+
+    np.savez(path, **arrays)
+    # Replace the memory-mapped copy the backend serves, which is otherwise stale
+    unpack(path)
+    print(f"  Compiled model exported to {path} (+ {os.path.splitext(path)[0]}.arrays)")
+
+def export_all_models(models_dir=MODELS_DIR):
+    """Export the compiled sidecar for every pickled pipeline in models_dir."""
+    for path in sorted(glob.glob(os.path.join(models_dir, 'stage*.pkl'))):
+        export_compiled_model(joblib.load(path), os.path.splitext(path)[0] + '.npz')
+
+def train_stage_1(df_orig, n_jobs=N_JOBS, cache_key=None, report_train_r2=False):
     """
     Train Stage 1 models on the ORIGINAL dataset (which has the sensors).
     Inputs: battery_type, total_dist_km, charging_time_min
     Outputs: charging_cycles, efficiency, battery_temp (Latent Features)
+
+    The shared preprocessor is fitted once and the three targets are fitted
+    in parallel. With a cache_key, unchanged inputs are loaded from CACHE_DIR.
     """
     print("\n--- Phase 2, Step 2: Training Stage 1 (Latent Feature Estimation) ---")
-    
-    # Inputs for Stage 1
-    X = df_orig[['battery_type', 'total_dist_km', 'charging_time_min']]
-    
-    # Targets for Stage 1 (Virtual Sensors)
-    targets = ['charging_cycles', 'efficiency', 'battery_temp']
-    
-    # Preprocessing pipeline
-    preprocessor = ColumnTransformer(
-        transformers=[
-            ('num', StandardScaler(), ['total_dist_km', 'charging_time_min']),
-            ('cat', OneHotEncoder(handle_unknown='ignore', sparse_output=False), ['battery_type'])
-        ])
-    
-    stage1_models = {}
-    
-    for target in targets:
-        y = df_orig[target]
-        print(f"Training Stage 1 model for: {target}")
-        
-        # Using Random Forest as per plan
-        model = Pipeline(steps=[
-            ('preprocessor', preprocessor),
-            ('regressor', RandomForestRegressor(n_estimators=100, random_state=42))
-        ])
-        
-        model.fit(X, y)
-        stage1_models[target] = model
-        
-        # Simple evaluation on training set (since this is just for creating features)
-        y_pred = model.predict(X)
-        print(f"  {target} R2: {r2_score(y, y_pred):.4f}")
-        
+
+    stage1_models = load_cached('stage1', cache_key)
+    if stage1_models is None:
+        # Inputs for Stage 1
+        X = df_orig[['battery_type', 'total_dist_km', 'charging_time_min']]
+
+        # Preprocessing pipeline, identical for every target so fitted once
+        preprocessor = stage1_preprocessor()
+        X_t = preprocessor.fit_transform(X)
+
+        # Using Random Forest as per plan, one per target (Virtual Sensors)
+        print(f"Training Stage 1 models for: {', '.join(STAGE1_TARGETS)}")
+        outer, inner = split_jobs(len(STAGE1_TARGETS), n_jobs)
+        regressors = Parallel(n_jobs=outer)(
+            delayed(_fit_regressor)(clone(STAGE1_REGRESSOR), X_t, df_orig[target], inner)
+            for target in STAGE1_TARGETS
+        )
+
+        stage1_models = {}
+        for target, regressor in zip(STAGE1_TARGETS, regressors):
+            stage1_models[target] = Pipeline(steps=[
+                ('preprocessor', preprocessor),
+                ('regressor', regressor)
+            ])
+            if report_train_r2:
+                # Simple evaluation on training set (since this is just for creating features)
+                print(f"  {target} R2: {r2_score(df_orig[target], regressor.predict(X_t)):.4f}")
+        save_cached('stage1', cache_key, stage1_models)
+
+    for target, model in stage1_models.items():
         # Save model
         joblib.dump(model, os.path.join(MODELS_DIR, f'stage1_{target}.pkl'))
-        
+        export_compiled_model(model, os.path.join(MODELS_DIR, f'stage1_{target}.npz'))
+
     return stage1_models
 
-def train_stage_2(df_student, stage1_models):
+def train_stage_1_multi(df_orig, n_jobs=N_JOBS, cache_key=None):
+    """
+    Multi-output alternative to train_stage_1: a single forest predicts
+    charging_cycles, efficiency and battery_temp in one pass, so inference
+    runs the preprocessor once and walks 100 trees instead of 300.
+    """
+    print("\n--- Phase 2, Step 2: Training Stage 1 (Latent Feature Estimation, multi-output) ---")
+
+    model = load_cached('stage1_multi', cache_key)
+    if model is None:
+        X = df_orig[['battery_type', 'total_dist_km', 'charging_time_min']]
+        model = Pipeline(steps=[
+            ('preprocessor', stage1_preprocessor()),
+            ('regressor', clone(STAGE1_MULTI_REGRESSOR))
+        ])
+        _set_n_jobs(model.named_steps['regressor'], split_jobs(1, n_jobs)[1])
+        model.fit(X, df_orig[STAGE1_TARGETS])
+        _set_n_jobs(model.named_steps['regressor'], None)
+        save_cached('stage1_multi', cache_key, model)
+
+    joblib.dump(model, os.path.join(MODELS_DIR, 'stage1_multi.pkl'))
+    export_compiled_model(model, os.path.join(MODELS_DIR, 'stage1_multi.npz'))
+    return {STAGE1_MULTI: model}
+
+def compare_stage1(df_orig, n_jobs=N_JOBS, output_path='stage1_comparison.csv'):
+    """
+    Accuracy/latency report: three separate forests vs one multi-output forest,
+    both fitted on the same 80% split and scored on the held-out 20%.
+    """
+    print("\n--- Stage 1 comparison: separate vs multi-output ---")
+    X = df_orig[['battery_type', 'total_dist_km', 'charging_time_min']]
+    X_train, X_test, y_train, y_test = train_test_split(X, df_orig[STAGE1_TARGETS], test_size=0.2, random_state=42)
+    outer, inner = split_jobs(len(STAGE1_TARGETS), n_jobs)
+
+    setups = {}
+    start = time.perf_counter()
+    preprocessor = stage1_preprocessor()
+    X_train_t = preprocessor.fit_transform(X_train)
+    regressors = Parallel(n_jobs=outer)(
+        delayed(_fit_regressor)(clone(STAGE1_REGRESSOR), X_train_t, y_train[target], inner)
+        for target in STAGE1_TARGETS
+    )
+    setups['Separate (3 models)'] = (time.perf_counter() - start, {
+        target: Pipeline(steps=[('preprocessor', preprocessor), ('regressor', regressor)])
+        for target, regressor in zip(STAGE1_TARGETS, regressors)
+    })
+
+    start = time.perf_counter()
+    multi = Pipeline(steps=[('preprocessor', stage1_preprocessor()),
+                            ('regressor', clone(STAGE1_MULTI_REGRESSOR))])
+    # n_jobs lives on the forest, not the Pipeline, as in train_stage_1_multi
+    _set_n_jobs(multi.named_steps['regressor'], split_jobs(1, n_jobs)[1])
+    multi.fit(X_train, y_train)
+    _set_n_jobs(multi.named_steps['regressor'], None)
+    setups['Multi-output (1 model)'] = (time.perf_counter() - start, {STAGE1_MULTI: multi})
+
+    def count_nodes(model):
+        regressor = model.named_steps['regressor']
+        regressor = getattr(regressor, 'regressor_', regressor)
+        return sum(est.tree_.node_count for est in regressor.estimators_)
+
+    rows = []
+    X_row = X_test.iloc[:1]
+    for setup, (fit_time, stage1_models) in setups.items():
+        preds = predict_latent(stage1_models, X_test)
+
+        timings = []
+        for _ in range(20):
+            t0 = time.perf_counter()
+            predict_latent(stage1_models, X_row)
+            timings.append(time.perf_counter() - t0)
+        t0 = time.perf_counter()
+        predict_latent(stage1_models, X_test)
+        batch_time = time.perf_counter() - t0
+
+        for target in STAGE1_TARGETS:
+            y_true, y_pred = y_test[target], preds[target]
+            rows.append({
+                'Setup': setup,
+                'Target': target,
+                'R2': r2_score(y_true, y_pred),
+                'RMSE': np.sqrt(mean_squared_error(y_true, y_pred)),
+                'MAE': mean_absolute_error(y_true, y_pred),
+                'Fit Time (s)': fit_time,
+                'Single-row Latency (ms)': np.median(timings) * 1e3,
+                f'Batch Latency {len(X_test)} rows (ms)': batch_time * 1e3,
+                'Tree Nodes': sum(count_nodes(m) for m in stage1_models.values()),
+            })
+            print(f"  {setup} | {target} R2: {rows[-1]['R2']:.4f} | single-row {rows[-1]['Single-row Latency (ms)']:.2f} ms")
+
+    pd.DataFrame(rows).to_csv(output_path, index=False)
+    print(f"Stage 1 comparison saved to {output_path}")
+
+def _fit_candidate(name, regressor, X_train, y_train, X_test, y_test, inner_jobs):
+    regressor = _fit_regressor(regressor, X_train, y_train, inner_jobs)
+    y_pred = regressor.predict(X_test)
+    r2 = r2_score(y_test, y_pred)
+    rmse = np.sqrt(mean_squared_error(y_test, y_pred))
+    mae = mean_absolute_error(y_test, y_pred)
+    return name, regressor, {'Model': name, 'R2': r2, 'RMSE': rmse, 'MAE': mae}
+
+def train_stage_2(df_student, stage1_models, n_jobs=N_JOBS, cache_key=None, features_key=None, search=None):
     """
     Train Stage 2 model on the STUDENT dataset.
     1. Use Stage 1 models to predict latent features for summary dataset.
-    2. Train final SOH Estimator.
+    2. Train final SOH Estimator (candidate models fitted in parallel), or
+       with `search` (keyword arguments for stage2_search.search) pick it
+       by a halving CV search and write SEARCH_LEADERBOARD.
+    With a cache_key, unchanged inputs are loaded from CACHE_DIR; with a
+    features_key, so are the latent features (reused when only the
+    candidates or search settings change).
     """
     print("\n--- Phase 2, Step 2: Training Stage 2 (Final SOH Estimation) ---")
+
+    cached = load_cached('stage2', cache_key)
+    if cached is not None:
+        best_model, results, df_student_augmented = cached
+        joblib.dump(best_model, os.path.join(MODELS_DIR, 'stage2_soh_model.pkl'))
+        export_compiled_model(best_model, os.path.join(MODELS_DIR, 'stage2_soh_model.npz'))
+        return best_model, results, df_student_augmented
     
-    # 1. Generate Latent Features
-    print("Generating latent features for student dataset...")
-    X_student_base = df_student[['battery_type', 'total_dist_km', 'charging_time_min']]
-    
-    # Create a copy to avoid SettingWithCopy warnings
-    df_student_augmented = df_student.copy()
-    
-    for target, model in stage1_models.items():
-        df_student_augmented[f'pred_{target}'] = model.predict(X_student_base)
+    # 1. Generate Latent Features, written into the frame's preallocated columns
+    feature_cols = STAGE2_COLUMNS
+    target_col = 'SOH_teacher'
+    df_student_augmented = load_cached('stage2_features', features_key)
+    if df_student_augmented is None:
+        print("Generating latent features for student dataset...")
+        frame = FeatureFrame.from_frame(df_student)
+        X_student_base = frame.to_frame(BASE_COLUMNS)
+        
+        for target, preds in predict_latent(stage1_models, X_student_base).items():
+            frame.set_column(f'pred_{target}', preds)
+        df_student_augmented = frame.to_frame(feature_cols).assign(**{target_col: df_student[target_col].to_numpy()})
+        save_cached('stage2_features', features_key, df_student_augmented)
     
     # 2. Train Stage 2 Model
-    # Inputs: Original Inputs + Latent Features
+    # Inputs: Original Inputs + Latent Features (the serving FeatureFrame layout)
     # Target: SOH_teacher
     
-    feature_cols = ['battery_type', 'total_dist_km', 'charging_time_min', 
-                    'pred_charging_cycles', 'pred_efficiency', 'pred_battery_temp']
-    target_col = 'SOH_teacher'
-    
     # Filter 0 values in target if necessary (assuming 0 is missing/error based on analysis)
     # Keeping them for now unless they skew results massively, but usually 0 degradation is suspicious if other cols are non-zero.
     # User constraint: "Use ONLY provided datasets".
@@ -136,62 +421,116 @@ def train_stage_2(df_student, stage1_models):
     
     preprocessor = ColumnTransformer(
         transformers=[
-            ('num', StandardScaler(), ['total_dist_km', 'charging_time_min', 'pred_charging_cycles', 'pred_efficiency', 'pred_battery_temp']),
+            ('num', StandardScaler(), NUMERIC_COLUMNS),
             ('cat', OneHotEncoder(handle_unknown='ignore', sparse_output=False), ['battery_type'])
         ])
+    X_train_t = preprocessor.fit_transform(X_train)
+    X_test_t = preprocessor.transform(X_test)
     
-    # Define models to evaluate
-    models = {
-        'Linear Regression': LinearRegression(),
-        'Random Forest': RandomForestRegressor(n_estimators=100, random_state=42),
-        'Gradient Boosting': GradientBoostingRegressor(n_estimators=100, random_state=42)
-    }
-    
-    best_model = None
-    best_score = -np.inf
-    best_name = ""
-    
-    results = []
-    
-    for name, regressor in models.items():
-        pipeline = Pipeline(steps=[
-            ('preprocessor', preprocessor),
-            ('regressor', regressor)
-        ])
-        
-        pipeline.fit(X_train, y_train)
-        y_pred = pipeline.predict(X_test)
-        
-        r2 = r2_score(y_test, y_pred)
-        rmse = np.sqrt(mean_squared_error(y_test, y_pred))
-        mae = mean_absolute_error(y_test, y_pred)
-        
-        print(f"Model: {name} | R2: {r2:.4f} | RMSE: {rmse:.4f} | MAE: {mae:.4f}")
-        results.append({'Model': name, 'R2': r2, 'RMSE': rmse, 'MAE': mae})
-        
-        if r2 > best_score:
-            best_score = r2
-            best_model = pipeline
-            best_name = name
-            
-    print(f"\nBest Stage 2 Model: {best_name} (R2={best_score:.4f})")
+    if search is not None:
+        regressor, leaderboard = stage2_search.search(X_train_t, y_train, X_test_t, y_test, n_jobs=n_jobs, **search)
+        leaderboard.to_csv(SEARCH_LEADERBOARD, index=False)
+        print(f"Search leaderboard saved to {SEARCH_LEADERBOARD}")
+        finalists = leaderboard.dropna(subset=['Holdout R2'])
+        results = [{'Model': f"{row['Model']} #{row['Rank']}", 'R2': row['Holdout R2'],
+                    'RMSE': row['Holdout RMSE'], 'MAE': row['Holdout MAE']} for _, row in finalists.iterrows()]
+        best_model = Pipeline(steps=[('preprocessor', preprocessor), ('regressor', regressor)])
+        print(f"\nBest Stage 2 Model: {finalists.iloc[0]['Model']} {finalists.iloc[0]['Params']} "
+              f"(CV R2={finalists.iloc[0]['CV R2']:.4f}, holdout R2={finalists.iloc[0]['Holdout R2']:.4f})")
+    else:
+        # Define models to evaluate, fitted in parallel on the shared transformed split
+        models = stage2_candidates()
+        outer, inner = split_jobs(len(models), n_jobs)
+        fitted = Parallel(n_jobs=outer)(
+            delayed(_fit_candidate)(name, regressor, X_train_t, y_train, X_test_t, y_test, inner)
+            for name, regressor in models.items()
+        )
+
+        best_model = None
+        best_score = -np.inf
+        best_name = ""
+
+        results = []
+
+        for name, regressor, metrics in fitted:
+            print(f"Model: {name} | R2: {metrics['R2']:.4f} | RMSE: {metrics['RMSE']:.4f} | MAE: {metrics['MAE']:.4f}")
+            results.append(metrics)
+
+            if metrics['R2'] > best_score:
+                best_score = metrics['R2']
+                best_model = Pipeline(steps=[
+                    ('preprocessor', preprocessor),
+                    ('regressor', regressor)
+                ])
+                best_name = name
+
+        print(f"\nBest Stage 2 Model: {best_name} (R2={best_score:.4f})")
     
     # Save best model
     joblib.dump(best_model, os.path.join(MODELS_DIR, 'stage2_soh_model.pkl'))
+    export_compiled_model(best_model, os.path.join(MODELS_DIR, 'stage2_soh_model.npz'))
     
     # Save scaler/preprocessor separately if needed, but Pipeline handles it.
+    save_cached('stage2', cache_key, (best_model, results, df_student_augmented))
     
     return best_model, results, df_student_augmented
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train the Stage 1/Stage 2 student models.")
+    parser.add_argument('--export-only', action='store_true',
+                        help="Only re-export compiled .npz sidecars for the existing pickles.")
+    parser.add_argument('--jobs', type=int, default=N_JOBS, help="CPU cores to train on (-1 = all).")
+    parser.add_argument('--no-cache', action='store_true',
+                        help="Retrain every stage even if its inputs and hyperparameters are unchanged.")
+    parser.add_argument('--stage1-mode', choices=['separate', STAGE1_MULTI], default='separate',
+                        help="Train three Stage 1 forests or one multi-output forest (stage1_multi.pkl). "
+                             "The backend's STAGE1_MODE must match the mode Stage 2 was trained with.")
+    parser.add_argument('--compare-stage1', action='store_true',
+                        help="Write stage1_comparison.csv (separate vs multi-output accuracy and latency).")
+    parser.add_argument('--search', action='store_true',
+                        help=f"Pick Stage 2 by a successive-halving CV search (writes {SEARCH_LEADERBOARD}).")
+    parser.add_argument('--search-space', help="JSON file: estimator name -> {param: [values]} "
+                                               "(default: stage2_search.SEARCH_SPACE).")
+    parser.add_argument('--search-candidates', type=int, default=stage2_search.SEARCH_CANDIDATES)
+    parser.add_argument('--cv', type=int, default=stage2_search.CV_FOLDS, help="Folds of the search.")
+    parser.add_argument('--report-train-r2', action='store_true',
+                        help="Also print Stage 1 R2 on its training set (one extra full predict per target).")
+    args = parser.parse_args()
+
+    if args.export_only:
+        export_all_models()
+        raise SystemExit(0)
+
     # 1. Load Data
     df_orig, df_student = load_data()
     
+    search = None
+    if args.search:
+        search = {'space': stage2_search.load_space(args.search_space),
+                  'n_candidates': args.search_candidates, 'cv': args.cv}
+    
+    # Content hashes: a stage is reused when its data and hyperparameters are unchanged
+    stage1_key = stage2_key = features_key = None
+    if not args.no_cache:
+        stage1_regressor = STAGE1_MULTI_REGRESSOR if args.stage1_mode == STAGE1_MULTI else STAGE1_REGRESSOR
+        stage1_key = content_hash(columnar.data_files(DATA_PATH_ORIGINAL), {'targets': STAGE1_TARGETS, 'mode': args.stage1_mode,
+                                                         'regressor': stage1_regressor.get_params()})
+        features_key = content_hash(columnar.data_files(DATA_PATH_STUDENT), {'stage1': stage1_key})
+        stage2_key = content_hash(columnar.data_files(DATA_PATH_STUDENT), {'stage1': stage1_key, 'candidates': {
+            name: regressor.get_params() for name, regressor in stage2_candidates().items()}, 'search': search})
+
+    if args.compare_stage1:
+        compare_stage1(df_orig, args.jobs)
+
     # 2. Stage 1: Latent Feature Estimation
-    stage1_models = train_stage_1(df_orig)
+    if args.stage1_mode == STAGE1_MULTI:
+        stage1_models = train_stage_1_multi(df_orig, args.jobs, stage1_key)
+    else:
+        stage1_models = train_stage_1(df_orig, args.jobs, stage1_key, args.report_train_r2)
     
     # 3. Stage 2: Final Health Estimation
-    best_student_model, evaluation_results, df_augmented = train_stage_2(df_student, stage1_models)
+    best_student_model, evaluation_results, df_augmented = train_stage_2(df_student, stage1_models,
+                                                                         args.jobs, stage2_key, features_key, search)
     
     # 4. Save analysis results
     pd.DataFrame(evaluation_results).to_csv("features_evaluation.csv", index=False)